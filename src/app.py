@@ -8,6 +8,7 @@ import plotly.graph_objs as go
 import webbrowser
 from threading import Timer
 import requests
+from ring_buffer import PPGRingBuffer, RING_BUFFER_FILE_NAME
 
 
 
@@ -18,6 +19,7 @@ WAVELET_FEATURE_FILE_NAME = "wavelet_results.csv"
 NONLINEAR_FEATURE_FILE_NAME = "nonlinear_results.csv"
 FREQUENCY_FEATURE_FILE_NAME = "fft_results.csv"
 OUTPUT_FILE = "final_prediction.csv"
+WINDOW_SECONDS = 60
 
 # Khởi tạo Dash app
 app = dash.Dash(__name__)
@@ -94,6 +96,17 @@ def safe_read_csv(filename):
             return df
     return pd.DataFrame()
 
+# Mở bộ đệm vòng do predict.py ghi (mở lại khi predict.py chưa chạy)
+ring_buffer = None
+def read_signal_window(seconds=WINDOW_SECONDS):
+    global ring_buffer
+    if ring_buffer is None:
+        try:
+            ring_buffer = PPGRingBuffer.open(RING_BUFFER_FILE_NAME)
+        except (FileNotFoundError, ValueError):
+            return None
+    return ring_buffer.latest_window(seconds)
+
 # Callback cập nhật toàn bộ giao diện
 @app.callback(
     [
@@ -114,13 +127,15 @@ def safe_read_csv(filename):
     [Input('interval-component', 'n_intervals')]
 )
 def update_dashboard(n):
-    df = safe_read_csv(CSV_FILE_NAME)
+    window = read_signal_window()
 
     fig = go.Figure()
-    if not df.empty:
+    latest_ir_raw = 0
+    if window is not None and len(window[0]) > 0:
+        time_arr, ir_raw, ir_filtered = window
         fig.add_trace(go.Scatter(
-            x=df['Time (s)'],
-            y=df['IR Value filtered'],
+            x=time_arr,
+            y=ir_filtered,
             mode='lines',
             name='IR Filtered',
             line=dict(color='black'),
@@ -137,7 +152,7 @@ def update_dashboard(n):
             plot_bgcolor='white',     
             paper_bgcolor='white'
         )
-        latest_ir_raw = df['IR Value raw'].iloc[-1]
+        latest_ir_raw = ir_raw[-1]
         status = "⚠️ Please place your finger on the sensor." if latest_ir_raw < 50000 else ""
     else:
         fig = {}
@@ -154,7 +169,9 @@ def update_dashboard(n):
 
     if not prediction_df.empty and 'Final Prediction' in prediction_df.columns:
         latest_pred = prediction_df['Final Prediction'].iloc[-1]
-        if latest_ir_raw < 50000:
+        # predict.py ghi "Signal Quality" khác "ok" cho cửa sổ bị bỏ qua (không ngón tay, bão hòa, phẳng, ...)
+        latest_quality = prediction_df['Signal Quality'].iloc[-1] if 'Signal Quality' in prediction_df.columns else "ok"
+        if latest_ir_raw < 50000 or latest_quality != "ok":
             prediction_status = "⚠️ Not detected! Please place your finger on the sensor."
         else:
             if latest_pred == 0:
@@ -0,0 +1,209 @@
+import argparse
+import time
+import numpy as np
+
+from numpy.linalg import norm
+from sklearn.neighbors import NearestNeighbors
+
+from nonlinear import calculate_fnn, estimate_delay_ami, PhaseSpace, calculate_dfa
+from ppg_archive import read_recording
+
+# So sánh tốc độ và kết quả giữa cách tính cũ (vét cạn) và cách tính mới
+# trên các cửa sổ 60 giây lấy từ một bản ghi trong thư mục data/.
+
+DEFAULT_FILE = "data/data_04042025.csv"
+WINDOW_SECONDS = 60
+
+
+# Cách tính FNN cũ: vòng lặp Python O(M²) cho mỗi chiều nhúng
+def calculate_fnn_reference(signal, delay, max_dim, Rtol=10.0, Atol=None):
+    if Atol is None:
+        Atol = 2.0 * np.std(signal)
+
+    N = len(signal)
+    fnn_percentages = []
+
+    for d in range(1, max_dim + 1):
+        M = N - (d + 1) * delay
+        if M <= 0:
+            break
+
+        embedded_d = np.array([signal[i:i + d * delay:delay] for i in range(M)])
+        embedded_d1 = np.array([signal[i:i + (d + 1) * delay:delay] for i in range(M)])
+
+        false_nearest = 0
+        for i in range(M):
+            dists = np.linalg.norm(embedded_d - embedded_d[i], axis=1)
+            dists[i] = np.inf
+            nearest_idx = np.argmin(dists)
+
+            dist_d = dists[nearest_idx]
+            dist_d1 = np.linalg.norm(embedded_d1[i] - embedded_d1[nearest_idx])
+
+            if dist_d == 0:
+                continue
+
+            if dist_d1 / dist_d > Rtol or abs(signal[i + d * delay] - signal[nearest_idx + d * delay]) > Atol:
+                false_nearest += 1
+
+        fnn_percentages.append(false_nearest / M * 100)
+    return fnn_percentages
+
+
+# Cách tính cũ: mỗi hàm tự dựng chỉ mục láng giềng và lặp Python theo từng điểm
+def reconstruct_phase_space_reference(signal, delay, embedding_dimension):
+    n_points = len(signal) - (embedding_dimension - 1) * delay
+    return np.array([signal[i:i + embedding_dimension * delay:delay] for i in range(n_points)])
+
+
+def calculate_lyapunov_exponent_reference(phase_space, k=10):
+    nbrs = NearestNeighbors(n_neighbors=2).fit(phase_space)
+    distances, indices = nbrs.kneighbors(phase_space)
+    divergence = []
+    for i in range(1, len(phase_space)):
+        d0 = distances[i, 1]
+        if i + k < len(phase_space) and indices[i, 1] + k < len(phase_space):
+            d1 = norm(phase_space[i + k] - phase_space[indices[i, 1] + k])
+            if d0 > 0 and d1 > 0:
+                divergence.append(np.log(d1 / d0))
+    return np.mean(divergence) / k if divergence else 0
+
+
+def calculate_attractor_reconstruction_error_reference(phase_space, delay):
+    N = len(phase_space)
+    if N < 2:
+        return np.nan
+    indices = NearestNeighbors(n_neighbors=2).fit(phase_space).kneighbors(phase_space, return_distance=False)
+    errors = []
+    for i in range(N - delay):
+        neighbor_idx = indices[i, 1]
+        if neighbor_idx + delay < N:
+            original_next = phase_space[i + delay]
+            predicted_next = phase_space[neighbor_idx + delay]
+            errors.append(norm(original_next - predicted_next))
+    return np.mean(errors) if errors else np.nan
+
+
+# Cách tính DFA cũ: polyfit/polyval cho từng đoạn
+def calculate_dfa_reference(signal, scales=None):
+    if scales is None:
+        scales = [10, 20, 40, 80, 100]
+    flucts = []
+    for scale in scales:
+        segments = len(signal) // scale
+        reshaped = np.reshape(signal[:segments * scale], (segments, scale))
+        F = []
+        for segment in reshaped:
+            x = np.arange(scale)
+            trend = np.polyfit(x, segment, 1)
+            detrended = segment - np.polyval(trend, x)
+            F.append(np.sqrt(np.mean(detrended ** 2)))
+        flucts.append(np.mean(F))
+    log_scales = np.log(scales)
+    log_flucts = np.log(flucts)
+    coeffs = np.polyfit(log_scales, log_flucts, 1)
+    return coeffs[0]
+
+
+def load_windows(file_path, n_windows, window_seconds=WINDOW_SECONDS):
+    df = read_recording(file_path)
+    df = df.drop_duplicates(subset=["Time (s)"]).sort_values(by=["Time (s)"])
+    time_arr = np.array(df["Time (s)"])
+    ir_signal = np.array(df["IR Value filtered"])
+    fs = 1 / np.mean(np.diff(time_arr))
+    size = int(window_seconds * fs)
+    # Các cửa sổ rải đều trên toàn bản ghi
+    starts = np.linspace(0, len(ir_signal) - size, n_windows).astype(int)
+    return [ir_signal[s:s + size] for s in starts]
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def report(name, ref_seconds, new_seconds, identical=None, note=""):
+    if identical is not None:
+        note = "✅ trùng khớp" if identical else "❌ KHÁC"
+    print(f"{name:<12} cũ: {ref_seconds:8.3f} s/cửa sổ   mới: {new_seconds:8.4f} s/cửa sổ   "
+          f"nhanh hơn: {ref_seconds / new_seconds:7.1f}x   {note}")
+
+
+def benchmark_fnn(windows, delay, max_dim):
+    ref_total = new_total = 0.0
+    identical = True
+    for w in windows:
+        ref, t_ref = timed(calculate_fnn_reference, w, delay=delay, max_dim=max_dim)
+        new, t_new = timed(calculate_fnn, w, delay=delay, max_dim=max_dim)
+        ref_total += t_ref
+        new_total += t_new
+        identical &= ref == new
+    report("FNN", ref_total / len(windows), new_total / len(windows), identical)
+
+
+# AMI: ước lượng histogram khác ước lượng k-NN của sklearn nên chỉ so sánh độ trễ được chọn
+def benchmark_ami(windows, max_lag):
+    ref_total = new_total = 0.0
+    lags = []
+    for w in windows:
+        (ref_lag, _), t_ref = timed(estimate_delay_ami, w, max_lag, method="sklearn")
+        (new_lag, _), t_new = timed(estimate_delay_ami, w, max_lag, method="histogram")
+        ref_total += t_ref
+        new_total += t_new
+        lags.append(f"{ref_lag}/{new_lag}")
+    report("AMI", ref_total / len(windows), new_total / len(windows),
+           note=f"độ trễ sklearn/histogram: {', '.join(lags)}")
+
+
+def _phase_space_reference(signal, delay, dim):
+    phase_space = reconstruct_phase_space_reference(signal, delay, dim)
+    return (calculate_lyapunov_exponent_reference(phase_space),
+            calculate_attractor_reconstruction_error_reference(phase_space, delay))
+
+
+def _phase_space_new(signal, delay, dim):
+    phase_space = PhaseSpace.from_signal(signal, delay, dim)
+    return phase_space.lyapunov_exponent(), phase_space.reconstruction_error(delay)
+
+
+def benchmark_phase_space(windows, delay, dim):
+    ref_total = new_total = 0.0
+    identical = True
+    for w in windows:
+        ref, t_ref = timed(_phase_space_reference, w, delay, dim)
+        new, t_new = timed(_phase_space_new, w, delay, dim)
+        ref_total += t_ref
+        new_total += t_new
+        identical &= bool(np.allclose(ref, new, rtol=1e-12, atol=0))
+    report("Lyap + ARE", ref_total / len(windows), new_total / len(windows), identical)
+
+
+def benchmark_dfa(windows):
+    ref_total = new_total = 0.0
+    identical = True
+    for w in windows:
+        ref, t_ref = timed(calculate_dfa_reference, w)
+        new, t_new = timed(calculate_dfa, w)
+        ref_total += t_ref
+        new_total += t_new
+        identical &= bool(np.isclose(ref, new, rtol=1e-9, atol=0))
+    report("DFA", ref_total / len(windows), new_total / len(windows), identical)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark các đặc trưng phi tuyến")
+    parser.add_argument("--file", default=DEFAULT_FILE)
+    parser.add_argument("--windows", type=int, default=3)
+    parser.add_argument("--delay", type=int, default=10)
+    parser.add_argument("--max-dim", type=int, default=10)
+    parser.add_argument("--max-lag", type=int, default=50)
+    parser.add_argument("--dim", type=int, default=3)
+    args = parser.parse_args()
+
+    windows = load_windows(args.file, args.windows)
+    print(f"📊 {len(windows)} cửa sổ x {len(windows[0])} mẫu từ '{args.file}'")
+    benchmark_ami(windows, args.max_lag)
+    benchmark_fnn(windows, args.delay, args.max_dim)
+    benchmark_phase_space(windows, args.delay, args.dim)
+    benchmark_dfa(windows)
@@ -0,0 +1,53 @@
+import numpy as np
+
+# Dự đoán theo tầng (cascade): tính miền rẻ trước, chỉ tính thêm miền đắt khi các mô hình đã có chưa đủ chắc chắn.
+# Tầng 1: miền thời gian (rẻ nhất, mô hình chính xác nhất); tầng 2: wavelet + Fourier; tầng 3: phi tuyến.
+# Sau mỗi tầng (trừ tầng cuối), xác suất "buồn ngủ" của các miền đã tính được lấy trung bình có trọng số
+# theo độ chính xác của từng miền; nếu max(p, 1 - p) >= ngưỡng thì quyết định luôn là (p >= 0.5).
+# Tầng cuối dùng đúng luật bỏ phiếu có trọng số của predict.py trên cả 4 miền.
+# Dùng chung cho luồng trực tiếp (predict.py) và công cụ đánh giá ngoại tuyến (cascade_eval.py).
+
+# Độ chính xác của từng miền, dùng làm trọng số bỏ phiếu (acc_time, acc_wavelet, ... trong predict.py)
+DOMAIN_WEIGHTS = {
+    "time": 0.9485,
+    "wavelet": 0.6826,
+    "nonlinear": 0.8796,
+    "frequency": 0.6566,
+}
+
+CASCADE_STAGES = (("time",), ("wavelet", "frequency"), ("nonlinear",))
+CASCADE_THRESHOLD = 0.9
+
+
+def positive_probability(model, X):
+    # Xác suất lớp 1 (buồn ngủ); None nếu mô hình không hỗ trợ predict_proba (khi đó luôn đi tiếp tầng sau)
+    if not hasattr(model, "predict_proba"):
+        return None
+    try:
+        proba = model.predict_proba(X)
+    except AttributeError:
+        return None  # vd. SVC(probability=False)
+    classes = list(model.classes_)
+    if 1 not in classes:
+        return np.zeros(len(proba))
+    return proba[:, classes.index(1)]
+
+
+def weighted_vote(predictions, weights=DOMAIN_WEIGHTS):
+    # Luật gốc: tổng trọng số các miền dự đoán 1 >= nửa tổng trọng số các miền tham gia
+    weight_sum = sum(weights[d] * np.asarray(p) for d, p in predictions.items())
+    threshold = sum(weights[d] for d in predictions) / 2
+    return (weight_sum >= threshold).astype(int)
+
+
+def weighted_probability(probabilities, weights=DOMAIN_WEIGHTS):
+    total = sum(weights[d] for d in probabilities)
+    return sum(weights[d] * np.asarray(p) for d, p in probabilities.items()) / total
+
+
+def confident_decision(probabilities, n, threshold=CASCADE_THRESHOLD, weights=DOMAIN_WEIGHTS):
+    # (mask n cửa sổ đủ chắc chắn để dừng, quyết định tương ứng) từ xác suất của các miền đã tính
+    if any(p is None for p in probabilities.values()):
+        return np.zeros(n, dtype=bool), np.zeros(n, dtype=int)
+    p = weighted_probability(probabilities, weights)
+    return np.maximum(p, 1 - p) >= threshold, (p >= 0.5).astype(int)
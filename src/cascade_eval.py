@@ -0,0 +1,158 @@
+import argparse
+import glob
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import GroupShuffleSplit, train_test_split
+
+from cascade import CASCADE_STAGES, confident_decision, positive_probability, weighted_vote
+from feature_store import FEATURE_SOURCES, FeatureStore
+from Fourier_transform import fourier_window_features
+from nonlinear import nonlinear_window_features
+from ppg_archive import read_recording
+import time_domain
+from time_domain import BeatTracker, window_time_features
+from wavelet import wavelet_window_features
+
+# Đánh giá ngoại tuyến chế độ dự đoán theo tầng (cascade.py) trên dữ liệu Features_*:
+#   1. ghép các cửa sổ của 4 miền theo (bản ghi, thời điểm kết thúc cửa sổ), huấn luyện mỗi miền một
+#      RandomForest như randomforest.py và tính xác suất/dự đoán trên tập kiểm tra;
+#   2. đo CPU-giây cho mỗi cửa sổ của từng miền (trích đặc trưng như predict.py + một lần predict của mô hình)
+#      trên một bản ghi thật, trượt cửa sổ 60 giây mỗi 1 giây;
+#   3. với từng ngưỡng: độ chính xác, tỉ lệ cửa sổ phải lên tầng 2/3 và CPU-giây trung bình mỗi cửa sổ,
+#      so với luôn tính đủ 4 miền.
+
+# Miền trong kho đặc trưng -> tên miền của predict.py / cascade.py
+STORE_DOMAINS = {"time": "time", "wavelet": "wavelet", "nonlinear": "nonlinear", "frequency": "fourier"}
+DEFAULT_THRESHOLDS = [0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.99]
+WINDOW_SECONDS = 60
+FOURIER_SECONDS = 10
+ALIGN_TOLERANCE_SECONDS = 0.5
+
+
+def load_aligned(store):
+    # Một hàng cho mỗi cửa sổ có đủ 4 miền; cột đặc trưng của từng miền được giữ trong `columns`
+    columns, aligned = {}, None
+    for domain, store_domain in STORE_DOMAINS.items():
+        source = FEATURE_SOURCES[store_domain]
+        df = store.load(store_domain, keys=True).rename(columns={source.end_column: "End"})
+        df = df.drop(columns=[source.start_column])
+        features = [c for c in df.columns if c not in ("Recording", "End", "Label bin")]
+        df = df.rename(columns={c: f"{domain}:{c}" for c in features})
+        columns[domain] = [f"{domain}:{c}" for c in features]
+        if aligned is None:
+            aligned = df
+            continue
+        df = df.drop(columns=["Label bin"])
+        merged = []
+        for recording, left in aligned.groupby("Recording", sort=False):
+            right = df[df["Recording"] == recording].drop(columns=["Recording"]).sort_values("End")
+            merged.append(pd.merge_asof(left.sort_values("End"), right, on="End", direction="nearest",
+                                        tolerance=ALIGN_TOLERANCE_SECONDS))
+        aligned = pd.concat(merged, ignore_index=True)
+    aligned = aligned.replace([np.inf, -np.inf], np.nan).dropna().reset_index(drop=True)
+    return aligned, columns
+
+
+def measure_cpu_costs(recording, windows, models, columns, time_mode=None):
+    # CPU-giây trung bình mỗi cửa sổ của từng miền: trích đặc trưng (như predict.py) + predict_proba của mô hình;
+    # time_mode như predict.py --time-mode: "beats" đo BeatTracker, mặc định đo cách tính theo từng cửa sổ
+    df = read_recording(recording, ["Time (s)", "IR Value filtered"]).dropna()
+    time_arr = df["Time (s)"].to_numpy(dtype=np.float64)
+    ir = df["IR Value filtered"].to_numpy()
+    ends = np.arange(time_arr[0] + WINDOW_SECONDS, time_arr[-1], 1.0)[:windows]
+    costs = {domain: 0.0 for domain in STORE_DOMAINS}
+    tracker = BeatTracker() if (time_mode or time_domain.TIME_FEATURE_MODE) == "beats" else None
+    for end in ends:
+        lo, hi = np.searchsorted(time_arr, [end - WINDOW_SECONDS, end], side="right")
+        t, x = time_arr[lo:hi], ir[lo:hi]
+        f_lo = np.searchsorted(t, t[-1] - FOURIER_SECONDS, side="left")
+        extractors = {
+            "time": (lambda: tracker.window_features(t, x, lo, WINDOW_SECONDS)) if tracker is not None
+                    else (lambda: window_time_features(t, x, WINDOW_SECONDS)),
+            "wavelet": lambda: wavelet_window_features(x),
+            "frequency": lambda: fourier_window_features(t[f_lo:], x[f_lo:]),
+            "nonlinear": lambda: nonlinear_window_features(x),
+        }
+        for domain, extract in extractors.items():
+            start = time.process_time()
+            features = extract()
+            row = pd.DataFrame([features], columns=[c.split(":", 1)[1] for c in columns[domain]])
+            positive_probability(models[domain], row)
+            costs[domain] += time.process_time() - start
+    return {domain: cost / len(ends) for domain, cost in costs.items()}
+
+
+def evaluate_cascade(probabilities, predictions, y, costs, threshold):
+    n = len(y)
+    final = np.zeros(n, dtype=int)
+    undecided = np.ones(n, dtype=bool)
+    cpu = np.zeros(n)
+    reached = []
+    seen = []
+    for stage, domains in enumerate(CASCADE_STAGES):
+        seen += domains
+        reached.append(undecided.mean())
+        cpu[undecided] += sum(costs[d] for d in domains)
+        if stage == len(CASCADE_STAGES) - 1:
+            final[undecided] = weighted_vote({d: predictions[d] for d in seen})[undecided]
+            break
+        confident, decision = confident_decision({d: probabilities[d] for d in seen}, n, threshold)
+        stop = undecided & confident
+        final[stop] = decision[stop]
+        undecided &= ~stop
+    return (final == y).mean(), cpu.mean(), reached
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Đánh giá độ chính xác và CPU-giây của dự đoán theo tầng")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=DEFAULT_THRESHOLDS)
+    parser.add_argument("--by-recording", action="store_true",
+                        help="Tách tập kiểm tra theo bản ghi thay vì ngẫu nhiên theo cửa sổ (như randomforest.py)")
+    parser.add_argument("--cost-recording", default=None, help="Bản ghi dùng để đo CPU (mặc định: file đầu tiên trong data/)")
+    parser.add_argument("--cost-windows", type=int, default=30, help="Số cửa sổ dùng để đo CPU")
+    parser.add_argument("--time-mode", choices=["window", "beats"], default=None,
+                        help="Cách tính miền thời gian khi đo CPU, như predict.py --time-mode (mặc định window)")
+    parser.add_argument("--output", default=None, help="Lưu bảng kết quả ra CSV")
+    args = parser.parse_args()
+
+    aligned, columns = load_aligned(FeatureStore())
+    y = aligned["Label bin"].to_numpy()
+    if args.by_recording:
+        train, test = next(GroupShuffleSplit(test_size=0.2, random_state=42).split(aligned, y, aligned["Recording"]))
+    else:
+        train, test = train_test_split(np.arange(len(aligned)), test_size=0.2, random_state=42, stratify=y)
+    print(f"📊 {len(aligned)} cửa sổ đủ 4 miền, huấn luyện {len(train)}, kiểm tra {len(test)}")
+
+    models, probabilities, predictions = {}, {}, {}
+    for domain in STORE_DOMAINS:
+        X = aligned[columns[domain]].rename(columns=lambda c: c.split(":", 1)[1])
+        model = RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=-1)
+        model.fit(X.iloc[train], y[train])
+        model.set_params(n_jobs=None)  # dự đoán từng cửa sổ như predict.py, không chia luồng
+        models[domain] = model
+        probabilities[domain] = positive_probability(model, X.iloc[test])
+        predictions[domain] = model.predict(X.iloc[test])
+        print(f"   {domain:<10} độ chính xác {np.mean(predictions[domain] == y[test]):.4f}")
+
+    cost_recording = args.cost_recording or sorted(glob.glob("data/*.csv"))[0]
+    costs = measure_cpu_costs(cost_recording, args.cost_windows, models, columns, args.time_mode)
+    print(f"⏱️ CPU mỗi cửa sổ ({cost_recording}): " + ", ".join(f"{d} {c * 1000:.1f} ms" for d, c in costs.items()))
+
+    y_test = y[test]
+    full_accuracy = np.mean(weighted_vote(predictions) == y_test)
+    full_cpu = sum(costs.values())
+    rows = [{"Threshold": "full", "Accuracy": full_accuracy, "CPU s/window": full_cpu,
+             "Stage 2 %": 100.0, "Stage 3 %": 100.0, "CPU saved %": 0.0}]
+    for threshold in args.thresholds:
+        accuracy, cpu, reached = evaluate_cascade(probabilities, predictions, y_test, costs, threshold)
+        rows.append({"Threshold": threshold, "Accuracy": accuracy, "CPU s/window": cpu,
+                     "Stage 2 %": reached[1] * 100, "Stage 3 %": reached[2] * 100,
+                     "CPU saved %": (1 - cpu / full_cpu) * 100})
+    result = pd.DataFrame(rows)
+    print(result.to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+    if args.output:
+        result.to_csv(args.output, index=False)
+        print(f"✅ Đã lưu kết quả vào '{args.output}'")
@@ -1,35 +1,16 @@
-import pandas as pd
-import os
+from feature_store import load_features
 
-# Tên các thư mục chứa dữ liệu
-time_domain_dir = 'Features_time'
-nonlinear_domain_dir = 'Features_nonlinear'
-wavelet_dir = 'Features_wavelet'
-frequence_dir = 'Features_fourier'
+# Đọc dữ liệu từ các miền (kèm cột "Recording": bản ghi gốc của từng cửa sổ)
+def load_with_recording(domain):
+    df = load_features(domain, keys=True)
+    return df.drop(columns=df.columns[1:3])  # bỏ thời điểm bắt đầu/kết thúc cửa sổ
 
-# Hàm đọc và kết hợp dữ liệu từ nhiều file trong thư mục
-def load_and_combine_all(directory, prefix, drop_cols):
-    all_files = [f for f in os.listdir(directory) if f.startswith(prefix) and f.endswith('.csv')]
-    df_list = []
-    for file in all_files:
-        file_path = os.path.join(directory, file)
-        df = pd.read_csv(file_path)
-        df.columns = df.columns.str.strip().str.replace('\ufeff', '', regex=True) 
-        df_dropped = df.drop(columns=drop_cols, errors='ignore')
-        df_dropped['source_file'] = file  
-        df_list.append(df_dropped)
-    if df_list:
-        combined_df = pd.concat(df_list, ignore_index=True)
-        return combined_df
-    return None
-
-# Đọc dữ liệu từ các miền
-df_thoi_gian_all = load_and_combine_all(time_domain_dir, 'time_data', ['Start Time (s)', 'End Time (s)', 'Label'])
-df_phi_tuyen_all = load_and_combine_all(nonlinear_domain_dir, 'Nonlinear_result_data', ['Time start', 'Time end', 'Label'])
+df_thoi_gian_all = load_with_recording("time")
+df_phi_tuyen_all = load_with_recording("nonlinear")
 df_phi_tuyen_all.to_csv("b.csv",index=False)
-df_wavelet_all = load_and_combine_all(wavelet_dir, 'Wavelet_result_data', ['Start Time (s)', 'End Time (s)', 'Label'])
+df_wavelet_all = load_with_recording("wavelet")
 df_wavelet_all.to_csv("a.csv",index=False)
-df_tanso_all = load_and_combine_all(frequence_dir, 'FFT_result_data', ['Start Time (s)', 'End Time (s)', 'Label'])
+df_tanso_all = load_with_recording("fourier")
 
 
 # Hàm kiểm tra giá trị NaN trong DataFrame
@@ -76,9 +57,9 @@ def check_for_nan_values(df, df_name):
     else:
         print("\nKhông có hàng nào chứa giá trị NaN.")
 
-    # 5. Tên file chứa NaN 
-    if 'source_file' in df.columns:
-        files_with_nan = rows_with_nan['source_file'].unique()
+    # 5. Tên bản ghi chứa NaN
+    if 'Recording' in df.columns:
+        files_with_nan = rows_with_nan['Recording'].unique()
         if len(files_with_nan) > 0:
             print(f"\n📂 Các file chứa giá trị NaN:")
             for f in files_with_nan:
@@ -1,26 +1,11 @@
-import os
-import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
 
-# Thư mục chứa các file CSV
-input_folder = "Features_wavelet"  
+from feature_store import FeatureStore
 
-# Duyệt qua tất cả các file CSV
-csv_files = [f for f in os.listdir(input_folder) if f.endswith(".csv")]
-
-# Nối tất cả các file CSV lại thành một DataFrame duy nhất
-all_data = pd.DataFrame()
-for file in csv_files:
-    file_path = os.path.join(input_folder, file)
-    df = pd.read_csv(file_path)
-    df.columns = df.columns.str.strip().str.replace('\ufeff', '', regex=True)
-    
-    # Chỉ giữ lại các cột số
-    df_numeric = df.select_dtypes(include='number')
-    df_numeric = df_numeric.drop(columns=['Label', 'Label bin', 'Start Time (s)', 'End Time (s)'], errors='ignore')  # Nếu có cột nhãn
-
-    all_data = pd.concat([all_data, df_numeric], ignore_index=True)
+# Chỉ lấy các cột đặc trưng Wavelet (không lấy nhãn, thời điểm cửa sổ) từ kho đặc trưng gộp
+store = FeatureStore()
+all_data = store.load("wavelet", columns=store.feature_columns("wavelet"))
 
 # Tính toán ma trận tương quan Pearson
 corr_matrix = all_data.corr()
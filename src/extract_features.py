@@ -0,0 +1,357 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import time as timer
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from windowing import window_bounds
+from file_hash import file_sha256
+from ppg_archive import read_recording
+from feature_store import FEATURE_SOURCES
+import nonlinear
+import time_domain
+from time_domain import extract_time_features
+from wavelet import extract_wavelet_features, WAVELET_NAME, WAVELET_LEVEL
+from Fourier_transform import extract_fourier_features
+from nonlinear import extract_nonlinear_features
+from resample import MAX_GAP_SECONDS, RESAMPLE_RATE_HZ, gaps, overlaps_gap, resample_uniform
+
+# Trích xuất đặc trưng hàng loạt cho cả thư mục bản ghi, thay cho việc sửa đường dẫn
+# cứng trong từng script rồi chạy lần lượt:
+#   python src/extract_features.py data --domains time wavelet fourier nonlinear
+# (nhận cả bản ghi .ppgz của ppg_archive.py: --pattern "*.ppgz")
+# Mỗi (file, miền) được chia thành các phần gồm `--chunk-windows` cửa sổ và chạy song song
+# trên một process pool. Mỗi phần xong được lưu ngay thành checkpoint trong thư mục .partial,
+# nên khi bị ngắt giữa chừng, lần chạy sau chỉ tính tiếp những phần còn thiếu. File kết quả
+# được ghi ra file tạm rồi os.replace, nên không bao giờ có file kết quả ghi dở.
+#
+# Mỗi thư mục Features_* có một manifest.json ghi lại, cho từng file kết quả, mã băm SHA-256
+# của bản ghi gốc và tham số trích xuất. Chỉ những bản ghi mới/đã thay đổi, hoặc khi tham số
+# thay đổi, mới phải tính lại; file kết quả chưa có trong manifest cũng được tính lại.
+#
+# --resample [HZ]: đưa mỗi bản ghi về lưới thời gian đều (resample.py) trước khi tính đặc trưng, để mọi
+# bản ghi (17-62.5 Hz, nhãn thời gian dao động) có cùng tần số và cửa sổ có số mẫu cố định; cửa sổ chứa
+# khoảng trống (mất mẫu > MAX_GAP_SECONDS) bị bỏ thay vì tính trên dữ liệu nội suy.
+# --nonlinear-rate HZ: chỉ miền phi tuyến được tính trên tín hiệu giảm còn HZ (nonlinear.NONLINEAR_RATE_HZ).
+
+Domain = namedtuple("Domain", ["extract", "output_dir", "prefix", "window_seconds"])
+
+DOMAINS = {
+    "time": Domain(extract_time_features, *FEATURE_SOURCES["time"][:2], 60),
+    "wavelet": Domain(extract_wavelet_features, *FEATURE_SOURCES["wavelet"][:2], 60),
+    "fourier": Domain(extract_fourier_features, *FEATURE_SOURCES["fourier"][:2], 10),
+    "nonlinear": Domain(extract_nonlinear_features, *FEATURE_SOURCES["nonlinear"][:2], 60),
+}
+# Miền chậm nhất được đưa vào hàng đợi trước để các tiến trình không phải chờ nó ở cuối
+DOMAIN_ORDER = ["nonlinear", "wavelet", "fourier", "time"]
+
+STEP_SECONDS = 1
+DEFAULT_CHUNK_WINDOWS = 200
+PARTIAL_DIR = ".partial"
+MANIFEST_FILE_NAME = "manifest.json"
+
+Job = namedtuple("Job", ["file_path", "domain", "output_path", "partial_dir", "chunks", "sha256", "params"])
+
+
+def domain_params(domain, resample_rate=None, nonlinear_rate=None, ami_method=None, time_mode=None):
+    # Mọi tham số ảnh hưởng tới giá trị đặc trưng; đổi bất kỳ giá trị nào thì kết quả cũ hết hiệu lực
+    params = {"window_seconds": DOMAINS[domain].window_seconds, "step_seconds": STEP_SECONDS}
+    if resample_rate is not None:
+        params.update(resample_rate=resample_rate, max_gap=MAX_GAP_SECONDS)
+    if domain == "time":
+        params["mode"] = time_mode or time_domain.TIME_FEATURE_MODE
+    elif domain == "wavelet":
+        params.update(wavelet=WAVELET_NAME, level=WAVELET_LEVEL)
+    elif domain == "nonlinear":
+        params.update(max_lag=nonlinear.NONLINEAR_MAX_LAG, max_dim=nonlinear.NONLINEAR_MAX_DIM,
+                      ami_method=ami_method or nonlinear.AMI_METHOD, ami_bins=nonlinear.AMI_BINS,
+                      dfa_scales=list(nonlinear.DFA_SCALES))
+        if nonlinear_rate is not None:
+            params["rate"] = nonlinear_rate
+    return params
+
+
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_FILE_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST_FILE_NAME)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+class RecordingHashes:
+    # Băm lại file chỉ khi kích thước hoặc thời điểm sửa đổi khác với lần ghi trong manifest
+    def __init__(self, manifests):
+        self._known = {}
+        for manifest in manifests:
+            for entry in manifest.values():
+                self._known[(entry["source"], entry["size"], entry["mtime_ns"])] = entry["sha256"]
+
+    def stat(self, path):
+        st = os.stat(path)
+        source = os.path.normpath(path)
+        sha256 = self._known.get((source, st.st_size, st.st_mtime_ns))
+        if sha256 is None:
+            sha256 = file_sha256(path)
+            self._known[(source, st.st_size, st.st_mtime_ns)] = sha256
+        return {"source": source, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": sha256}
+
+
+@lru_cache(maxsize=2)
+def load_recording(file_path, resample_rate=None):
+    # Mỗi tiến trình chỉ đọc một file một lần dù xử lý nhiều phần của nó.
+    # Trả về (time, ir_signal, labels, các khoảng trống); khoảng trống chỉ được tính khi lấy mẫu lại
+    df = read_recording(file_path)
+    label_column = "Label" if "Label" in df.columns else "Label_Detail"
+    missing = {"Time (s)", "IR Value filtered", label_column} - set(df.columns)
+    if missing:
+        raise ValueError(f"File '{file_path}' thiếu cột: {', '.join(sorted(missing))}")
+    df = df.drop_duplicates(subset=["Time (s)"]).sort_values(by=["Time (s)"])
+    time, ir_signal, labels = np.array(df["Time (s)"]), np.array(df["IR Value filtered"]), np.array(df[label_column])
+    if resample_rate is None:
+        return time, ir_signal, labels, np.empty((0, 2))
+    grid = resample_uniform(time, ir_signal, resample_rate)
+    return grid.time, grid.signal, labels[grid.source_index], gaps(time)
+
+
+def count_windows(domain, time, nonlinear_rate=None):
+    if domain == "nonlinear":
+        if nonlinear_rate is not None:
+            # Lưới đều mà extract_nonlinear_features sẽ dựng
+            time = resample_uniform(time, time, nonlinear_rate).time
+        lo, _ = nonlinear.nonlinear_window_bounds(time, DOMAINS[domain].window_seconds, STEP_SECONDS, nonlinear_rate)
+        return len(lo)
+    return len(window_bounds(time, DOMAINS[domain].window_seconds, STEP_SECONDS)[0])
+
+
+def write_csv_atomic(df, path):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def chunk_path(partial_dir, chunk):
+    return os.path.join(partial_dir, f"chunk_{chunk:05d}.csv")
+
+
+def run_chunk(file_path, domain, partial_dir, chunk, chunk_windows, resample_rate=None, nonlinear_rate=None,
+              ami_method=None, time_mode=None):
+    time, ir_signal, labels, gap_list = load_recording(file_path, resample_rate)
+    windows = slice(chunk * chunk_windows, (chunk + 1) * chunk_windows)
+    spec = DOMAINS[domain]
+    options = {}
+    if domain == "nonlinear":
+        options.update(rate=nonlinear_rate, ami_method=ami_method)
+    elif domain == "time":
+        options["mode"] = time_mode
+    with np.errstate(all="ignore"):
+        df = spec.extract(time, ir_signal, labels, spec.window_seconds, STEP_SECONDS, windows=windows, **options)
+    if len(gap_list) and len(df):
+        source = FEATURE_SOURCES[domain]
+        df = df[~overlaps_gap(df[source.start_column], df[source.end_column], gap_list)]
+    path = chunk_path(partial_dir, chunk)
+    write_csv_atomic(df, path)
+    return path
+
+
+def add_label_bin(df):
+    # Giống addlabelbin.py: nhãn 0..5 là tỉnh táo (0), lớn hơn 5 là buồn ngủ (1)
+    labels = pd.to_numeric(df["Label"], errors="coerce")
+    if len(df) and labels.notna().all():
+        df["Label"] = labels
+        df["Label bin"] = (labels > 5).astype(int)
+    return df
+
+
+def finalize(job, stats):
+    parts = [pd.read_csv(chunk_path(job.partial_dir, chunk)) for chunk in range(job.chunks)]
+    parts = [part for part in parts if len(part)]
+    df = pd.concat(parts, ignore_index=True) if parts else pd.read_csv(chunk_path(job.partial_dir, 0))
+    write_csv_atomic(add_label_bin(df), job.output_path)
+
+    output_dir = os.path.dirname(job.output_path)
+    manifest = load_manifest(output_dir)
+    manifest[os.path.basename(job.output_path)] = dict(stats, params=json.loads(job.params))
+    save_manifest(output_dir, manifest)
+
+    shutil.rmtree(job.partial_dir, ignore_errors=True)
+    try:
+        os.rmdir(os.path.dirname(job.partial_dir))  # chỉ xóa .partial khi đã trống
+    except OSError:
+        pass
+    return len(df)
+
+
+def recording_stem(file_path):
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+
+def check_unique_stems(files):
+    # Tên file kết quả, khóa manifest và thư mục checkpoint chỉ dựa vào tên bản ghi (không có thư mục),
+    # nên hai bản ghi cùng tên ở hai thư mục (data/ và predict_data/) sẽ ghi đè và xóa checkpoint của nhau
+    paths = {}
+    for file_path in files:
+        paths.setdefault(recording_stem(file_path), set()).add(os.path.normpath(file_path))
+    duplicates = {stem: sorted(p) for stem, p in paths.items() if len(p) > 1}
+    if duplicates:
+        listing = "; ".join(f"{stem}: {', '.join(p)}" for stem, p in sorted(duplicates.items()))
+        raise ValueError(f"Các bản ghi trùng tên sẽ ghi đè kết quả của nhau ({listing}). "
+                         "Chạy riêng từng thư mục với --output-root khác nhau.")
+
+
+def plan_jobs(files, domains, output_root, chunk_windows, force, resample_rate=None, nonlinear_rate=None,
+              ami_method=None, time_mode=None):
+    check_unique_stems(files)
+    output_dirs = {domain: os.path.join(output_root, DOMAINS[domain].output_dir) for domain in domains}
+    manifests = {domain: load_manifest(output_dirs[domain]) for domain in domains}
+    hashes = RecordingHashes(manifests.values())
+    params = {domain: json.dumps(domain_params(domain, resample_rate, nonlinear_rate, ami_method, time_mode),
+                                 sort_keys=True) for domain in domains}
+
+    jobs = []
+    stats = {}
+    for file_path in files:
+        stem = recording_stem(file_path)
+        file_stats = hashes.stat(file_path)
+        pending = []
+        for domain in domains:
+            name = f"{DOMAINS[domain].prefix}{stem}.csv"
+            output_path = os.path.join(output_dirs[domain], name)
+            entry = manifests[domain].get(name)
+            if (not force and entry is not None and os.path.exists(output_path)
+                    and entry["sha256"] == file_stats["sha256"]
+                    and json.dumps(entry["params"], sort_keys=True) == params[domain]):
+                continue
+            pending.append((domain, name, output_path))
+        if not pending:
+            continue
+
+        try:
+            time = load_recording(file_path, resample_rate)[0]
+        except Exception as e:
+            print(f"⚠️ Bỏ qua '{file_path}': {e}")
+            continue
+        for domain, name, output_path in pending:
+            # Checkpoint chỉ dùng lại khi bản ghi, tham số và cách chia phần đều giống hệt
+            key = hashlib.sha1(f"{file_stats['sha256']}|{params[domain]}|{chunk_windows}".encode()).hexdigest()[:12]
+            partial_root = os.path.join(output_dirs[domain], PARTIAL_DIR)
+            partial_dir = os.path.join(partial_root, f"{name}.{key}")
+            for stale in glob.glob(os.path.join(partial_root, f"{glob.escape(name)}.*")):
+                if force or stale != partial_dir:
+                    shutil.rmtree(stale, ignore_errors=True)
+            os.makedirs(partial_dir, exist_ok=True)
+            chunks = max(1, -(-count_windows(domain, time, nonlinear_rate) // chunk_windows))
+            job = Job(file_path, domain, output_path, partial_dir, chunks, file_stats["sha256"], params[domain])
+            jobs.append(job)
+            stats[job] = file_stats
+    load_recording.cache_clear()
+    return jobs, stats
+
+
+def run(files, domains, output_root=".", jobs=None, chunk_windows=DEFAULT_CHUNK_WINDOWS, force=False,
+        resample_rate=None, nonlinear_rate=None, ami_method=None, time_mode=None):
+    planned, stats = plan_jobs(files, domains, output_root, chunk_windows, force, resample_rate, nonlinear_rate,
+                               ami_method, time_mode)
+    remaining = {}
+    tasks = []
+    for job in planned:
+        todo = [c for c in range(job.chunks) if not os.path.exists(chunk_path(job.partial_dir, c))]
+        remaining[job] = len(todo)
+        if todo and len(todo) < job.chunks:
+            print(f"↩️ [{job.domain}] {os.path.basename(job.file_path)}: tiếp tục từ checkpoint "
+                  f"({job.chunks - len(todo)}/{job.chunks} phần)")
+        tasks.extend((DOMAIN_ORDER.index(job.domain), job, c) for c in todo)
+    # Theo miền trước, rồi theo file: các phần của cùng một file nằm gần nhau và dùng lại cache đọc file
+    tasks.sort(key=lambda task: (task[0], task[1].file_path, task[2]))
+
+    completed = failed = 0
+    start = timer.perf_counter()
+
+    def finish(job):
+        nonlocal completed
+        rows = finalize(job, stats[job])
+        completed += 1
+        print(f"✅ [{job.domain}] {os.path.basename(job.file_path)} -> '{job.output_path}' ({rows} cửa sổ)")
+
+    for job, todo in remaining.items():
+        if todo == 0:
+            finish(job)
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(run_chunk, job.file_path, job.domain, job.partial_dir, chunk, chunk_windows,
+                               resample_rate, nonlinear_rate, ami_method, time_mode): job
+                   for _, job, chunk in tasks}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                remaining[job] = -1
+                print(f"❌ [{job.domain}] {os.path.basename(job.file_path)}: {e}")
+                continue
+            remaining[job] -= 1
+            if remaining[job] == 0:
+                finish(job)
+
+    print(f"🏁 Xong {completed}/{len(planned)} file kết quả cần tính lại trong {timer.perf_counter() - start:.1f} s"
+          + (f", {failed} phần lỗi (chạy lại để tiếp tục)" if failed else ""))
+    return completed
+
+
+def find_recordings(inputs, pattern="*.csv"):
+    files = []
+    for path in inputs:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, pattern))))
+        else:
+            files.append(path)
+    # Cùng một file được chỉ ra hai lần (vd. "data" và "data/x.csv") chỉ tính một lần
+    return list(dict.fromkeys(os.path.normpath(f) for f in files))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Trích xuất đặc trưng song song cho các bản ghi PPG")
+    parser.add_argument("inputs", nargs="+", help="thư mục bản ghi (data/, predict_data/) hoặc file CSV")
+    parser.add_argument("--domains", nargs="+", choices=list(DOMAINS), default=list(DOMAINS))
+    parser.add_argument("--output-root", default=".", help="thư mục chứa Features_time/, Features_wavelet/, ...")
+    parser.add_argument("--pattern", default="*.csv")
+    parser.add_argument("--jobs", type=int, default=None, help="số tiến trình (mặc định: số nhân CPU)")
+    parser.add_argument("--chunk-windows", type=int, default=DEFAULT_CHUNK_WINDOWS, help="số cửa sổ mỗi phần việc")
+    parser.add_argument("--resample", nargs="?", type=float, const=RESAMPLE_RATE_HZ, default=None, metavar="HZ",
+                        help=f"lấy mẫu lại lên lưới thời gian đều (mặc định {RESAMPLE_RATE_HZ:g} Hz) trước khi tính")
+    parser.add_argument("--nonlinear-rate", type=float, default=None, metavar="HZ",
+                        help="chỉ miền phi tuyến: tính trên tín hiệu giảm còn HZ (xem nonlinear_rate_eval.py)")
+    parser.add_argument("--ami-method", choices=["sklearn", "histogram"], default=None,
+                        help=f"cách ước lượng AMI của miền phi tuyến (mặc định {nonlinear.AMI_METHOD}; "
+                             "histogram nhanh hơn nhưng cần huấn luyện lại model_nonlinear.pkl)")
+    parser.add_argument("--time-mode", choices=["window", "beats"], default=None,
+                        help=f"cách tính miền thời gian (mặc định {time_domain.TIME_FEATURE_MODE}, khớp với "
+                             "model_time_domain.pkl; beats nhanh hơn nhưng STD Interval lệch so với window)")
+    parser.add_argument("--force", action="store_true", help="tính lại cả những file đã có kết quả hợp lệ trong manifest")
+    args = parser.parse_args()
+
+    recordings = find_recordings(args.inputs, args.pattern)
+    print(f"📂 {len(recordings)} bản ghi, miền: {', '.join(args.domains)}")
+    try:
+        check_unique_stems(recordings)
+    except ValueError as e:
+        raise SystemExit(f"❌ {e}")
+    run(recordings, args.domains, args.output_root, args.jobs, args.chunk_windows, args.force, args.resample,
+        args.nonlinear_rate, args.ami_method, args.time_mode)
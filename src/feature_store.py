@@ -0,0 +1,183 @@
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# Kho đặc trưng gộp: mỗi miền (time, wavelet, fourier, nonlinear) là một ma trận .npy
+# lưu theo cột (Fortran order) kèm một schema.json, thay cho ~100 file CSV trong 4 thư mục Features_*.
+# Các hàng được sắp theo (bản ghi, thời điểm bắt đầu cửa sổ), nên mỗi bản ghi là một khoảng hàng
+# liên tiếp; khi đọc chỉ cần np.load(mmap_mode="r") rồi lấy đúng các cột và khoảng hàng cần thiết.
+# Kho tự dựng lại miền nào có file CSV nguồn thay đổi (thêm/xóa/sửa file).
+
+FEATURE_STORE_DIR = "feature_store"
+SCHEMA_FILE_NAME = "schema.json"
+
+FeatureSource = namedtuple("FeatureSource", ["directory", "prefix", "start_column", "end_column"])
+
+FEATURE_SOURCES = {
+    "time": FeatureSource("Features_time", "time_", "Start Time (s)", "End Time (s)"),
+    "wavelet": FeatureSource("Features_wavelet", "Wavelet_result_", "Start Time (s)", "End Time (s)"),
+    "fourier": FeatureSource("Features_fourier", "FFT_result_", "Start Time (s)", "End Time (s)"),
+    "nonlinear": FeatureSource("Features_nonlinear", "Nonlinear_result_", "Time start", "Time end"),
+}
+
+LABEL_COLUMNS = ["Label", "Label bin"]
+
+
+def read_feature_csv(path):
+    df = pd.read_csv(path)
+    # Một số file có tiêu đề lệch (" Label", BOM ở đầu file)
+    df.columns = df.columns.str.strip().str.replace('\ufeff', '', regex=True)
+    if "Label bin" not in df.columns:
+        df["Label bin"] = df["Label"].apply(lambda x: 0 if x <= 5 else 1)
+    return df
+
+
+def _source_files(root, domain):
+    source = FEATURE_SOURCES[domain]
+    directory = os.path.join(root, source.directory)
+    if not os.path.isdir(directory):
+        return {}
+    files = {}
+    for name in sorted(os.listdir(directory)):
+        if name.startswith(source.prefix) and name.endswith(".csv"):
+            st = os.stat(os.path.join(directory, name))
+            files[name] = [st.st_size, st.st_mtime_ns]
+    return files
+
+
+def _save_npy_atomic(path, array):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+class FeatureStore:
+    def __init__(self, store_dir=FEATURE_STORE_DIR, root="."):
+        self.store_dir = store_dir
+        self.root = root
+        self._arrays = {}
+        schema_path = os.path.join(store_dir, SCHEMA_FILE_NAME)
+        if os.path.exists(schema_path):
+            with open(schema_path, encoding="utf-8") as f:
+                self.schema = json.load(f)
+        else:
+            self.schema = {"domains": {}}
+
+    def _save_schema(self):
+        os.makedirs(self.store_dir, exist_ok=True)
+        path = os.path.join(self.store_dir, SCHEMA_FILE_NAME)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.schema, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def is_stale(self, domain):
+        entry = self.schema["domains"].get(domain)
+        return (entry is None or entry["sources"] != _source_files(self.root, domain)
+                or not os.path.exists(os.path.join(self.store_dir, entry["file"])))
+
+    def build(self, domain):
+        source = FEATURE_SOURCES[domain]
+        sources = _source_files(self.root, domain)
+        frames, recordings, columns = [], [], None
+        row = 0
+        for name in sources:
+            df = read_feature_csv(os.path.join(self.root, source.directory, name))
+            df = df.sort_values(by=source.start_column, kind="stable")
+            if columns is None:
+                # Thứ tự cột: thời điểm bắt đầu/kết thúc, các đặc trưng, rồi nhãn
+                keys = [source.start_column, source.end_column]
+                columns = keys + [c for c in df.columns if c not in keys + LABEL_COLUMNS] + LABEL_COLUMNS
+            frames.append(df[columns].to_numpy(dtype=np.float64))
+            recordings.append({"name": name[len(source.prefix):-len(".csv")], "start": row, "stop": row + len(df)})
+            row += len(df)
+
+        file_name = f"{domain}.npy"
+        os.makedirs(self.store_dir, exist_ok=True)
+        matrix = np.concatenate(frames) if frames else np.empty((0, 0))
+        _save_npy_atomic(os.path.join(self.store_dir, file_name), np.asfortranarray(matrix))
+        self._arrays.pop(domain, None)
+        self.schema["domains"][domain] = {
+            "file": file_name,
+            "columns": columns or [],
+            "rows": row,
+            "recordings": recordings,
+            "sources": sources,
+        }
+        self._save_schema()
+        print(f"📦 Đã gộp {len(recordings)} file {source.directory} ({row} cửa sổ) vào '{file_name}'")
+
+    def refresh(self, domains=None):
+        for domain in domains or FEATURE_SOURCES:
+            if self.is_stale(domain):
+                self.build(domain)
+
+    def _array(self, domain):
+        if domain not in self._arrays:
+            entry = self.schema["domains"][domain]
+            self._arrays[domain] = np.load(os.path.join(self.store_dir, entry["file"]), mmap_mode="r")
+        return self._arrays[domain]
+
+    def recordings(self, domain):
+        self.refresh([domain])
+        return [r["name"] for r in self.schema["domains"][domain]["recordings"]]
+
+    def feature_columns(self, domain):
+        self.refresh([domain])
+        return self._feature_columns(domain)
+
+    def _feature_columns(self, domain):
+        source = FEATURE_SOURCES[domain]
+        return [c for c in self.schema["domains"][domain]["columns"]
+                if c not in (source.start_column, source.end_column, *LABEL_COLUMNS)]
+
+    def load(self, domain, columns=None, recordings=None, keys=False):
+        # columns=None: mọi cột đặc trưng + "Label bin" (giống load_and_combine_all cũ)
+        # recordings: chỉ lấy các bản ghi này (tên file gốc không có đuôi, vd. "data_Cong_12052025")
+        # keys=True: thêm cột "Recording" và thời điểm bắt đầu/kết thúc cửa sổ
+        self.refresh([domain])
+        entry = self.schema["domains"][domain]
+        if not entry["recordings"]:
+            return None
+        source = FEATURE_SOURCES[domain]
+        if columns is None:
+            columns = self._feature_columns(domain) + ["Label bin"]
+        if keys:
+            columns = [source.start_column, source.end_column] + [
+                c for c in columns if c not in (source.start_column, source.end_column)]
+
+        selected = entry["recordings"]
+        if recordings is not None:
+            wanted = set(recordings)
+            selected = [r for r in selected if r["name"] in wanted]
+
+        array = self._array(domain)
+        col_index = [entry["columns"].index(c) for c in columns]
+        # Mỗi cột nằm liền kề trong file nên chỉ các cột được chọn bị đọc từ đĩa
+        data = {}
+        for c, j in zip(columns, col_index):
+            column = array[:, j]
+            if recordings is not None:
+                column = np.concatenate([column[r["start"]:r["stop"]] for r in selected]) if selected else column[:0]
+            data[c] = np.array(column)
+        df = pd.DataFrame(data, columns=columns)
+        if "Label bin" in df.columns:
+            df["Label bin"] = df["Label bin"].astype(np.int64)
+        if keys:
+            names = np.repeat([r["name"] for r in selected], [r["stop"] - r["start"] for r in selected])
+            df.insert(0, "Recording", names)
+        return df
+
+
+def load_features(domain, columns=None, recordings=None, keys=False, store_dir=FEATURE_STORE_DIR, root="."):
+    return FeatureStore(store_dir, root).load(domain, columns=columns, recordings=recordings, keys=keys)
+
+
+if __name__ == "__main__":
+    store = FeatureStore()
+    for domain in FEATURE_SOURCES:
+        store.build(domain)
@@ -0,0 +1,12 @@
+import hashlib
+
+# Băm nội dung file, dùng chung cho manifest của extract_features.py và model_registry.py.
+# Để riêng một module nhỏ để nạp lại mô hình không phải import extract_features (kéo theo mọi miền đặc trưng).
+
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,92 @@
+import argparse
+import asyncio
+import glob
+import time
+
+import numpy as np
+
+from ingest_server import INGEST_PORT
+from ppg_archive import read_recording
+from replay_serial import REPLAY_COLUMNS
+
+# Bộ tạo tải cho ingest_server.py: mở nhiều client TCP cùng lúc, mỗi client phát lại một bản ghi trong data/
+# (xoay vòng nếu số client nhiều hơn số bản ghi) theo đúng nhịp "Time (s)" nhân với hệ số tốc độ,
+# gom các dòng "ir,filtered\n" thành lô mỗi BATCH_INTERVAL_SECONDS giống ESP32 gửi qua Wi-Fi.
+# Nếu máy chủ không theo kịp, writer.drain() bị chặn và client tụt lại sau lịch phát: độ trễ so với lịch
+# (lag) tăng dần chính là dấu hiệu máy chủ không chịu nổi số luồng đó.
+
+BATCH_INTERVAL_SECONDS = 0.1
+
+
+def encode_recording(path):
+    df = read_recording(path, REPLAY_COLUMNS).dropna()
+    lines = [f"{int(raw)},{int(filtered)}\n".encode()
+             for raw, filtered in zip(df["IR Value raw"], df["IR Value filtered"])]
+    times = df["Time (s)"].to_numpy(dtype=np.float64)
+    return lines, times - times[0]
+
+
+async def run_client(client_id, recording, host, port, speed, duration, stats):
+    lines, offsets = recording
+    reader, writer = await asyncio.open_connection(host, port)
+    name = f"load{client_id:03d}"
+    writer.write(f"HELLO {name}\n".encode())
+    await writer.drain()
+    reply = await reader.readline()
+    if not reply.startswith(b"OK"):
+        print(f"❌ [{name}] Máy chủ từ chối: {reply.decode(errors='replace').strip()}")
+        writer.close()
+        return
+
+    start = time.monotonic()
+    sent, lags = 0, []
+    while sent < len(lines):
+        elapsed = time.monotonic() - start
+        if elapsed >= duration:
+            break
+        # Mọi mẫu đã tới lịch phát được gửi trong một lần ghi
+        due = int(np.searchsorted(offsets, elapsed * speed, side="right"))
+        if due > sent:
+            writer.write(b"".join(lines[sent:due]))
+            await writer.drain()
+            # Độ trễ so với lịch: từ lúc mẫu cuối của lô tới hạn tới lúc máy chủ nhận xong lô
+            lags.append(time.monotonic() - start - offsets[due - 1] / speed)
+            sent = due
+        await asyncio.sleep(BATCH_INTERVAL_SECONDS)
+    writer.close()
+    await writer.wait_closed()
+    stats.append((sent, time.monotonic() - start, lags))
+
+
+async def main(args):
+    paths = sorted(glob.glob(args.recordings))
+    if not paths:
+        raise SystemExit(f"❌ Không tìm thấy bản ghi nào khớp '{args.recordings}'")
+    recordings = [encode_recording(path) for path in paths[:args.clients]]
+    print(f"🚀 {args.clients} client, {len(recordings)} bản ghi, tốc độ x{args.speed}, {args.duration:.0f} s")
+
+    stats = []
+    await asyncio.gather(*[
+        run_client(i, recordings[i % len(recordings)], args.host, args.port, args.speed, args.duration, stats)
+        for i in range(args.clients)])
+
+    if not stats:
+        return
+    samples = sum(s[0] for s in stats)
+    duration = max(s[1] for s in stats)
+    lags = np.concatenate([s[2] for s in stats if s[2]]) * 1000 if any(s[2] for s in stats) else np.zeros(1)
+    print(f"📡 Đã gửi {samples} mẫu trong {duration:.1f} s ({samples / duration:.0f} mẫu/s, "
+          f"{len(stats)}/{args.clients} client hoàn tất)")
+    print(f"⏱️ Trễ so với lịch: trung vị {np.median(lags):.1f} ms, p95 {np.percentile(lags, 95):.1f} ms, "
+          f"lớn nhất {lags.max():.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tạo tải cho máy chủ nhận PPG bằng cách phát lại các bản ghi")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=INGEST_PORT)
+    parser.add_argument("--clients", type=int, default=10, help="Số luồng (cảm biến ảo) đồng thời")
+    parser.add_argument("--speed", type=float, default=1.0, help="Hệ số tốc độ phát lại")
+    parser.add_argument("--duration", type=float, default=120.0, help="Thời gian chạy (giây)")
+    parser.add_argument("--recordings", default="data/*.csv", help="Mẫu glob của các bản ghi cần phát lại")
+    asyncio.run(main(parser.parse_args()))
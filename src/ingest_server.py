@@ -0,0 +1,183 @@
+import argparse
+import asyncio
+import csv
+import os
+import re
+import time
+
+from predict import CSV_FILE_NAME, STREAMS_DIR, WARMUP_SECONDS, Stream, models
+from cascade import CASCADE_THRESHOLD
+from resample import RESAMPLE_RATE_HZ
+from scheduler import SharedWorkerPool
+from serial_ingest import MAX_READ_BYTES, SerialBatchReader
+
+# Máy chủ TCP (asyncio) nhận tín hiệu PPG từ nhiều ESP32 cùng lúc thay vì mỗi cảm biến cắm vào COM3 của một máy.
+# Giao thức giống hệt dòng Serial của firmware: mỗi mẫu một dòng "irValue,filteredFIR\n"; client có thể gửi
+# nhiều dòng trong một lần ghi (gom lô), máy chủ tách theo dòng nên ranh giới gói TCP không quan trọng.
+# Dòng đầu tiên có thể là "HELLO <tên>" để đặt tên luồng (máy chủ trả "OK <tên>"); nếu không, tên lấy
+# theo địa chỉ client. Mỗi tên là một Stream của predict.py (bộ đệm vòng, trạng thái cửa sổ, file kết quả
+# trong streams/<tên>/), kết nối lại cùng tên thì ghi tiếp; đặc trưng của mọi luồng chạy trên một nhóm worker chung.
+
+INGEST_HOST = "0.0.0.0"
+INGEST_PORT = 5050
+STATS_INTERVAL_SECONDS = 10
+HELLO_TIMEOUT_SECONDS = 5
+
+_STREAM_NAME = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+class IngestServer:
+    def __init__(self, pool, streams_dir=STREAMS_DIR, verbose=True, cascade_threshold=None, resample_rate=None,
+                 nonlinear_rate=None, ami_method=None, time_mode=None):
+        self.pool = pool
+        self.cascade_threshold = cascade_threshold
+        self.resample_rate = resample_rate
+        self.nonlinear_rate = nonlinear_rate
+        self.ami_method = ami_method
+        self.time_mode = time_mode
+        self.streams_dir = streams_dir
+        self.verbose = verbose
+        self.streams = {}
+        self.readers = {}
+        self.connected = set()
+
+    def _stream(self, name, peer):
+        if name not in self.streams:
+            stream = Stream(name, f"tcp:{peer}", os.path.join(self.streams_dir, name), self.pool,
+                            self.cascade_threshold, self.resample_rate, self.nonlinear_rate,
+                            self.ami_method, self.time_mode)
+            stream.verbose = self.verbose
+            self.streams[name] = stream
+            self.readers[name] = SerialBatchReader()
+        return self.streams[name], self.readers[name]
+
+    async def handle(self, reader, writer):
+        host, port = writer.get_extra_info("peername")[:2]
+        peer = f"{host}:{port}"
+        try:
+            first = await asyncio.wait_for(reader.readline(), HELLO_TIMEOUT_SECONDS)
+        except (asyncio.TimeoutError, ConnectionError):
+            writer.close()
+            return
+        if not first:
+            writer.close()
+            return
+        hello = first.startswith(b"HELLO ")
+        if hello:
+            name = first[len(b"HELLO "):].strip().decode("ascii", "replace")
+            first = b""
+        else:
+            name = f"{host}_{port}".replace(":", "_")
+        if not _STREAM_NAME.match(name) or name in self.connected:
+            writer.write(f"ERR tên luồng '{name}' không hợp lệ hoặc đang được dùng\n".encode())
+            await writer.drain()
+            writer.close()
+            return
+        if hello:
+            writer.write(f"OK {name}\n".encode())
+            await writer.drain()
+
+        stream, batch_reader = self._stream(name, peer)
+        self.connected.add(name)
+        print(f"🔌 [{name}] Kết nối từ {peer} ({len(self.connected)} luồng đang mở)")
+        csv_path = stream.path(CSV_FILE_NAME)
+        write_header = not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0
+        try:
+            with open(csv_path, "a", newline="") as csv_file:
+                csv_writer = csv.writer(csv_file)
+                if write_header:
+                    csv_writer.writerow(["Time (real)", "IR Value raw", "IR Value filtered", "Time (s)"])
+                if not batch_reader.started:
+                    # Lần kết nối đầu: bỏ WARMUP_SECONDS giây đầu để ổn định tín hiệu, giống serial_reader
+                    deadline = time.monotonic() + WARMUP_SECONDS
+                    while time.monotonic() < deadline:
+                        try:
+                            data = await asyncio.wait_for(reader.read(MAX_READ_BYTES), deadline - time.monotonic())
+                        except asyncio.TimeoutError:
+                            break
+                        if not data:
+                            return
+                    first = b""
+                    batch_reader.start_clock()
+                else:
+                    # Kết nối lại: đồng hồ của luồng chạy tiếp, bỏ phần dòng dở của kết nối cũ
+                    batch_reader.drop_partial()
+                    batch_reader.mark_discontinuity()
+                data = first
+                while True:
+                    if data:
+                        stream.ingest(batch_reader.feed(data), csv_writer)
+                    data = await reader.read(MAX_READ_BYTES)
+                    if not data:
+                        break
+        except ConnectionError as e:
+            print(f"⚠️ [{name}] Mất kết nối: {e}")
+        finally:
+            self.connected.discard(name)
+            writer.close()
+            print(f"🔌 [{name}] Ngắt kết nối ({len(self.connected)} luồng đang mở)")
+
+    async def report_stats(self, interval=STATS_INTERVAL_SECONDS):
+        # Định kỳ in thông lượng: nếu số cửa sổ hoàn tất thấp hơn số cửa sổ phát ra, nhóm worker đã quá tải
+        last = {}
+        last_time = time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            elapsed = now - last_time
+            samples = published = completed = 0
+            for name, stream in self.streams.items():
+                prev = last.get(name, (0, 0, 0))
+                current = (stream.samples_received, stream.next_window_id, stream.windows_completed)
+                samples += current[0] - prev[0]
+                published += current[1] - prev[1]
+                completed += current[2] - prev[2]
+                last[name] = current
+            last_time = now
+            print(f"📊 {len(self.connected)} luồng | {samples / elapsed:.0f} mẫu/s | "
+                  f"cửa sổ phát {published / elapsed:.1f}/s, hoàn tất {completed / elapsed:.1f}/s")
+
+    async def serve(self, host=INGEST_HOST, port=INGEST_PORT):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"🟢 Máy chủ nhận PPG đang lắng nghe tại {host}:{port}, {self.pool.workers} worker tính đặc trưng, "
+              f"{self.pool.process_workers} tiến trình phi tuyến")
+        models.start_watching()
+        stats = asyncio.create_task(self.report_stats())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            stats.cancel()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Máy chủ TCP nhận tín hiệu PPG từ nhiều cảm biến và chạy dự đoán")
+    parser.add_argument("--host", default=INGEST_HOST)
+    parser.add_argument("--port", type=int, default=INGEST_PORT)
+    parser.add_argument("--streams-dir", default=STREAMS_DIR, help="Thư mục chứa kết quả của từng luồng")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Số worker tính đặc trưng dùng chung (mặc định: số nhân CPU)")
+    parser.add_argument("--process-workers", type=int, default=os.cpu_count(),
+                        help="Số tiến trình tính đặc trưng phi tuyến (0: chạy ngay trong worker)")
+    parser.add_argument("--cascade", nargs="?", type=float, const=CASCADE_THRESHOLD, default=None, metavar="THRESHOLD",
+                        help=f"Dự đoán theo tầng (xem cascade.py), ngưỡng mặc định {CASCADE_THRESHOLD}")
+    parser.add_argument("--resample", nargs="?", type=float, const=RESAMPLE_RATE_HZ, default=None, metavar="HZ",
+                        help=f"Lấy mẫu lại lên lưới thời gian đều (xem resample.py), mặc định {RESAMPLE_RATE_HZ:g} Hz")
+    parser.add_argument("--nonlinear-rate", type=float, default=None, metavar="HZ",
+                        help="Tần số riêng cho miền phi tuyến (xem nonlinear_rate_eval.py)")
+    parser.add_argument("--ami-method", choices=["sklearn", "histogram"], default=None,
+                        help="Cách ước lượng AMI, phải khớp với model_nonlinear.pkl (mặc định sklearn)")
+    parser.add_argument("--time-mode", choices=["window", "beats"], default=None,
+                        help="Cách tính miền thời gian, phải khớp với model_time_domain.pkl (mặc định window)")
+    parser.add_argument("--quiet", action="store_true", help="Không in nhật ký từng cửa sổ, chỉ in thống kê")
+    args = parser.parse_args()
+
+    pool = SharedWorkerPool(args.workers, args.process_workers)
+    server = IngestServer(pool, args.streams_dir, verbose=not args.quiet, cascade_threshold=args.cascade,
+                          resample_rate=args.resample, nonlinear_rate=args.nonlinear_rate,
+                          ami_method=args.ami_method, time_mode=args.time_mode)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("⛔ Dừng máy chủ.")
+        pool.shutdown(wait=False)
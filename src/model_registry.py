@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+from collections import namedtuple
+
+import joblib
+
+from file_hash import file_sha256
+
+# Giữ các mô hình đã huấn luyện thường trú trong bộ nhớ thay vì joblib.load cả 4 file .pkl ở mỗi lần dự đoán.
+# Một luồng nền kiểm tra (size, mtime) của từng file mỗi `check_interval` giây; khi file đổi và đã ổn định
+# qua hai lần kiểm tra (tránh đọc file đang được ghi dở), sha256 được tính lại và chỉ khi nội dung khác
+# mới nạp bản mới. Bản mới được nạp xong rồi mới thay vào bằng một phép gán, nên các lượt dự đoán
+# đang chạy vẫn dùng trọn vẹn bản cũ; nạp lỗi thì giữ bản cũ và thử lại ở lần kiểm tra sau.
+
+MODEL_CHECK_INTERVAL_SECONDS = 2.0
+
+# version: 12 ký tự đầu của sha256 file; load_seconds: thời gian joblib.load; loaded_at: time.time() khi nạp
+ModelVersion = namedtuple("ModelVersion", ["model", "path", "version", "size", "mtime_ns", "load_seconds", "loaded_at"])
+
+
+def _file_stat(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+class ModelRegistry:
+    def __init__(self, paths, check_interval=MODEL_CHECK_INTERVAL_SECONDS):
+        self.paths = dict(paths)
+        self.check_interval = check_interval
+        self._entries = {}
+        self._pending = {}
+        self._load_lock = threading.Lock()
+        self._watcher = None
+        self._stop = threading.Event()
+
+    def _load(self, name, stat, digest=None):
+        path = self.paths[name]
+        digest = digest or file_sha256(path)
+        start = time.perf_counter()
+        model = joblib.load(path)
+        entry = ModelVersion(model, path, digest[:12], stat[0], stat[1], time.perf_counter() - start, time.time())
+        old = self._entries.get(name)
+        self._entries[name] = entry
+        action = "Nạp" if old is None else f"Thay {old.version} bằng"
+        print(f"📦 [Model] {action} '{os.path.basename(path)}' phiên bản {entry.version} ({entry.load_seconds * 1000:.0f} ms)")
+        return entry
+
+    def entry(self, name):
+        entry = self._entries.get(name)
+        if entry is None:
+            # Lần đầu: nạp ngay (chỉ một luồng nạp, các luồng khác chờ rồi dùng chung kết quả)
+            with self._load_lock:
+                entry = self._entries.get(name)
+                if entry is None:
+                    entry = self._load(name, _file_stat(self.paths[name]))
+        return entry
+
+    def get(self, name):
+        return self.entry(name).model
+
+    def versions(self):
+        return {name: {"version": e.version, "path": e.path, "load_seconds": e.load_seconds, "loaded_at": e.loaded_at}
+                for name, e in self._entries.items()}
+
+    def refresh(self):
+        # Một lượt kiểm tra; trả về danh sách mô hình đã được thay
+        reloaded = []
+        for name, path in self.paths.items():
+            entry = self._entries.get(name)
+            try:
+                stat = _file_stat(path)
+            except OSError:
+                continue  # file đang bị thay/xóa: giữ bản đang dùng
+            if entry is None or stat == (entry.size, entry.mtime_ns):
+                self._pending.pop(name, None)
+                continue
+            if self._pending.get(name) != stat:
+                # File vừa đổi: đợi thêm một lượt để chắc đã ghi xong
+                self._pending[name] = stat
+                continue
+            del self._pending[name]
+            with self._load_lock:
+                try:
+                    digest = file_sha256(path)
+                    if digest[:12] == entry.version:
+                        # Nội dung không đổi (chỉ chạm mtime): cập nhật stat, không nạp lại
+                        self._entries[name] = entry._replace(size=stat[0], mtime_ns=stat[1])
+                        continue
+                    self._load(name, stat, digest)
+                    reloaded.append(name)
+                except Exception as e:
+                    print(f"⚠️ [Model] Không nạp được '{path}', tiếp tục dùng phiên bản {entry.version}: {e}")
+        return reloaded
+
+    def _watch(self):
+        while not self._stop.wait(self.check_interval):
+            self.refresh()
+
+    def start_watching(self):
+        if self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch, name="model-registry", daemon=True)
+            self._watcher.start()
+
+    def stop_watching(self):
+        self._stop.set()
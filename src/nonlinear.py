@@ -5,27 +5,138 @@ import pandas as pd
 from scipy.stats import gaussian_kde
 from scipy.spatial.distance import pdist
 from scipy.signal import detrend
-from numpy.linalg import norm
 from sklearn.neighbors import NearestNeighbors
 from collections import Counter
 from sklearn.feature_selection import mutual_info_regression
+from scipy.spatial import cKDTree
+from numpy.lib.stride_tricks import sliding_window_view
+from functools import lru_cache
 import os
+from windowing import index_windows
+from result_sink import CSVResultSink
+from file_hash import file_sha256
+from ppg_archive import read_recording
+from resample import resample_uniform
 
 #Improved AMI Estimation
-def estimate_delay_ami(signal, max_lag):
+# "histogram": MI của mọi độ trễ tính một lượt trên tín hiệu đã lượng tử hóa (nhanh)
+# "sklearn": mutual_info_regression cho từng độ trễ (cách tính tham chiếu, chậm)
+# Mặc định vẫn là "sklearn": model_nonlinear.pkl được huấn luyện trên đặc trưng tính theo cách này, còn
+# "histogram" chọn độ trễ khác (vd. 43 thay vì 49) nên AMI/FNN/Lyapunov/ARE đều lệch. Chỉ bật "histogram"
+# (--ami-method histogram) khi đã tính lại Features_nonlinear và huấn luyện lại mô hình.
+AMI_METHOD = "sklearn"
+AMI_BINS = 16
+AMI_LAG_CHUNK = 10  # số độ trễ tính mỗi lượt khi dừng ở cực tiểu địa phương đầu tiên
+
+def _quantize(signal, bins):
+    signal = np.asarray(signal, dtype=float)
+    lo, hi = signal.min(), signal.max()
+    if hi == lo:
+        return np.zeros(len(signal), dtype=np.int64)
+    codes = ((signal - lo) / (hi - lo) * bins).astype(np.int64)
+    return np.minimum(codes, bins - 1)
+
+def ami_histogram(signal, lags, bins=AMI_BINS, codes=None):
+    # MI (nats) giữa x[t] và x[t + lag] cho tất cả các độ trễ trong `lags` bằng một lần bincount
+    if codes is None:
+        codes = _quantize(signal, bins)
+    lags = np.asarray(lags)
+    N = len(codes)
+    L = len(lags)
+    i = np.arange(N - lags.min())
+    valid = i[None, :] < (N - lags)[:, None]
+    y = codes[np.minimum(i[None, :] + lags[:, None], N - 1)]
+    flat = (np.arange(L)[:, None] * bins + codes[i][None, :]) * bins + y
+    joint = np.bincount(flat[valid], minlength=L * bins * bins).reshape(L, bins, bins)
+
+    p_xy = joint / joint.sum(axis=(1, 2), keepdims=True)
+    p_x = p_xy.sum(axis=2, keepdims=True)
+    p_y = p_xy.sum(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        terms = np.where(p_xy > 0, p_xy * np.log(p_xy / (p_x * p_y)), 0.0)
+    return terms.sum(axis=(1, 2))
+
+def ami_sklearn(signal, lags):
     mi_values = []
-    for lag in range(1, max_lag + 1):
+    for lag in lags:
         X = signal[:-lag].reshape(-1, 1)
         Y = signal[lag:]
         mi = mutual_info_regression(X, Y, discrete_features=False)
         mi_values.append(mi[0])
-
-    optimal_lag = np.argmin(mi_values) + 1 if mi_values else 1
+    return np.array(mi_values)
+
+def _first_local_minimum(mi_values):
+    for i in range(1, len(mi_values) - 1):
+        if mi_values[i] < mi_values[i - 1] and mi_values[i] < mi_values[i + 1]:
+            return i
+    return None
+
+def estimate_delay_ami(signal, max_lag, method=None, first_minimum=False, bins=AMI_BINS):
+    # Trả về (độ trễ tối ưu, giá trị AMI tại độ trễ đó).
+    # Mặc định chọn cực tiểu toàn cục trên 1..max_lag; first_minimum=True thì dừng
+    # ngay tại cực tiểu địa phương đầu tiên (không tính các độ trễ phía sau).
+    signal = np.asarray(signal)
+    method = method or AMI_METHOD
+    if method == "histogram":
+        codes = _quantize(signal, bins)
+        compute = lambda lags: ami_histogram(signal, lags, bins=bins, codes=codes)
+    elif method == "sklearn":
+        compute = lambda lags: ami_sklearn(signal, lags)
+    else:
+        raise ValueError(f"Phương pháp AMI không hợp lệ: {method}")
+
+    max_lag = min(max_lag, len(signal) - 1)
+    if max_lag < 1:
+        return 1, 0.0
+    if not first_minimum:
+        mi_values = compute(np.arange(1, max_lag + 1))
+    else:
+        mi_values = np.empty(0)
+        for start in range(1, max_lag + 1, AMI_LAG_CHUNK):
+            lags = np.arange(start, min(start + AMI_LAG_CHUNK, max_lag + 1))
+            mi_values = np.concatenate([mi_values, compute(lags)])
+            first = _first_local_minimum(mi_values)
+            if first is not None:
+                return first + 1, mi_values[first]
+
+    optimal_lag = int(np.argmin(mi_values)) + 1
     ami_value = mi_values[optimal_lag - 1]
     return optimal_lag, ami_value
 
 # FNN Estimation
+# Số láng giềng truy vấn mỗi điểm trên KD-tree; đủ để xử lý các trường hợp hòa khoảng cách
+FNN_QUERY_K = 16
+
+def _nearest_neighbors(points):
+    # Láng giềng gần nhất (không tính chính nó) của mọi điểm bằng một truy vấn KD-tree.
+    # Khi nhiều điểm cách đều thì chọn chỉ số nhỏ nhất, giống np.argmin trong cách tính vét cạn.
+    M = len(points)
+    tree = cKDTree(points)
+    dist, idx = tree.query(points, k=min(M, 3))
+    nearest_dist = dist[:, 1]
+    nearest_idx = idx[:, 1].copy()
+    if dist.shape[1] < 3:
+        return nearest_idx, nearest_dist
+
+    # Chỉ các điểm có láng giềng thứ 2 cách đều láng giềng thứ 1 mới cần truy vấn thêm
+    # (với khoảng cách > 0 thì cột 0 chắc chắn là chính điểm đó)
+    rows = np.flatnonzero((dist[:, 2] == nearest_dist) & (nearest_dist > 0))
+    if len(rows) == 0:
+        return nearest_idx, nearest_dist
+    dist_k, idx_k = tree.query(points[rows], k=min(M, FNN_QUERY_K))
+    ties = dist_k[:, 1:] == nearest_dist[rows, None]
+    nearest_idx[rows] = np.where(ties, idx_k[:, 1:], M).min(axis=1)
+
+    # Số điểm hòa có thể vượt quá FNN_QUERY_K: tìm lại trong hình cầu bán kính nearest_dist
+    for i in rows[ties[:, -1]]:
+        candidates = np.array(tree.query_ball_point(points[i], nearest_dist[i] * (1 + 1e-9)))
+        candidates = candidates[candidates != i]
+        cand_dist = np.linalg.norm(points[candidates] - points[i], axis=1)
+        nearest_idx[i] = candidates[np.isclose(cand_dist, nearest_dist[i], rtol=1e-12, atol=0)].min()
+    return nearest_idx, nearest_dist
+
 def calculate_fnn(signal, delay, max_dim, Rtol=10.0, Atol=None):
+    signal = np.asarray(signal)
     if Atol is None:
         Atol = 2.0 * np.std(signal)
 
@@ -36,24 +147,23 @@ def calculate_fnn(signal, delay, max_dim, Rtol=10.0, Atol=None):
         M = N - (d + 1) * delay
         if M <= 0:
             break
+        if M == 1:
+            fnn_percentages.append(0.0)
+            continue
 
-        embedded_d = np.array([signal[i:i + d * delay:delay] for i in range(M)])
-        embedded_d1 = np.array([signal[i:i + (d + 1) * delay:delay] for i in range(M)])
-
-        false_nearest = 0
-        for i in range(M):
-            dists = np.linalg.norm(embedded_d - embedded_d[i], axis=1)
-            dists[i] = np.inf  # bỏ chính nó
-            nearest_idx = np.argmin(dists)
+        # Hàng i = signal[i], signal[i + delay], ..., signal[i + d*delay] (view, không sao chép)
+        embedded_d1 = sliding_window_view(signal, d * delay + 1)[:M, ::delay].astype(float)
+        embedded_d = embedded_d1[:, :d]
 
-            dist_d = dists[nearest_idx]
-            dist_d1 = np.linalg.norm(embedded_d1[i] - embedded_d1[nearest_idx])
+        nearest_idx, dist_d = _nearest_neighbors(embedded_d)
+        diff_d1 = embedded_d1 - embedded_d1[nearest_idx]
+        dist_d1 = np.sqrt(np.einsum("ij,ij->i", diff_d1, diff_d1))
 
-            if dist_d == 0:
-                continue
-
-            if dist_d1 / dist_d > Rtol or abs(signal[i + d * delay] - signal[nearest_idx + d * delay]) > Atol:
-                false_nearest += 1
+        # Bỏ qua các điểm trùng nhau (dist_d == 0), giống cách tính vét cạn
+        valid = dist_d > 0
+        ratio = np.divide(dist_d1, dist_d, out=np.zeros_like(dist_d1), where=valid)
+        last = np.abs(embedded_d1[:, d] - embedded_d1[nearest_idx, d])
+        false_nearest = np.count_nonzero(valid & ((ratio > Rtol) | (last > Atol)))
 
         fnn_percentages.append(false_nearest / M * 100)
 
@@ -73,48 +183,91 @@ def plot_fnn(fnn_vals):
 
 
 def reconstruct_phase_space(signal, delay, embedding_dimension):
-    n_points = len(signal) - (embedding_dimension - 1) * delay
-    return np.array([signal[i:i + embedding_dimension * delay:delay] for i in range(n_points)])
+    # Hàng i = signal[i], signal[i + delay], ... (view theo stride, không sao chép)
+    span = (embedding_dimension - 1) * delay + 1
+    return sliding_window_view(np.asarray(signal), span)[:, ::delay]
+
+class PhaseSpace:
+    # Không gian pha của một cửa sổ: dựng một lần, fit chỉ mục láng giềng một lần
+    # và dùng chung cho Lyapunov và ARE (sai số tái tạo attractor).
+    def __init__(self, points):
+        self.points = points
+        self._distances = None
+        self._indices = None
+
+    @classmethod
+    def from_signal(cls, signal, delay, embedding_dimension):
+        return cls(reconstruct_phase_space(signal, delay, embedding_dimension))
+
+    def __len__(self):
+        return len(self.points)
+
+    def neighbors(self):
+        if self._indices is None:
+            nbrs = NearestNeighbors(n_neighbors=2).fit(self.points)
+            self._distances, self._indices = nbrs.kneighbors(self.points)
+        return self._distances, self._indices
+
+    def _pair_distances(self, i, j):
+        diff = self.points[i].astype(float) - self.points[j]
+        return np.sqrt(np.einsum("ij,ij->i", diff, diff))
+
+    def lyapunov_exponent(self, k=10):
+        n = len(self.points)
+        distances, indices = self.neighbors()
+        i = np.arange(1, max(n - k, 1))
+        nbr = indices[i, 1]
+        keep = nbr + k < n
+        i, nbr = i[keep], nbr[keep]
+        d0 = distances[i, 1]
+        d1 = self._pair_distances(i + k, nbr + k)
+        keep = (d0 > 0) & (d1 > 0)
+        return np.mean(np.log(d1[keep] / d0[keep])) / k if keep.any() else 0
+
+    def reconstruction_error(self, delay):
+        N = len(self.points)
+        if N < 2:
+            return np.nan
+        _, indices = self.neighbors()
+        i = np.arange(max(N - delay, 0))
+        nbr = indices[i, 1]
+        keep = nbr + delay < N
+        errors = self._pair_distances(i[keep] + delay, nbr[keep] + delay)
+        return np.mean(errors) if len(errors) else np.nan
 
 def calculate_lyapunov_exponent(phase_space, k=10):
-    nbrs = NearestNeighbors(n_neighbors=2).fit(phase_space)
-    distances, indices = nbrs.kneighbors(phase_space)
-    divergence = []
-    for i in range(1, len(phase_space)):
-        d0 = distances[i, 1]
-        if i + k < len(phase_space) and indices[i, 1] + k < len(phase_space):
-            d1 = norm(phase_space[i + k] - phase_space[indices[i, 1] + k])
-            if d0 > 0 and d1 > 0:
-                divergence.append(np.log(d1 / d0))
-    return np.mean(divergence) / k if divergence else 0
+    return PhaseSpace(phase_space).lyapunov_exponent(k)
 
 def calculate_attractor_reconstruction_error(phase_space, delay):
-    N = len(phase_space)
-    if N < 2:
-        return np.nan
-    indices = NearestNeighbors(n_neighbors=2).fit(phase_space).kneighbors(phase_space, return_distance=False)
-    errors = []
-    for i in range(N - delay):
-        neighbor_idx = indices[i, 1]
-        if neighbor_idx + delay < N:
-            original_next = phase_space[i + delay]
-            predicted_next = phase_space[neighbor_idx + delay]
-            errors.append(norm(original_next - predicted_next))
-    return np.mean(errors) if errors else np.nan
-
-def calculate_dfa(signal, scales=None):
+    return PhaseSpace(phase_space).reconstruction_error(delay)
+
+DFA_SCALES = [10, 20, 40, 80, 100]
+
+def log_spaced_scales(min_scale, max_scale, count):
+    # Các scale nguyên cách đều theo thang log, ví dụ log_spaced_scales(10, 300, 12)
+    scales = np.round(np.logspace(np.log10(min_scale), np.log10(max_scale), count)).astype(int)
+    return np.unique(scales)
+
+@lru_cache(maxsize=None)
+def _detrend_basis(scale, order):
+    # Cơ sở trực chuẩn Q của các đa thức bậc <= order trên một đoạn dài `scale`;
+    # phần dư sau khi khử xu hướng là x - Q Qᵀ x (phép chiếu bình phương tối thiểu dạng đóng)
+    x = np.linspace(-1.0, 1.0, scale)
+    q, _ = np.linalg.qr(np.vander(x, order + 1))
+    return q
+
+def calculate_dfa(signal, scales=None, order=1):
     if scales is None:
-        scales = [10, 20, 40, 80, 100]
+        scales = DFA_SCALES
+    signal = np.asarray(signal, dtype=float)
     flucts = []
     for scale in scales:
         segments = len(signal) // scale
-        reshaped = np.reshape(signal[:segments * scale], (segments, scale))
-        F = []
-        for segment in reshaped:
-            x = np.arange(scale)
-            trend = np.polyfit(x, segment, 1)
-            detrended = segment - np.polyval(trend, x)
-            F.append(np.sqrt(np.mean(detrended ** 2)))
+        # Ma trận segments x scale, khử xu hướng tất cả các đoạn cùng lúc
+        reshaped = signal[:segments * scale].reshape(segments, scale)
+        q = _detrend_basis(int(scale), order)
+        detrended = reshaped - (reshaped @ q) @ q.T
+        F = np.sqrt(np.mean(detrended ** 2, axis=1))
         flucts.append(np.mean(F))
     log_scales = np.log(scales)
     log_flucts = np.log(flucts)
@@ -163,70 +316,107 @@ def plot_density_2d(attractor_2d, title="2D Density Plot", xlabel="v'", ylabel="
     plt.show()
 
 
+NONLINEAR_FEATURE_COLUMNS = ["AMI", "FNN", "Lyapunov", "ARE", "DFA"]
+NONLINEAR_MAX_LAG = 50
+NONLINEAR_MAX_DIM = 10
+NONLINEAR_RESULT_FILE_NAME = "nonlinear_result.csv"
+# Chế độ giảm tần số cho riêng miền phi tuyến: AMI/FNN/Lyapunov/ARE tăng nhanh hơn tuyến tính theo số mẫu,
+# nên tính trên tín hiệu đã lấy mẫu lại ở tần số thấp hơn (vd. 15 Hz thay cho ~25-50 Hz) rẻ hơn nhiều.
+# None: dùng tần số gốc. Độ trễ, chiều nhúng và scale DFA vẫn tính theo số mẫu nên giá trị đặc trưng
+# đổi theo tần số: mô hình phải được huấn luyện lại ở cùng tần số (xem nonlinear_rate_eval.py).
+NONLINEAR_RATE_HZ = None
+
+
+def nonlinear_window_features(windowed_signal, max_lag=NONLINEAR_MAX_LAG, max_dim=NONLINEAR_MAX_DIM, ami_method=None):
+    optimal_delay, amivalue = estimate_delay_ami(windowed_signal, max_lag=max_lag, method=ami_method)
+    fnn_vals = calculate_fnn(windowed_signal, delay=optimal_delay, max_dim=max_dim)
+    fnn = plot_fnn(fnn_vals)
+    embedding_dimension = next((d + 1 for d, val in enumerate(fnn_vals) if val < 1), 3)
+
+    phase_space = PhaseSpace.from_signal(windowed_signal, optimal_delay, embedding_dimension)
+    lyap = phase_space.lyapunov_exponent()
+    reconstruction_error = phase_space.reconstruction_error(delay=optimal_delay)
+    dfa = calculate_dfa(windowed_signal)
+    return [amivalue, fnn, lyap, reconstruction_error, dfa]
+
+
+def reduce_rate(time, ir_signal, rate=None):
+    # Tín hiệu trên lưới đều `rate` Hz (giảm tần số có lọc chống chồng phổ); rate=None: giữ nguyên
+    if rate is None:
+        return ir_signal
+    return resample_uniform(time, ir_signal, rate).signal
+
+
+def nonlinear_window_bounds(time, window_seconds=60, stride_seconds=1, rate=None):
+    # Cửa sổ theo số mẫu [lo, hi). Trên lưới đều (rate khác None) dùng đúng tần số của lưới: ước lượng
+    # 1 / mean(diff) có sai số dấu phẩy động làm int() cắt 900 thành 899 mẫu, 15 thành 14 mẫu bước trượt.
+    # Dùng chung cho extract_nonlinear_features và extract_features.count_windows để số cửa sổ luôn khớp.
+    fs = rate if rate is not None else 1 / np.mean(np.diff(time))
+    return index_windows(len(time), int(window_seconds * fs), int(stride_seconds * fs))
+
+
+def extract_nonlinear_features(time, ir_signal, labels, window_seconds=60, stride_seconds=1, windows=None,
+                               rate=NONLINEAR_RATE_HZ, ami_method=None):
+    # Cửa sổ theo số mẫu; `windows`: slice chọn một phần danh sách cửa sổ (để chia việc cho nhiều tiến trình)
+    if rate is not None:
+        grid = resample_uniform(time, ir_signal, rate)
+        time, ir_signal, labels = grid.time, grid.signal, np.asarray(labels)[grid.source_index]
+    lo, hi = nonlinear_window_bounds(time, window_seconds, stride_seconds, rate)
+    if windows is not None:
+        lo, hi = lo[windows], hi[windows]
+
+    nonlinear_results = []
+    for i, i_end in zip(lo, hi):
+        windowed_signal = ir_signal[i:i_end]
+        if len(windowed_signal) < 60:
+            continue
+        try:
+            features = nonlinear_window_features(windowed_signal, ami_method=ami_method)
+        except Exception as e:
+            print(f"Lỗi tại {time[i]:.2f}s: {e}")
+            continue
+        nonlinear_results.append([time[i], time[i_end - 1], *features, labels[i_end - 1]])
+
+    return pd.DataFrame(nonlinear_results, columns=["Time start", "Time end", *NONLINEAR_FEATURE_COLUMNS, "Label"])
+
+
 if __name__ == "__main__":
     file_path = "data/data_Cong_11062025.csv"
     try:
-        df = pd.read_csv(file_path)
+        df = read_recording(file_path)
         if "Time (s)" in df.columns and "IR Value filtered" in df.columns:
             df = df.drop_duplicates(subset=["Time (s)"]).sort_values(by=["Time (s)"])
             time = np.array(df["Time (s)"])
             ir_signal = np.array(df["IR Value filtered"])
-            fs = 1 / np.mean(np.diff(time))
             label = np.array(df["Label"])
 
-            window_size = int(60 * fs)
-            stride = int(1 * fs)
-            nonlinear_results = []
-
-            for i in range(0, len(ir_signal) - window_size + 1, stride):
-                windowed_signal = ir_signal[i:i + window_size]
-                windowed_time = time[i:i + window_size]
-                time_start = time[i]
-                time_end = time[i + window_size - 1]
-                most_commom_label = label[i + window_size - 1]
-
-                if len(windowed_signal) < 60:
-                    continue
-                try:
-                    optimal_delay, amivalue = estimate_delay_ami(windowed_signal, max_lag=50)
-                    fnn_vals = calculate_fnn(windowed_signal, delay=optimal_delay, max_dim=10)
-                    fnn = plot_fnn(fnn_vals)
-                    embedding_dimension = next((d + 1 for d, val in enumerate(fnn_vals) if val < 1), 3)
-
-                    # attractor_3d = reconstruct_phase_space(windowed_signal, optimal_delay, 3)
-
-                    # plt.figure(figsize=(8, 4))
-                    # plt.plot(windowed_time, windowed_signal)
-                    # plt.title(f"PPG Signal ({time[i]:.2f}s)")
-                    # plt.xlabel("Time (s)")
-                    # plt.ylabel("PPG")
-                    # plt.show()
-
-                    # plot_attractor_3d(attractor_3d, title=f"3D Attractor ({time[i]:.2f}s)")
-
-                    # normal_vector = np.array([1, 1, 1])
-                    # attractor_2d = projection_on_plane(attractor_3d, normal_vector)
-
-                    # plot_attractor_2d_projection(attractor_2d, title=f"2D Attractor ({time[i]:.2f}s)")
-                    # plot_density_2d(attractor_2d, title=f"2D Density ({time[i]:.2f}s)")
-
-                    phase_space = reconstruct_phase_space(windowed_signal, optimal_delay, embedding_dimension)
-                    lyap = calculate_lyapunov_exponent(phase_space)
-                    reconstruction_error = calculate_attractor_reconstruction_error(phase_space, delay=optimal_delay)
-                    dfa = calculate_dfa(windowed_signal)
-                    nonlinear_results.append([time_start, time_end, amivalue, fnn, lyap, reconstruction_error, dfa, most_commom_label])
-                    
-                    
-            
-                    nonlinear_df = pd.DataFrame(nonlinear_results, columns=["Time start", "Time end", "AMI", "FNN", "Lyapunov", "ARE", "DFA", "Label"])
-                    nonlinear_df.to_csv("nonlinear_result.csv", index=False)
-                
-                except Exception as e:
-                    print(f"Lỗi tại {time[i]:.2f}s: {e}")
-
-            
-            print(f"✅ Đã xử lý và lưu : nonlinear_result.csv'")
+            # Nối thêm từng hàng theo lô; chạy lại trên cùng bản ghi (cùng sha256) thì tính tiếp từ cửa sổ cuối
+            # cùng đã ghi, còn file kết quả của bản ghi khác thì báo lỗi thay vì nối lẫn vào
+            source = f"{os.path.basename(file_path)} sha256={file_sha256(file_path)}"
+            sink = CSVResultSink(NONLINEAR_RESULT_FILE_NAME, ["Time start", "Time end", *NONLINEAR_FEATURE_COLUMNS, "Label"],
+                                 source=source)
+            if sink.last_key is not None:
+                print(f"↩️ Tiếp tục sau cửa sổ {sink.last_key:.2f}s ({sink.rows_written} cửa sổ đã có)")
+
+            # Đóng sink (ghi nốt các hàng trong bộ đệm) kể cả khi bị dừng bằng Ctrl+C
+            with sink:
+                for i, i_end in zip(*nonlinear_window_bounds(time)):
+                    if sink.last_key is not None and time[i] <= sink.last_key:
+                        continue
+                    windowed_signal = ir_signal[i:i_end]
+                    if len(windowed_signal) < 60:
+                        continue
+                    try:
+                        features = nonlinear_window_features(windowed_signal)
+                    except Exception as e:
+                        print(f"Lỗi tại {time[i]:.2f}s: {e}")
+                        continue
+                    sink.append([time[i], time[i_end - 1], *features, label[i_end - 1]])
+
+            print(f"✅ Đã xử lý và lưu : {NONLINEAR_RESULT_FILE_NAME}")
         else:
             print(f"⚠️ File thiếu cột cần thiết")
+    except ValueError as e:
+        print(f"❌ {e}")
     except Exception as e:
         print(f"⚠️ Lỗi không mong muốn: {e}")
\ No newline at end of file
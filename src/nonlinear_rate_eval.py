@@ -0,0 +1,150 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import GroupShuffleSplit, train_test_split
+
+from feature_store import FEATURE_SOURCES, FeatureStore
+from nonlinear import NONLINEAR_FEATURE_COLUMNS, nonlinear_window_bounds, nonlinear_window_features
+from ppg_archive import ARCHIVE_EXTENSION, read_recording
+from resample import resample_uniform
+
+# Đánh giá chế độ giảm tần số của miền phi tuyến (nonlinear.NONLINEAR_RATE_HZ / predict.py --nonlinear-rate):
+#   1. lấy mẫu đều `--windows` cửa sổ mỗi bản ghi trong Features_nonlinear (kho đặc trưng), giữ nguyên
+#      thời điểm đầu/cuối và nhãn "Label bin" của cửa sổ đó;
+#   2. với từng tần số (kể cả tần số gốc), tính lại 5 đặc trưng phi tuyến trên đúng đoạn tín hiệu ấy và đo
+#      CPU-giây mỗi cửa sổ (lấy mẫu lại + nonlinear_window_features, như tiến trình phi tuyến của predict.py);
+#   3. huấn luyện RandomForest như randomforest.py trên đặc trưng của từng tần số, cùng một cách chia tập,
+#      và báo độ chính xác so với tần số gốc; hàng "stored" dùng chính giá trị trong kho làm đối chứng.
+#   python src/nonlinear_rate_eval.py --rates 25 20 15 10 5 --windows 40
+
+DEFAULT_RATES = [25, 20, 15, 10, 5]
+DEFAULT_WINDOWS_PER_RECORDING = 40
+RECORDING_DIRS = ["data", "predict_data"]
+NATIVE = "native"
+WINDOW_SECONDS = 60
+
+
+def find_recording(name, directories):
+    for directory in directories:
+        for extension in (".csv", ARCHIVE_EXTENSION):
+            path = os.path.join(directory, name + extension)
+            if os.path.exists(path):
+                return path
+    return None
+
+
+def sample_windows(store, per_recording, directories):
+    # Các cửa sổ cách đều trong mỗi bản ghi có file gốc; trả về DataFrame kèm đường dẫn bản ghi
+    source = FEATURE_SOURCES["nonlinear"]
+    df = store.load("nonlinear", keys=True)
+    picked = []
+    for recording, rows in df.groupby("Recording", sort=True):
+        path = find_recording(recording, directories)
+        if path is None:
+            print(f"⚠️ Bỏ qua '{recording}': không tìm thấy bản ghi gốc")
+            continue
+        index = np.unique(np.linspace(0, len(rows) - 1, min(per_recording, len(rows))).round().astype(int))
+        rows = rows.iloc[index].copy()
+        rows["Path"] = path
+        picked.append(rows)
+    windows = pd.concat(picked, ignore_index=True)
+    return windows.rename(columns={source.start_column: "Start", source.end_column: "End"})
+
+
+def rate_window(time_arr, ir_signal, a, b, rate):
+    # Đoạn [a, b) ở tần số `rate` với đúng số mẫu như extract_nonlinear_features tạo ra (int(60 * rate));
+    # lấy thêm một mẫu gốc sau b để lưới đều phủ hết tới cuối cửa sổ
+    if rate == NATIVE:
+        return ir_signal[a:b]
+    grid = resample_uniform(time_arr[a:b + 1], ir_signal[a:b + 1], rate)
+    lo, hi = nonlinear_window_bounds(grid.time, WINDOW_SECONDS, rate=rate)
+    return grid.signal[lo[0]:hi[0]] if len(lo) else grid.signal
+
+
+def compute_features(windows, rates):
+    # {tần số: (ma trận đặc trưng, CPU-giây từng cửa sổ, số mẫu từng cửa sổ)}
+    results = {rate: (np.full((len(windows), len(NONLINEAR_FEATURE_COLUMNS)), np.nan),
+                      np.zeros(len(windows)), np.zeros(len(windows), dtype=int)) for rate in rates}
+    for path, rows in windows.groupby("Path", sort=False):
+        df = read_recording(path, ["Time (s)", "IR Value filtered"]).dropna()
+        df = df.drop_duplicates(subset=["Time (s)"]).sort_values(by="Time (s)")
+        time_arr = df["Time (s)"].to_numpy(dtype=np.float64)
+        ir_signal = df["IR Value filtered"].to_numpy(dtype=np.float64)
+        lo = np.searchsorted(time_arr, rows["Start"].to_numpy(), side="left")
+        hi = np.searchsorted(time_arr, rows["End"].to_numpy(), side="right")
+        for row, a, b in zip(rows.index, lo, hi):
+            for rate in rates:
+                features, costs, samples = results[rate]
+                start = time.process_time()
+                signal = rate_window(time_arr, ir_signal, a, b, rate)
+                try:
+                    with np.errstate(all="ignore"):
+                        features[row] = nonlinear_window_features(signal)
+                except Exception:
+                    pass  # cửa sổ quá ngắn / suy biến: để NaN, bị loại ở mọi tần số
+                costs[row] = time.process_time() - start
+                samples[row] = len(signal)
+        print(f"   {os.path.basename(path)}: {len(rows)} cửa sổ")
+    return results
+
+
+def evaluate(X, y, train, test):
+    model = RandomForestClassifier(n_estimators=100, random_state=42)
+    model.fit(X[train], y[train])
+    return np.mean(model.predict(X[test]) == y[test])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chi phí CPU và độ chính xác của miền phi tuyến ở các tần số lấy mẫu")
+    parser.add_argument("--rates", type=float, nargs="+", default=DEFAULT_RATES, help="Các tần số cần thử (Hz)")
+    parser.add_argument("--windows", type=int, default=DEFAULT_WINDOWS_PER_RECORDING,
+                        help="Số cửa sổ lấy từ mỗi bản ghi")
+    parser.add_argument("--recording-dirs", nargs="+", default=RECORDING_DIRS,
+                        help="Thư mục chứa bản ghi gốc (tên file trùng cột Recording của kho đặc trưng)")
+    parser.add_argument("--by-recording", action="store_true",
+                        help="Tách tập kiểm tra theo bản ghi thay vì ngẫu nhiên theo cửa sổ (như randomforest.py)")
+    parser.add_argument("--output", default=None, help="Lưu bảng kết quả ra CSV")
+    args = parser.parse_args()
+
+    windows = sample_windows(FeatureStore(), args.windows, args.recording_dirs)
+    rates = [NATIVE] + sorted(set(args.rates), reverse=True)
+    print(f"📊 {len(windows)} cửa sổ từ {windows['Recording'].nunique()} bản ghi, tần số: "
+          + ", ".join(str(r) if r == NATIVE else f"{r:g} Hz" for r in rates))
+    results = compute_features(windows, rates)
+
+    # Chỉ giữ cửa sổ tính được ở mọi tần số để các hàng so sánh trên cùng tập cửa sổ
+    valid = np.all([np.isfinite(results[rate][0]).all(axis=1) for rate in rates], axis=0)
+    stored = windows[NONLINEAR_FEATURE_COLUMNS].to_numpy(dtype=np.float64)
+    valid &= np.isfinite(stored).all(axis=1)
+    y = windows["Label bin"].to_numpy()[valid]
+    index = np.arange(len(y))
+    if args.by_recording:
+        train, test = next(GroupShuffleSplit(test_size=0.2, random_state=42).split(
+            index, y, windows["Recording"].to_numpy()[valid]))
+    else:
+        train, test = train_test_split(index, test_size=0.2, random_state=42, stratify=y)
+    print(f"🧪 {valid.sum()}/{len(windows)} cửa sổ hợp lệ, huấn luyện {len(train)}, kiểm tra {len(test)}")
+
+    native_cost = np.mean(results[NATIVE][1][valid])
+    native_accuracy = evaluate(results[NATIVE][0][valid], y, train, test)
+    rows = [{"Rate": "stored", "Samples/window": np.nan, "ms/window": np.nan, "p95 ms": np.nan,
+             "Speedup": np.nan, "Accuracy": evaluate(stored[valid], y, train, test), "Δ Accuracy": np.nan}]
+    for rate in rates:
+        features, costs, samples = results[rate]
+        accuracy = native_accuracy if rate == NATIVE else evaluate(features[valid], y, train, test)
+        rows.append({"Rate": rate if rate == NATIVE else f"{rate:g} Hz",
+                     "Samples/window": np.median(samples[valid]),
+                     "ms/window": np.mean(costs[valid]) * 1000,
+                     "p95 ms": np.percentile(costs[valid], 95) * 1000,
+                     "Speedup": native_cost / np.mean(costs[valid]),
+                     "Accuracy": accuracy,
+                     "Δ Accuracy": accuracy - native_accuracy})
+    result = pd.DataFrame(rows)
+    print(result.to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+    if args.output:
+        result.to_csv(args.output, index=False)
+        print(f"✅ Đã lưu kết quả vào '{args.output}'")
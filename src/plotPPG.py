@@ -2,13 +2,15 @@ import serial
 import pyqtgraph as pg
 from pyqtgraph.Qt import QtCore, QtWidgets
 from collections import deque
-from datetime import datetime
-import pytz
-import time
 import csv
+import os
+import time
+from serial_ingest import SerialBatchReader, batch_rows
+from replay_serial import open_serial
 
 
-SERIAL_PORT = 'COM3'
+# Có thể thay bằng cổng ảo phát lại bản ghi, vd. PPG_SERIAL_PORT="replay:data/data_04042025.csv?speed=10"
+SERIAL_PORT = os.environ.get("PPG_SERIAL_PORT", 'COM3')
 SERIAL_BAUD = 115200
 CSV_FILE_NAME = "data.csv"
 GRAPH_TITLE = "Real-time MAX30102 IR Signal Plot"
@@ -18,11 +20,11 @@ Y_RANGE = (85000, 90000)
 X_RANGE_SECONDS = 20
 UPDATE_INTERVAL_MS = 10
 DATA_BUFFER_SIZE = 2000
-CSV_WRITE_INTERVAL_SECONDS = 0
+CSV_WRITE_INTERVAL_SECONDS = 0  # 0: flush data.csv sau mỗi lô; > 0: tối đa một lần mỗi N giây
 
 # Kết nối Serial
 try:
-    ser = serial.Serial(SERIAL_PORT, SERIAL_BAUD)
+    ser = open_serial(SERIAL_PORT, SERIAL_BAUD)
 except serial.SerialException as e:
     print(f"Lỗi kết nối Serial: {e}")
     exit()
@@ -31,18 +33,13 @@ except serial.SerialException as e:
 csv_file = open(CSV_FILE_NAME, "w", newline="")
 csv_writer = csv.writer(csv_file)
 csv_writer.writerow(["Time (real)", "IR Value raw", "IR Value filtered", "Time (s)"])
+last_flush = time.monotonic()
 
 # Khởi tạo ứng dụng và cửa sổ
 app = QtWidgets.QApplication([])
 win = pg.GraphicsLayoutWidget(title=GRAPH_TITLE)
 win.resize(WINDOW_WIDTH, WINDOW_HEIGHT)
 
-# Định nghĩa múi giờ Việt Nam
-vn_tz = pytz.timezone('Asia/Ho_Chi_Minh')
-
-def get_vietnam_time():
-    return datetime.now(vn_tz).strftime("%Y-%m-%d %H:%M:%S")
-
 # Tạo đồ thị
 plot = win.addPlot(title="IR Signal vs Time (seconds)")
 plot.setLabel('bottom', 'Time (seconds)')
@@ -57,31 +54,28 @@ data_goc = deque([0] * DATA_BUFFER_SIZE, maxlen=DATA_BUFFER_SIZE)
 data_loc = deque([0] * DATA_BUFFER_SIZE, maxlen=DATA_BUFFER_SIZE)
 time_data = deque([0] * DATA_BUFFER_SIZE, maxlen=DATA_BUFFER_SIZE)
 
-# Bắt đầu đếm thời gian
-start_time = time.time()
-last_csv_write_time = start_time
+# Bắt đầu đếm thời gian (đồng hồ đơn điệu của bộ đọc theo lô)
+reader = SerialBatchReader(ser)
+reader.start_clock()
 
 # Hàm cập nhật đồ thị
 def update():
-    global data_goc, data_loc, time_data, curve_goc, curve_loc, start_time, last_csv_write_time
+    global data_goc, data_loc, time_data, curve_goc, curve_loc, last_flush
     try:
-        while ser.in_waiting:
-            line = ser.readline().decode('utf-8').strip()
-            try:
-                ir_value_goc, ir_value_loc = map(int, line.split(','))
-            except ValueError:
-                continue
-
-            current_time = time.time() - start_time
-            real_time = get_vietnam_time()
-            data_goc.append(ir_value_goc)
-            data_loc.append(ir_value_loc)
-            time_data.append(current_time)
-
-            # Ghi vào file CSV theo lô
-            csv_writer.writerow([real_time, ir_value_goc, ir_value_loc, current_time])
-            csv_file.flush()
-            last_csv_write_time = current_time
+        # Lấy toàn bộ mẫu đã về trong một lần đọc, không chặn luồng giao diện
+        batch = reader.read_batch(block=False)
+        if len(batch.elapsed):
+            data_goc.extend(batch.ir_raw.tolist())
+            data_loc.extend(batch.ir_filtered.tolist())
+            time_data.extend(batch.elapsed.tolist())
+
+            # Ghi vào file CSV theo lô; flush theo lô (không theo từng mẫu) để ứng dụng bị tắt đột ngột
+            # chỉ mất tối đa một lô / CSV_WRITE_INTERVAL_SECONDS dữ liệu
+            csv_writer.writerows(batch_rows(batch))
+            now = time.monotonic()
+            if now - last_flush >= CSV_WRITE_INTERVAL_SECONDS:
+                csv_file.flush()
+                last_flush = now
 
         # Cập nhật đồ thị với trục X là thời gian
         curve_goc.setData(list(time_data), list(data_goc))
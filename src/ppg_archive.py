@@ -0,0 +1,402 @@
+import argparse
+import glob
+import io
+import json
+import mmap
+import os
+import struct
+import time as timer
+import zlib
+
+import numpy as np
+import pandas as pd
+
+# Định dạng nhị phân .ppgz cho bản ghi PPG thô, thay cho CSV (mỗi hàng lặp lại chuỗi ngày giờ,
+# mọi số lưu dạng văn bản). Bố cục file:
+#   [8 byte magic "PPGZ\x00\x00\x00\x01"][8 byte vị trí footer][các khối dữ liệu ...][footer JSON]
+# Tín hiệu được chia thành từng đoạn (chunk) CHUNK_SAMPLES mẫu; mỗi cột của mỗi đoạn là một khối:
+#   - số nguyên (IR raw int32, IR filtered int16, nhãn int16): lưu hiệu giữa hai mẫu liên tiếp
+#   - Time (s): số tick nguyên rồi lưu hiệu giữa các tick int64; khi đọc chia cho số tick mỗi giây (không
+#     nhân với 1e-6) nên giá trị thập phân trong CSV được khôi phục đúng từng bit. Độ phân giải là mức thô
+#     nhất từ TIME_RESOLUTION (1 µs) tới MIN_TIME_RESOLUTION (1 ns) mà phép chia đó tái tạo chính xác mọi
+#     giá trị; nếu không có (vd. time.time() ghi đủ 17 chữ số) hoặc time_resolution=0 thì lưu hiệu giữa
+#     các mẫu bit của float64 (xem như int64), không mất chính xác nhưng file lớn hơn ~1.5 lần
+#   - "Time (real)": số giây Unix (int64), cũng lưu dạng hiệu; kiểu định dạng chuỗi gốc ghi trong footer để
+#     đọc lại ra đúng chuỗi như trong CSV
+# rồi xáo byte (byte shuffle: byte thứ k của mọi phần tử đứng cạnh nhau) và nén zlib.
+# Footer ghi chỉ mục đoạn (vị trí, thời điểm nhỏ nhất/lớn nhất) nên có thể đọc một khoảng bất kỳ mà không
+# giải nén cả file; file được mmap và các khối được giải nén thẳng từ vùng nhớ ánh xạ.
+#
+# load_span(recording, t0, t1) chỉ đọc các mẫu có Time (s) trong [t0, t1]: với .ppgz dùng chỉ mục đoạn
+# ở footer, với .csv dùng file chỉ mục phụ "<file>.csv.tidx" (vị trí byte và khoảng thời gian của mỗi
+# khối INDEX_ROWS hàng), được tạo ở lần đọc đầu tiên và tạo lại khi file CSV thay đổi.
+
+ARCHIVE_EXTENSION = ".ppgz"
+CHUNK_SAMPLES = 1 << 13  # ~7 phút ở ~20 mẫu/giây: đọc một khoảng ngắn chỉ giải nén 1-2 đoạn
+COMPRESS_LEVEL = 6
+TIME_RESOLUTION = 1e-6
+MIN_TIME_RESOLUTION = 1e-9  # phần lớn bản ghi có Time (s) 7-9 chữ số thập phân
+
+_MAGIC = b"PPGZ\x00\x00\x00\x01"
+_PREAMBLE = struct.Struct("<8sQ")
+
+TIME_COLUMN = "Time (s)"
+WALL_CLOCK_COLUMN = "Time (real)"
+# "mdy" (vd. "6/5/2025 2:21") không có số 0 đứng đầu và chỉ tới phút, strftime không tạo được nên tự ghép
+WALL_CLOCK_FORMATS = {"iso": "%Y-%m-%d %H:%M:%S", "mdy": None}
+
+
+def _ticks_per_second(scale):
+    return round(1 / scale)
+
+
+def _time_ticks(values, time_resolution):
+    # (số tick nguyên, độ phân giải) với độ phân giải thô nhất từ time_resolution xuống MIN_TIME_RESOLUTION
+    # mà ticks / ticks_per_second khôi phục đúng từng bit mọi giá trị; (None, None) nếu không có
+    resolution = time_resolution
+    while resolution and resolution >= MIN_TIME_RESOLUTION * (1 - 1e-9):
+        ticks_per_second = _ticks_per_second(resolution)
+        ticks = np.round(values * ticks_per_second)
+        if (np.isfinite(ticks).all() and np.abs(ticks).max(initial=0) < 2 ** 53
+                and np.array_equal(ticks / ticks_per_second, values)):
+            return ticks.astype(np.int64), 1 / ticks_per_second
+        resolution /= 10
+    return None, None
+
+
+def _delta_encode(values):
+    # Hiệu với mẫu trước (mẫu đầu giữ nguyên); số học tràn vòng nên giải mã luôn chính xác
+    if values.dtype.kind == "f":
+        values = values.view(np.int64)
+    deltas = np.empty_like(values)
+    if len(values):
+        deltas[0] = values[0]
+        np.subtract(values[1:], values[:-1], out=deltas[1:])
+    return deltas
+
+
+def _delta_decode(deltas, dtype):
+    with np.errstate(over="ignore"):
+        values = np.cumsum(deltas, dtype=deltas.dtype)
+    return values.view(dtype) if np.dtype(dtype).kind == "f" else values
+
+
+def _shuffle(values):
+    return np.ascontiguousarray(values.view(np.uint8).reshape(len(values), values.dtype.itemsize).T).tobytes()
+
+
+def _unshuffle(buffer, dtype, count):
+    itemsize = np.dtype(dtype).itemsize
+    raw = np.frombuffer(buffer, dtype=np.uint8).reshape(itemsize, count)
+    return np.ascontiguousarray(raw.T).view(dtype).reshape(count)
+
+
+def _storage_dtype(name, values):
+    if name == TIME_COLUMN or values.dtype.kind == "f":
+        return "float64"
+    if name == WALL_CLOCK_COLUMN:
+        return "int64"
+    for dtype in ("int16", "int32"):
+        info = np.iinfo(dtype)
+        if len(values) == 0 or (values.min() >= info.min and values.max() <= info.max):
+            return dtype
+    return "int64"
+
+
+def _wall_clock_seconds(column):
+    # Hai kiểu định dạng trong data/: "2025-05-12 00:46:40" và "6/5/2025 2:21" (tháng/ngày/năm)
+    parsed = pd.to_datetime(column, format="mixed")
+    return parsed.to_numpy(dtype="datetime64[s]").astype(np.int64)
+
+
+def _format_wall_clock(seconds, fmt):
+    # Chuỗi ngày giờ theo kiểu `fmt` của WALL_CLOCK_FORMATS; giờ thực chỉ đổi mỗi giây nên chỉ định dạng
+    # các giá trị khác nhau rồi trải lại
+    unique, inverse = np.unique(seconds, return_inverse=True)
+    parsed = pd.to_datetime(unique, unit="s")
+    if fmt == "mdy":
+        strings = [f"{t.month}/{t.day}/{t.year} {t.hour}:{t.minute:02d}" for t in parsed]
+    else:
+        strings = parsed.strftime(WALL_CLOCK_FORMATS["iso"])
+    return np.asarray(strings, dtype=object)[inverse.reshape(-1)]
+
+
+def _wall_clock_format(column, seconds):
+    # Kiểu định dạng tái tạo lại đúng từng chuỗi gốc; None nếu không kiểu nào khớp (đọc ra dạng "iso")
+    original = column.astype(str).to_numpy(dtype=object)
+    for fmt in WALL_CLOCK_FORMATS:
+        if np.array_equal(_format_wall_clock(seconds, fmt), original):
+            return fmt
+    return None
+
+
+def write_archive(df, path, chunk_samples=CHUNK_SAMPLES, level=COMPRESS_LEVEL, time_resolution=TIME_RESOLUTION,
+                  meta=None):
+    # Bỏ các cột rác "Unnamed: k" sinh ra do Excel
+    columns = [c for c in df.columns if not str(c).startswith("Unnamed")]
+    arrays = {}
+    schema = {}
+    for name in columns:
+        if name == WALL_CLOCK_COLUMN:
+            values = _wall_clock_seconds(df[name])
+        else:
+            values = df[name].to_numpy()
+        dtype = _storage_dtype(name, values)
+        schema[name] = {"dtype": dtype}
+        if name == WALL_CLOCK_COLUMN:
+            schema[name]["format"] = _wall_clock_format(df[name], values)
+        ticks = None
+        if dtype == "float64" and name == TIME_COLUMN:
+            ticks, resolution = _time_ticks(values, time_resolution)
+        if ticks is not None:
+            # Lưu số tick nguyên thay cho số thực
+            schema[name]["scale"] = resolution
+            arrays[name] = ticks
+        else:
+            arrays[name] = values.astype(dtype)
+
+    n_samples = len(df)
+    chunks = []
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_PREAMBLE.pack(_MAGIC, 0))
+        for start in range(0, n_samples, chunk_samples):
+            stop = min(start + chunk_samples, n_samples)
+            blocks = {}
+            for name, values in arrays.items():
+                payload = zlib.compress(_shuffle(_delta_encode(values[start:stop])), level)
+                blocks[name] = [f.tell(), len(payload)]
+                f.write(payload)
+            chunk = {"start": start, "count": stop - start, "blocks": blocks}
+            if TIME_COLUMN in arrays:
+                chunk_time = arrays[TIME_COLUMN][start:stop]
+                if "scale" in schema[TIME_COLUMN]:
+                    chunk_time = chunk_time / _ticks_per_second(schema[TIME_COLUMN]["scale"])
+                chunk["t_min"] = float(chunk_time.min())
+                chunk["t_max"] = float(chunk_time.max())
+            chunks.append(chunk)
+
+        footer_offset = f.tell()
+        footer = {
+            "version": 1,
+            "n_samples": n_samples,
+            "columns": schema,
+            "chunks": chunks,
+            "meta": meta or {},
+        }
+        f.write(json.dumps(footer, ensure_ascii=False).encode("utf-8"))
+        f.seek(0)
+        f.write(_PREAMBLE.pack(_MAGIC, footer_offset))
+    os.replace(tmp_path, path)
+
+
+class PPGArchive:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, footer_offset = _PREAMBLE.unpack_from(self._mm, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"File '{path}' không phải bản ghi {ARCHIVE_EXTENSION}")
+        footer = json.loads(bytes(self._mm[footer_offset:]).decode("utf-8"))
+        self.n_samples = footer["n_samples"]
+        self.columns = footer["columns"]
+        self.chunks = footer["chunks"]
+        self.meta = footer["meta"]
+
+    def __len__(self):
+        return self.n_samples
+
+    def close(self):
+        self._mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _read_block(self, chunk, name):
+        offset, nbytes = chunk["blocks"][name]
+        column = self.columns[name]
+        dtype = np.dtype(column["dtype"])
+        storage = np.int64 if dtype.kind == "f" else dtype
+        raw = zlib.decompress(memoryview(self._mm)[offset:offset + nbytes])
+        if "scale" in column:
+            return _delta_decode(_unshuffle(raw, storage, chunk["count"]), storage) / _ticks_per_second(column["scale"])
+        return _delta_decode(_unshuffle(raw, storage, chunk["count"]), dtype)
+
+    def read(self, columns=None, start=0, stop=None):
+        # Đọc các mẫu [start, stop) của những cột được chọn; chỉ giải nén các đoạn giao với khoảng này
+        columns = list(self.columns) if columns is None else list(columns)
+        stop = self.n_samples if stop is None else min(stop, self.n_samples)
+        parts = {name: [] for name in columns}
+        for chunk in self.chunks:
+            c_start, c_stop = chunk["start"], chunk["start"] + chunk["count"]
+            if c_stop <= start or c_start >= stop:
+                continue
+            lo, hi = max(start, c_start) - c_start, min(stop, c_stop) - c_start
+            for name in columns:
+                parts[name].append(self._read_block(chunk, name)[lo:hi])
+        return {name: (np.concatenate(parts[name]) if parts[name] else np.empty(0, self.columns[name]["dtype"]))
+                for name in columns}
+
+    def to_frame(self, columns=None, start=0, stop=None):
+        return _frame(self.read(columns, start, stop), self.columns)
+
+    def load_span(self, t0, t1, columns=None):
+        # Chỉ giải nén các đoạn có khoảng thời gian giao với [t0, t1]
+        columns = list(self.columns) if columns is None else list(columns)
+        read_columns = columns if TIME_COLUMN in columns else columns + [TIME_COLUMN]
+        parts = []
+        for chunk in self.chunks:
+            if chunk["t_max"] < t0 or chunk["t_min"] > t1:
+                continue
+            data = {name: self._read_block(chunk, name) for name in read_columns}
+            mask = (data[TIME_COLUMN] >= t0) & (data[TIME_COLUMN] <= t1)
+            parts.append({name: data[name][mask] for name in columns})
+        return _frame({name: (np.concatenate([part[name] for part in parts]) if parts
+                              else np.empty(0, self.columns[name]["dtype"])) for name in columns}, self.columns)
+
+
+def _frame(data, schema):
+    # Cùng kiểu dữ liệu như pd.read_csv trên file gốc: số nguyên nâng lên int64 (IR filtered lưu int16,
+    # phép -ir_signal trên int16 bị tràn) và giờ thực trả lại chuỗi như trong CSV
+    for name, values in data.items():
+        if name == WALL_CLOCK_COLUMN:
+            data[name] = pd.Series(_format_wall_clock(values, schema[name].get("format") or "iso"), dtype=str)
+        elif values.dtype.kind in "iu":
+            data[name] = values.astype(np.int64)
+    return pd.DataFrame(data)
+
+
+INDEX_EXTENSION = ".tidx"
+INDEX_ROWS = 4096
+
+
+def _index_path(csv_path):
+    return csv_path + INDEX_EXTENSION
+
+
+def build_csv_index(csv_path, rows_per_block=INDEX_ROWS):
+    # Chỉ mục phụ cho CSV: vị trí byte bắt đầu của mỗi khối rows_per_block hàng và Time (s) nhỏ nhất/lớn nhất
+    with open(csv_path, "rb") as f:
+        data = f.read()
+    newlines = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord("\n"))
+    line_starts = np.concatenate([[0], newlines + 1])
+    if line_starts[-1] < len(data):
+        line_starts = np.append(line_starts, len(data))  # dòng cuối không có ký tự xuống dòng
+    time = pd.read_csv(io.BytesIO(data), usecols=[TIME_COLUMN])[TIME_COLUMN].to_numpy()
+    if len(line_starts) - 2 != len(time):
+        raise ValueError(f"Không lập được chỉ mục cho '{csv_path}' (số dòng không khớp số hàng)")
+
+    block_rows = np.arange(0, len(time), rows_per_block)
+    offsets = np.append(line_starts[block_rows + 1], line_starts[-1])
+    t_min = np.minimum.reduceat(time, block_rows) if len(time) else np.empty(0)
+    t_max = np.maximum.reduceat(time, block_rows) if len(time) else np.empty(0)
+    st = os.stat(csv_path)
+    tmp_path = f"{_index_path(csv_path)}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, offsets=offsets, t_min=t_min, t_max=t_max,
+                 header=np.frombuffer(data[:line_starts[1]], dtype=np.uint8),
+                 source=np.array([st.st_size, st.st_mtime_ns], dtype=np.int64))
+    os.replace(tmp_path, _index_path(csv_path))
+
+
+def _load_csv_index(csv_path):
+    index_path = _index_path(csv_path)
+    st = os.stat(csv_path)
+    if os.path.exists(index_path):
+        index = dict(np.load(index_path))
+        if list(index["source"]) == [st.st_size, st.st_mtime_ns]:
+            return index
+    build_csv_index(csv_path)
+    return dict(np.load(index_path))
+
+
+def load_span(recording, t0, t1, columns=None):
+    # Các mẫu có Time (s) trong [t0, t1] của một bản ghi .ppgz hoặc .csv, không phải đọc cả file
+    if recording.endswith(ARCHIVE_EXTENSION):
+        with PPGArchive(recording) as archive:
+            return archive.load_span(t0, t1, columns)
+
+    index = _load_csv_index(recording)
+    blocks = np.flatnonzero((index["t_max"] >= t0) & (index["t_min"] <= t1))
+    header = index["header"].tobytes()
+    parts = []
+    with open(recording, "rb") as f:
+        # Các khối liền kề được đọc trong một lần
+        for run in np.split(blocks, np.flatnonzero(np.diff(blocks) > 1) + 1) if len(blocks) else []:
+            start, stop = index["offsets"][run[0]], index["offsets"][run[-1] + 1]
+            f.seek(start)
+            parts.append(f.read(stop - start))
+    df = pd.read_csv(io.BytesIO(header + b"".join(parts)))
+    df = df[(df[TIME_COLUMN] >= t0) & (df[TIME_COLUMN] <= t1)].reset_index(drop=True)
+    return df if columns is None else df[list(columns)]
+
+
+def read_recording(path, columns=None):
+    # Dùng thay cho pd.read_csv trong các script trích xuất đặc trưng: nhận cả .csv lẫn .ppgz
+    if path.endswith(ARCHIVE_EXTENSION):
+        with PPGArchive(path) as archive:
+            return archive.to_frame(columns)
+    return pd.read_csv(path, usecols=columns)
+
+
+def convert_csv(csv_path, output_dir=None, chunk_samples=CHUNK_SAMPLES, level=COMPRESS_LEVEL,
+                time_resolution=TIME_RESOLUTION):
+    output_dir = output_dir or os.path.dirname(csv_path)
+    os.makedirs(output_dir, exist_ok=True)
+    archive_path = os.path.join(output_dir, os.path.splitext(os.path.basename(csv_path))[0] + ARCHIVE_EXTENSION)
+    df = pd.read_csv(csv_path)
+    write_archive(df, archive_path, chunk_samples, level, time_resolution, meta={"source": os.path.basename(csv_path)})
+    return archive_path
+
+
+def verify(csv_path, archive_path):
+    # Kiểm tra chuyển đổi: mọi cột phải khớp tuyệt đối với pd.read_csv (thời gian đúng từng bit)
+    df = pd.read_csv(csv_path)
+    with PPGArchive(archive_path) as archive:
+        data = archive.read()
+        columns = archive.columns
+    for name, values in data.items():
+        if name == WALL_CLOCK_COLUMN:
+            fmt = columns[name].get("format") or "iso"
+            if not np.array_equal(_format_wall_clock(values, fmt), df[name].astype(str).to_numpy(dtype=object)):
+                return False
+            continue
+        if not np.array_equal(df[name].to_numpy(), values, equal_nan=values.dtype.kind == "f"):
+            return False
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=f"Chuyển bản ghi CSV sang định dạng {ARCHIVE_EXTENSION}")
+    parser.add_argument("inputs", nargs="+", help="thư mục (data/, predict_data/) hoặc file CSV")
+    parser.add_argument("--output-dir", default=None, help="mặc định: cùng thư mục với file CSV")
+    parser.add_argument("--chunk-samples", type=int, default=CHUNK_SAMPLES)
+    parser.add_argument("--level", type=int, default=COMPRESS_LEVEL, help="mức nén zlib (0-9)")
+    parser.add_argument("--time-resolution", type=float, default=TIME_RESOLUTION,
+                        help="độ phân giải tick của Time (s); giá trị không biểu diễn đúng bằng tick (và 0) "
+                             "được giữ nguyên float64")
+    parser.add_argument("--verify", action="store_true", help="đọc lại và so sánh với CSV gốc")
+    args = parser.parse_args()
+
+    files = []
+    for path in args.inputs:
+        files.extend(sorted(glob.glob(os.path.join(path, "*.csv"))) if os.path.isdir(path) else [path])
+
+    csv_bytes = archive_bytes = 0
+    for csv_path in files:
+        start = timer.perf_counter()
+        archive_path = convert_csv(csv_path, args.output_dir, args.chunk_samples, args.level, args.time_resolution)
+        csv_bytes += os.path.getsize(csv_path)
+        archive_bytes += os.path.getsize(archive_path)
+        status = ""
+        if args.verify:
+            status = " ✅ khớp" if verify(csv_path, archive_path) else " ❌ KHÁC"
+        print(f"📦 {csv_path} -> {archive_path} "
+              f"({os.path.getsize(csv_path) / 1e6:.1f} MB -> {os.path.getsize(archive_path) / 1e6:.2f} MB, "
+              f"{timer.perf_counter() - start:.1f} s){status}")
+    if files:
+        print(f"✅ Tổng: {csv_bytes / 1e6:.1f} MB -> {archive_bytes / 1e6:.2f} MB ({csv_bytes / max(archive_bytes, 1):.1f}x)")
@@ -2,23 +2,37 @@ import serial
 import threading
 import time
 import csv
-from datetime import datetime
-import pytz
+import os
+import argparse
 import pandas as pd
 import numpy as np
 import pywt
-import joblib
 from scipy.signal import find_peaks
-from sklearn.feature_selection import mutual_info_regression
-from numpy.linalg import norm
-from sklearn.neighbors import NearestNeighbors
 from scipy.stats import kurtosis
-
-
-
-SERIAL_PORT = 'COM3'
+from ring_buffer import PPGRingBuffer, RING_BUFFER_FILE_NAME
+from scheduler import CascadeScheduler, PipelineScheduler, SharedWorkerPool, Window
+from nonlinear import nonlinear_window_features, reduce_rate, NONLINEAR_FEATURE_COLUMNS
+import time_domain
+from time_domain import BeatTracker, TIME_FEATURE_COLUMNS, window_time_features
+from serial_ingest import SerialBatchReader, batch_rows
+from replay_serial import open_serial
+from model_registry import ModelRegistry
+from signal_quality import QUALITY_OK, SignalQualityTracker
+from resample import GAP, RESAMPLE_RATE_HZ, gaps, grid_length, resample_uniform, rfft_frequencies
+from cascade import (CASCADE_STAGES, CASCADE_THRESHOLD, DOMAIN_WEIGHTS, confident_decision, positive_probability,
+                     weighted_vote)
+
+
+
+# Có thể thay bằng cổng ảo phát lại bản ghi, vd. PPG_SERIAL_PORT="replay:data/data_04042025.csv?speed=10"
+SERIAL_PORT = os.environ.get("PPG_SERIAL_PORT", 'COM3')
 SERIAL_BAUD = 115200
 CSV_FILE_NAME = "data.csv"
+WINDOW_SECONDS = 60
+HOP_SECONDS = 1          # mỗi giây tính đặc trưng + dự đoán một lần trên cửa sổ trượt 60 giây
+FOURIER_SECONDS = 10
+WARMUP_SECONDS = 5
+RECONNECT_DELAY_SECONDS = 1
 
 TIME_FEATURE_FILE_NAME = "heart_rate_results.csv"
 WAVELET_FEATURE_FILE_NAME = "wavelet_results.csv"
@@ -30,432 +44,470 @@ MODEL_NONLINEAR = "model_nonlinear.pkl"
 MODEL_WAVELET = "model_wavelet.pkl"
 MODEL_FREQUENCY = "model_frequency.pkl"
 
-OUTPUT_FILE = "final_prediction.csv"
+# Mô hình được nạp một lần và giữ thường trú; file .pkl được thay khi đang chạy sẽ tự được nạp lại
+models = ModelRegistry({
+    "time": MODEL_TIME,
+    "wavelet": MODEL_WAVELET,
+    "nonlinear": MODEL_NONLINEAR,
+    "frequency": MODEL_FREQUENCY,
+})
 
-acc_time = 0.9485
-acc_wavelet = 0.6826
-acc_nonlinear = 0.8796
-acc_fourier = 0.6566
-
-# Định nghĩa múi giờ Việt Nam
-vn_tz = pytz.timezone('Asia/Ho_Chi_Minh')
-def get_vietnam_time():
-    return datetime.now(vn_tz).strftime("%Y-%m-%d %H:%M:%S")
-
-# Ghi dữ liệu từ Serial vào CSV
-def serial_reader():
-    while True:
-        try:
-            ser = serial.Serial(SERIAL_PORT, SERIAL_BAUD)
-        except serial.SerialException as e:
-            print(f"Lỗi kết nối Serial: {e}")
+OUTPUT_FILE = "final_prediction.csv"
+STREAMS_DIR = "streams"   # nhiều cảm biến: kết quả của mỗi cảm biến nằm trong streams/<tên>/
+
+acc_time = DOMAIN_WEIGHTS["time"]
+acc_wavelet = DOMAIN_WEIGHTS["wavelet"]
+acc_nonlinear = DOMAIN_WEIGHTS["nonlinear"]
+acc_fourier = DOMAIN_WEIGHTS["frequency"]
+
+# Luồng: "cửa sổ sẵn sàng" -> 4 miền đặc trưng (chạy trên nhóm worker dùng chung)
+#        -> "đủ 4 miền cho cửa sổ k" -> dự đoán
+DOMAINS = ("time", "wavelet", "nonlinear", "frequency")
+
+
+class Stream:
+    # Một cảm biến (một cổng Serial) với bộ đệm vòng, trạng thái đặc trưng, file kết quả
+    # và lịch sử dự đoán riêng; các đặc trưng được tính trên nhóm worker dùng chung.
+    # cascade_threshold: None để luôn tính đủ 4 miền; có giá trị thì dự đoán theo tầng (cascade.py)
+    # resample_rate: None để dùng mẫu gốc; có giá trị thì mọi miền nhận cửa sổ trên lưới đều (resample.py)
+    # nonlinear_rate: tần số riêng (thấp hơn) cho miền phi tuyến; mặc định giống resample_rate
+    # ami_method: cách ước lượng AMI (nonlinear.AMI_METHOD nếu None), phải khớp với lúc huấn luyện model_nonlinear.pkl
+    # time_mode: như extract_features.py --time-mode (time_domain.TIME_FEATURE_MODE nếu None); "beats" dùng
+    # BeatTracker (chỉ dò nhịp trên phần tín hiệu mới) nhưng lệch so với model_time_domain.pkl
+    def __init__(self, name, port, directory, pool, cascade_threshold=None, resample_rate=None, nonlinear_rate=None,
+                 ami_method=None, time_mode=None):
+        self.name = name
+        self.port = port
+        self.directory = directory
+        self.pool = pool
+        os.makedirs(directory, exist_ok=True)
+        # Bộ đệm vòng dùng chung giữa serial_reader và các worker trích xuất đặc trưng
+        self.ring_buffer = PPGRingBuffer.create(self.path(RING_BUFFER_FILE_NAME))
+        self.cascade_threshold = cascade_threshold
+        self.resample_rate = resample_rate
+        self.nonlinear_rate = nonlinear_rate if nonlinear_rate is not None else resample_rate
+        self.ami_method = ami_method
+        if cascade_threshold is None:
+            self.scheduler = PipelineScheduler(DOMAINS, self.predict)
+        else:
+            self.scheduler = CascadeScheduler(CASCADE_STAGES, on_stage=self.cascade_stage, dispatch=self.dispatch)
+        self.time_mode = time_mode or time_domain.TIME_FEATURE_MODE
+        self.beat_tracker = BeatTracker() if self.time_mode == "beats" else None
+        self.quality = SignalQualityTracker()
+        self.signal_ok = None
+        self.next_window_id = 0
+        self.next_window_end = WINDOW_SECONDS
+        self.verbose = True
+        # Bộ đếm cho thống kê tải: mẫu đã nhận, cửa sổ đã phát, cửa sổ đã đủ 4 miền
+        self.samples_received = 0
+        self.windows_completed = 0
+
+    def path(self, file_name):
+        return os.path.join(self.directory, file_name)
+
+    def log(self, message):
+        if self.verbose:
+            print(f"[{self.name}] {message}")
+
+    # Lấy view (không sao chép) của đúng cửa sổ mà sự kiện mang theo, kèm chỉ số tuyệt đối của mẫu đầu;
+    # khi lấy mẫu lại thì là cửa sổ trên lưới đều và chỉ số lưới (neo theo thời gian nên vẫn tuyệt đối)
+    def read_window(self, window):
+        time_arr, _, ir_signal = self.ring_buffer.window(window.start_index, window.end_index)
+        if self.resample_rate is None:
+            return time_arr, ir_signal, window.start_index
+        grid = resample_uniform(time_arr, ir_signal, self.resample_rate)
+        return grid.time, grid.signal, grid.first_index
+
+    # Ghi kết quả của một miền ra CSV (cho app.py) kèm id cửa sổ
+    def save_features(self, df, window, file_name):
+        output = df.copy()
+        output.insert(0, "Window", window.window_id)
+        output.to_csv(self.path(file_name), index=False)
+
+    # Mỗi (cảm biến, miền) chỉ giữ cửa sổ mới nhất đang chờ: miền chậm tự bỏ qua cửa sổ cũ
+    def dispatch(self, window, domains):
+        for domain in domains:
+            self.pool.submit_latest((self.name, domain), DOMAIN_EXTRACTORS[domain], self, window)
+
+    # Phát sự kiện "cửa sổ sẵn sàng" khi đã có đủ WINDOW_SECONDS và đã trượt thêm HOP_SECONDS
+    def publish_window_if_ready(self, elapsed_time):
+        if elapsed_time < self.next_window_end:
             return
-
-        with open(CSV_FILE_NAME, "w", newline="") as csv_file:
+        start_index, end_index = self.ring_buffer.latest_window_bounds(WINDOW_SECONDS)
+        time_arr, _, ir_signal = self.ring_buffer.window(start_index, end_index)
+        window = Window(self.next_window_id, start_index, end_index, time_arr[0], time_arr[-1])
+        # Cửa sổ không có ngón tay / bão hòa / phẳng / nhịp vô lý: không tính miền nào, ghi "no signal"
+        quality = self.quality.assess(window.t_start, window.t_end, time_arr, ir_signal)
+        if quality.ok != self.signal_ok:
+            self.signal_ok = quality.ok
+            if quality.ok:
+                self.log("📶 Tín hiệu ổn định trở lại, tiếp tục tính đặc trưng.")
+            else:
+                self.log(f"🚫 Không có tín hiệu hợp lệ ({quality.reason}), tạm dừng tính đặc trưng.")
+        if not quality.ok:
+            self.skip_window(window, quality.reason)
+        elif self.resample_rate is not None and len(gaps(time_arr)):
+            # Không nội suy qua chỗ mất mẫu (mất kết nối): cửa sổ có khoảng trống cũng bị bỏ qua
+            self.skip_window(window, GAP)
+        elif self.cascade_threshold is None:
+            self.dispatch(window, DOMAINS)
+        else:
+            self.scheduler.start(window)
+        self.next_window_id += 1
+        self.next_window_end += HOP_SECONDS
+        # Nếu bị lỡ nhịp (mất kết nối), cửa sổ tiếp theo tính từ thời điểm hiện tại
+        if self.next_window_end <= elapsed_time:
+            self.next_window_end = elapsed_time + HOP_SECONDS
+
+    # Cửa sổ không đạt chất lượng: bỏ cả việc đang chờ của các miền (cửa sổ cũ hơn cũng không còn cần)
+    def skip_window(self, window, reason):
+        for domain in DOMAINS:
+            self.pool.cancel((self.name, domain))
+        self.windows_completed += 1
+        self.record_prediction([window.window_id, np.nan, np.nan, np.nan, np.nan, np.nan], quality=reason,
+                               verbose=False)
+
+    # Đưa một lô mẫu vào bộ đệm vòng và data.csv, phát cửa sổ mới nếu đã tới lúc
+    def ingest(self, batch, csv_writer):
+        if len(batch.elapsed) == 0:
+            return
+        self.samples_received += len(batch.elapsed)
+        had_contact = self.quality.contact
+        self.quality.update(batch.elapsed, batch.ir_raw)
+        # Chỉ nhắc khi vừa mất tiếp xúc, không in lại ở mỗi lô trong suốt thời gian bỏ tay ra
+        if not self.quality.contact and had_contact is not False:
+            self.log("Đặt tay vào cảm biến!")
+        self.ring_buffer.extend(batch.elapsed, batch.ir_raw, batch.ir_filtered)
+        # data.csv chỉ còn là file lưu trữ, ghi cả lô một lần và không flush
+        csv_writer.writerows(batch_rows(batch))
+        self.publish_window_if_ready(batch.elapsed[-1])
+
+    # Thu dữ liệu liên tục từ Serial vào bộ đệm vòng (và data.csv để lưu trữ), mỗi lần một lô mẫu
+    def serial_reader(self):
+        reader = SerialBatchReader()
+        recording = False
+        csv_path = self.path(CSV_FILE_NAME)
+        # Không xóa data.csv khi kết nối lại, chỉ ghi tiếp
+        write_header = not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0
+        with open(csv_path, "a", newline="") as csv_file:
             csv_writer = csv.writer(csv_file)
-            csv_writer.writerow(["Time (real)", "IR Value raw", "IR Value filtered", "Time (s)"])
-
-            print("🟢 Bắt đầu thu thập dữ liệu (bỏ 5 giây đầu, ghi 60 giây / nghỉ 10 giây)... Nhấn Ctrl+C để thoát.")
-            try:
-                total_start = time.time()
-                print("⏳ Bỏ qua 5 giây đầu để ổn định tín hiệu...")
-                
-                # Đợi 5 giây đầu không ghi dữ liệu
-                while time.time() - total_start < 5:
-                    if ser.in_waiting:
-                        ser.readline()  # Đọc bỏ để không backlog
-
-                print("📡 Bắt đầu ghi dữ liệu trong 60 giây...")
-                record_start = time.time()
-                while time.time() - record_start < 60:
-                    if ser.in_waiting:
-                        line = ser.readline().decode('utf-8').strip()
-                        try:
-                            ir_raw, ir_filtered = map(int, line.split(','))
-                            if ir_raw < 50000:
-                                print("Đặt tay vào cảm biến!")
-                        except ValueError:
-                            continue
-                        elapsed_time = time.time() - record_start
-                        csv_writer.writerow([get_vietnam_time(), ir_raw, ir_filtered, elapsed_time])
-                        csv_file.flush()
-
-                print("⏸️ Nghỉ 10 giây...")
-                time.sleep(10)
-
-            except KeyboardInterrupt:
-                print("⛔ Dừng ghi dữ liệu.")
-            finally:
-                ser.close()
-
-
-
-# Phân tích dữ liệu sau 60s và lặp lại mỗi 10s
-def feature_time_extractor():
-    while True:
-        print("⏳ [Time] Đang đợi 60 giây để thu đủ dữ liệu...")
-        time.sleep(65)  # Đợi 60 giây cho quá trình đo
+            if write_header:
+                csv_writer.writerow(["Time (real)", "IR Value raw", "IR Value filtered", "Time (s)"])
+
+            while True:
+                try:
+                    ser = open_serial(self.port, SERIAL_BAUD)
+                except serial.SerialException as e:
+                    self.log(f"Lỗi kết nối Serial: {e}")
+                    time.sleep(RECONNECT_DELAY_SECONDS)
+                    continue
 
+                try:
+                    reader.attach(ser)
+                    if not recording:
+                        self.log(f"🟢 Bắt đầu thu thập dữ liệu liên tục từ {self.port}... Nhấn Ctrl+C để thoát.")
+                        self.log(f"⏳ Bỏ qua {WARMUP_SECONDS} giây đầu để ổn định tín hiệu...")
+
+                        # Đợi vài giây đầu không ghi dữ liệu (đọc bỏ để không backlog)
+                        reader.discard(WARMUP_SECONDS)
+
+                        self.log("📡 Bắt đầu ghi dữ liệu...")
+                        reader.start_clock()
+                        recording = True
+                    else:
+                        self.log("🔁 Đã kết nối lại Serial, tiếp tục ghi dữ liệu.")
+
+                    # Thu liên tục, không nghỉ giữa các cửa sổ; read_batch chặn tới khi có dữ liệu
+                    while True:
+                        self.ingest(reader.read_batch(), csv_writer)
+
+                except serial.SerialException as e:
+                    self.log(f"⚠️ Mất kết nối Serial: {e}")
+                    time.sleep(RECONNECT_DELAY_SECONDS)
+                finally:
+                    ser.close()
+
+    # Chạy trong worker vừa nộp kết quả của miền cuối cùng cho cửa sổ window_id
+    def predict(self, window_id, features):
+        self.windows_completed += 1
         try:
-            df = pd.read_csv(CSV_FILE_NAME)
-
-            # Kiểm tra cột cần thiết
-            if {"Time (s)", "IR Value filtered"}.issubset(df.columns):
-                # Loại bỏ trùng và sắp xếp
-                df = df.drop_duplicates(subset=["Time (s)"]).sort_values(by=["Time (s)"])
-                time_arr = np.array(df["Time (s)"])
-                ir_signal = np.array(df["IR Value filtered"])
-                
-                # Tìm đỉnh và đáy
-                dt = np.mean(np.diff(time_arr))  # sampling interval
-                peaks, _ = find_peaks(ir_signal, height=np.mean(ir_signal), distance=0.5 / dt)
-                valleys, _ = find_peaks(-ir_signal, height=-np.mean(ir_signal), distance=0.3 / dt)
-
-                rising_times = []
-                for v in valleys:
-                    future_peaks = peaks[peaks > v]
-                    if len(future_peaks) == 0:
-                        continue
-                    p = future_peaks[0]
-                    rising_times.append(time_arr[p] - time_arr[v])
-
-                # Tính đặc trưng
-                if len(peaks) >= 2:
-                    peak_times = time_arr[peaks]
-                    intervals = np.diff(peak_times)
-                    avg_interval = np.mean(intervals)
-                    std_interval = np.std(intervals)
-                else:
-                    avg_interval = std_interval = np.nan
-
-                if len(peaks) > 0 and len(valleys) > 0:
-                    amplitude = np.mean(ir_signal[peaks]) - np.mean(ir_signal[valleys])
-                else:
-                    amplitude = np.nan
-
-                avg_rising_time = np.mean(rising_times) if rising_times else np.nan
-                num_beats = len(peaks)
-                bpm = (num_beats / 60) * 60  # do đã đo đúng 60s
-
-                # Ghi kết quả
-        
-                result = pd.DataFrame([[bpm, avg_interval, std_interval, amplitude, avg_rising_time]],
-                                      columns=["BPM", "AVG Interval (s)", "STD Interval (s)", "Amplitude", "Time V2P (s)"])
-                result.to_csv(TIME_FEATURE_FILE_NAME, index=False)
-                print(f"✅ Đã lưu các đặc trưng vào '{TIME_FEATURE_FILE_NAME}'")
-                time.sleep(10)
-
+            result = predict_window(window_id, features)
         except Exception as e:
-            print(f"❌ Lỗi xử lý feature: {e}")
-
-def fourier_feature_extractor():
-    while True:
-        print("⏳ [Frequency] Đang đợi 60 giây trước khi bắt đầu tính đặc trưng biến đổi frequency...")
-        time.sleep(65)
+            self.log(f"❌ [Prediction] Lỗi dự đoán: {e}")
+            return
+        if result is None:
+            self.log("⚠️ Một trong các file đặc trưng bị rỗng, bỏ qua lần này.")
+            return
+        self.record_prediction(result)
 
+    # Dự đoán theo tầng: gọi khi đủ kết quả của một tầng, trả về True nếu cần tính thêm tầng sau
+    def cascade_stage(self, window, stage, features):
         try:
-            df = pd.read_csv(CSV_FILE_NAME)
-            if {"Time (s)", "IR Value filtered"}.issubset(df.columns):
-                df = df.drop_duplicates(subset=["Time (s)"]).sort_values(by=["Time (s)"])
-                time_arr = np.array(df["Time (s)"])
-                ir_signal = np.array(df["IR Value filtered"])
-                end_time = time_arr[-1]
-                start_time = end_time - 10
-
-                mask = (time_arr >= start_time) & (time_arr <= end_time)
-                time_window = time_arr[mask]
-                ir_window = ir_signal[mask]
-
-                if len(time_window) < 2:
-                    print("⚠️ [Frequency] Dữ liệu trong 10 giây cuối không đủ để tính FFT.")
-                    continue
-
-                # FFT
-                dt = np.mean(np.diff(time_window))
-                N = len(ir_window)
-                freqs = np.fft.rfftfreq(N, d=dt)
-                fft_result = np.fft.rfft(ir_window)
-
-                amplitude = np.abs(fft_result)
-                phase = np.angle(fft_result)
-                power = amplitude ** 2
-
-                # Tìm peaks & troughs pha
-                peaks_all, _ = find_peaks(phase)
-                peaks = peaks_all[phase[peaks_all] > 1]
-
-                troughs_all, _ = find_peaks(-phase)
-                troughs = troughs_all[phase[troughs_all] < -1]
-
-                peak_phases = phase[peaks]
-                trough_phases = phase[troughs]
-
-                peak_mean = np.mean(peak_phases) if len(peak_phases) > 0 else 0
-                peak_std = np.std(peak_phases) if len(peak_phases) > 0 else 0
-                trough_mean = np.mean(trough_phases) if len(trough_phases) > 0 else 0
-                trough_std = np.std(trough_phases) if len(trough_phases) > 0 else 0
-
-                max_amplitude = np.max(amplitude)
-                fma = freqs[np.argmax(amplitude)]
-                total_power = np.sum(power)
-
-                output = pd.DataFrame([[
-                    peak_mean, peak_std,
-                    trough_mean, trough_std, fma, total_power
-                ]], columns=[
-                    "AVG Peak", "STD Peak",
-                    "AVG Trough", "STD Trough", "FMA", "Total Power"
-                ])
-
-                
-                output.to_csv(FREQUENCY_FEATURE_FILE_NAME, index=False)
-
-                print(f"✅ [Frequency] Đã tính đặc trưng và lưu vào '{FREQUENCY_FEATURE_FILE_NAME}'")
-                time.sleep(10)
+            if any(df.empty for df in features.values()):
+                self.log("⚠️ Một trong các file đặc trưng bị rỗng, bỏ qua lần này.")
+                return False
+            predictions, probabilities = {}, {}
+            for domain, df in features.items():
+                model = models.get(domain)
+                predictions[domain] = model.predict(df)
+                probabilities[domain] = positive_probability(model, df)
+            if stage == len(CASCADE_STAGES) - 1:
+                final_pred = weighted_vote(predictions)[0]
             else:
-                print("⚠️ [Frequency] File không chứa các cột cần thiết: 'Time (s)', 'IR Value filtered', 'Label'")
-        except Exception as e:
-            print(f"❌ [Frequency] Lỗi xử lý Frequency: {e}")
-
-
-def wavelet_feature_extractor():
-    
-    while True:
-        print("⏳ [Wavelet] Đang đợi 60 giây trước khi bắt đầu tính đặc trưng biến đổi wavelet...")
-        time.sleep(65)
-
-        
-        try:
-            df = pd.read_csv(CSV_FILE_NAME)
-
-            if {"Time (s)", "IR Value filtered"}.issubset(df.columns):
-                df = df.drop_duplicates(subset=["Time (s)"]).sort_values(by=["Time (s)"])
-                time_arr = np.array(df["Time (s)"])
-                ir_signal = np.array(df["IR Value filtered"])
-                result = []
-                
-           
-
-                
-                # Biến đổi wavelet mức 4 với coif5
-                coeffs = pywt.wavedec(ir_signal, wavelet='coif5', level=4)
-                A4, D4, D3, D2, D1 = coeffs  # Giải nén hệ số (ngược lại với thứ tự trả về)
-
-                # Tính kurtosis
-                kurt_D1 = kurtosis(D1)
-                kurt_D2 = kurtosis(D2)
-                kurt_D3 = kurtosis(D3)
-                kurt_A4 = kurtosis(A4)
-
-                result.append([kurt_D1, kurt_D2, kurt_D3, kurt_A4])
-                result_df = pd.DataFrame(result, columns=["Kurtosis D1", "Kurtosis D2", "Kurtosis D3", "Kurtosis A4"])
-                result_df.to_csv(WAVELET_FEATURE_FILE_NAME, index=False)
-                print("✅ Đã lưu các đặc trưng vào 'wavelet_results.csv'")
-                time.sleep(10)
-        except Exception as e:
-            print(f"❌ [Wavelet] Lỗi xử lý Wavelet: {e}")
-
-
-def calculate_fnn(signal, delay, max_dim, Rtol=10.0, Atol=None):
-    if Atol is None:
-        Atol = 2.0 * np.std(signal)
-
-    N = len(signal)
-    fnn_percentages = []
-
-    for d in range(1, max_dim + 1):
-        M = N - (d + 1) * delay
-        if M <= 0:
-            break
-
-        embedded_d = np.array([signal[i:i + d * delay:delay] for i in range(M)])
-        embedded_d1 = np.array([signal[i:i + (d + 1) * delay:delay] for i in range(M)])
-
-        false_nearest = 0
-        for i in range(M):
-            dists = np.linalg.norm(embedded_d - embedded_d[i], axis=1)
-            dists[i] = np.inf 
-            nearest_idx = np.argmin(dists)
-
-            dist_d = dists[nearest_idx]
-            dist_d1 = np.linalg.norm(embedded_d1[i] - embedded_d1[nearest_idx])
-
-            if dist_d == 0:
-                continue
-
-            if dist_d1 / dist_d > Rtol or abs(signal[i + d * delay] - signal[nearest_idx + d * delay]) > Atol:
-                false_nearest += 1
-
-        fnn_percentages.append(false_nearest / M * 100)
-    return fnn_percentages
-
-def estimate_delay_ami(signal, max_lag):
-    mi_values = []
-    for lag in range(1, max_lag + 1):
-        X = signal[:-lag].reshape(-1,1)
-        Y = signal[lag:]
-        mi = mutual_info_regression(X, Y, discrete_features=False)
-        mi_values.append(mi[0])
-    optimal_lag = np.argmin(mi_values) + 1 if mi_values else 1
-    ami_value = mi_values[optimal_lag - 1]
-    return optimal_lag, ami_value
-
-def plot_fnn(fnn_vals):
-    # Tìm minimum cục bộ đầu tiên nếu có
-    for i in range(1, len(fnn_vals) - 1):
-        if fnn_vals[i] < fnn_vals[i - 1] and fnn_vals[i] < fnn_vals[i + 1]:
-            return fnn_vals[i]
-    # fallback: chọn giá trị nhỏ hơn 1% đầu tiên, nếu có
-    for i, val in enumerate(fnn_vals):
-        if val < 1:
-            return val
-    return fnn_vals[0]
-
-def reconstruct_phase_space(signal, delay, embedding_dimension):
-    n_points = len(signal) - (embedding_dimension - 1) * delay
-    return np.array([signal[i:i + embedding_dimension * delay:delay] for i in range(n_points)])
-
-def calculate_lyapunov_exponent(phase_space, k=10):
-    nbrs = NearestNeighbors(n_neighbors=2).fit(phase_space)
-    distances, indices = nbrs.kneighbors(phase_space)
-    divergence = []
-    for i in range(1, len(phase_space)):
-        d0 = distances[i, 1]
-        if i + k < len(phase_space) and indices[i, 1] + k < len(phase_space):
-            d1 = norm(phase_space[i + k] - phase_space[indices[i, 1] + k])
-            if d0 > 0 and d1 > 0:
-                divergence.append(np.log(d1 / d0))
-    return np.mean(divergence) / k if divergence else 0
-
-def calculate_attractor_reconstruction_error(phase_space, delay):
-    N = len(phase_space)
-    if N < 2:
-        return np.nan
-    indices = NearestNeighbors(n_neighbors=2).fit(phase_space).kneighbors(phase_space, return_distance=False)
-    errors = []
-    for i in range(N - delay):
-        neighbor_idx = indices[i, 1]
-        if neighbor_idx + delay < N:
-            original_next = phase_space[i + delay]
-            predicted_next = phase_space[neighbor_idx + delay]
-            errors.append(norm(original_next - predicted_next))
-    return np.mean(errors) if errors else np.nan
-
-def calculate_dfa(signal, scales=None):
-    if scales is None:
-        scales = [10, 20, 40, 80, 100]
-    flucts = []
-    for scale in scales:
-        segments = len(signal) // scale
-        reshaped = np.reshape(signal[:segments * scale], (segments, scale))
-        F = []
-        for segment in reshaped:
-            x = np.arange(scale)
-            trend = np.polyfit(x, segment, 1)
-            detrended = segment - np.polyval(trend, x)
-            F.append(np.sqrt(np.mean(detrended ** 2)))
-        flucts.append(np.mean(F))
-    log_scales = np.log(scales)
-    log_flucts = np.log(flucts)
-    coeffs = np.polyfit(log_scales, log_flucts, 1)
-    return coeffs[0] 
-
-def run_nonlinear_analysis():
-    
-    while True:
-        print("⏳ [Nonlinear] Đang đợi 60 giây trước khi bắt đầu tính đặc trưng phi tuyến...")
-        time.sleep(65)
-        
-        try:
-            df = pd.read_csv(CSV_FILE_NAME)
-            if "Time (s)" in df.columns and "IR Value filtered" in df.columns:
-                df = df.drop_duplicates(subset=["Time (s)"]).sort_values(by=["Time (s)"])
-                times = np.array(df["Time (s)"])
-                ir_signal = np.array(df["IR Value filtered"])
-               
-                nonlinear_results = []
-
-                optimal_delay, amivalue = estimate_delay_ami(ir_signal, max_lag=50)
-                fnn_vals = calculate_fnn(ir_signal, delay=optimal_delay, max_dim=10)
-                fnn = plot_fnn(fnn_vals)
-                embedding_dimension = next((d + 1 for d, val in enumerate(fnn_vals) if val < 1), 3)
-                phase_space = reconstruct_phase_space(ir_signal, optimal_delay, embedding_dimension)
-                lyap = calculate_lyapunov_exponent(phase_space)
-                reconstruction_error = calculate_attractor_reconstruction_error(phase_space, delay=optimal_delay)
-                dfa = calculate_dfa(ir_signal)
-                nonlinear_results.append([amivalue, fnn, lyap, reconstruction_error, dfa])
-                nonlinear_df = pd.DataFrame(nonlinear_results, columns=["AMI", "FNN", "Lyapunov", "ARE", "DFA"])
-                nonlinear_df.to_csv(NONLINEAR_FEATURE_FILE_NAME, index=False)
-                print("✅ Đã lưu các đặc trưng vào 'nonlinear_results.csv'")
-                time.sleep(10)
-        except FileNotFoundError:
-            print(f"⚠️ Không tìm thấy file '{CSV_FILE_NAME}'")
-        except Exception as e:
-            print(f"⚠️ Lỗi không mong muốn: {e}")
-
-def predic_with_model():
-    while True:
-        print("⏳ [Prediction] Đang đợi 60 giây trước khi chạy dự đoán...")
-        time.sleep(70)
-        try: 
-            df_time = pd.read_csv(TIME_FEATURE_FILE_NAME)
-            df_wavelet = pd.read_csv(WAVELET_FEATURE_FILE_NAME)
-            df_nonlinear = pd.read_csv(NONLINEAR_FEATURE_FILE_NAME)
-            df_frequency = pd.read_csv(FREQUENCY_FEATURE_FILE_NAME)
-            final_results = []
-            if df_time.empty or df_wavelet.empty or df_nonlinear.empty or df_frequency.empty:
-                print("⚠️ Một trong các file đặc trưng bị rỗng, bỏ qua lần này.")
-                continue
-
-            model_time = joblib.load(MODEL_TIME)
-            model_wavelet = joblib.load(MODEL_WAVELET)
-            model_nonlinear = joblib.load(MODEL_NONLINEAR)
-            model_frequency = joblib.load(MODEL_FREQUENCY)
-
-            pred_time = model_time.predict(df_time)[0]
-            pred_wavelet = model_wavelet.predict(df_wavelet)[0]
-            pred_nonlinear = model_nonlinear.predict(df_nonlinear)[0]
-            pred_frequency = model_frequency.predict(df_frequency)[0]
-
-            weight_sum = pred_time*acc_time + pred_nonlinear*acc_nonlinear + pred_wavelet*acc_wavelet + pred_frequency*acc_fourier
-            threshold = (acc_wavelet + acc_nonlinear + acc_time +acc_fourier)/2
-
-            final_pred = (weight_sum >= threshold).astype(int)
-
-            final_results.append([pred_time, pred_wavelet, pred_nonlinear, pred_frequency, final_pred])
-
-          
-            final_df = pd.DataFrame(final_results, columns=["Prediction Time", "Prediction Wavelet", "Prediction Nonlinear", "Prediction Fourier", "Final Prediction"])
-            final_df.to_csv(OUTPUT_FILE, index=False)
-
-            print(f"✅ [Prediction] Dự đoán: Time = {pred_time:.2f}, Wavelet = {pred_wavelet:.2f}, Nonlinear = {pred_nonlinear:.2f}, Fourier = {pred_frequency:.2f}, Final={final_pred:.2f}")
-            time.sleep(5)
-
-
+                confident, decision = confident_decision(probabilities, 1, self.cascade_threshold)
+                if not confident[0]:
+                    return True
+                final_pred = decision[0]
         except Exception as e:
-            print(f"❌ [Prediction] Lỗi dự đoán: {e}")
-
-
-
-# Khởi chạy song song
-t1 = threading.Thread(target=serial_reader)
-t2 = threading.Thread(target=feature_time_extractor)
-t3 = threading.Thread(target=fourier_feature_extractor)
-t4 = threading.Thread(target=wavelet_feature_extractor)
-t5 = threading.Thread(target=run_nonlinear_analysis)
-t6 = threading.Thread(target=predic_with_model)
-
-
-t1.start()
-t2.start()
-t3.start()
-t4.start()
-t5.start()
-t6.start()
+            self.log(f"❌ [Prediction] Lỗi dự đoán: {e}")
+            return False
+        self.windows_completed += 1
+        # Miền không cần tính (đã dừng ở tầng trước) để trống
+        self.record_prediction([window.window_id] + [predictions[d][0] if d in predictions else np.nan
+                                                     for d in ("time", "wavelet", "nonlinear", "frequency")]
+                               + [final_pred], stage)
+        return False
+
+    # quality: QUALITY_OK hoặc lý do "no signal" (signal_quality.py) ghi vào cột "Signal Quality"
+    def record_prediction(self, result, stage=None, quality=QUALITY_OK, verbose=True):
+        result = result + [quality]
+        final_df = pd.DataFrame([result], columns=["Window", "Prediction Time", "Prediction Wavelet", "Prediction Nonlinear", "Prediction Fourier", "Final Prediction", "Signal Quality"])
+        final_df.to_csv(self.path(OUTPUT_FILE), index=False)
+        if not verbose:
+            return
+        window_id, pred_time, pred_wavelet, pred_nonlinear, pred_frequency, final_pred, _ = result
+        tier = "" if stage is None else f" (tầng {stage + 1}/{len(CASCADE_STAGES)})"
+        self.log(f"✅ [Prediction] Cửa sổ {window_id}{tier}: Time = {pred_time:.2f}, Wavelet = {pred_wavelet:.2f}, Nonlinear = {pred_nonlinear:.2f}, Fourier = {pred_frequency:.2f}, Final={final_pred:.2f}")
+
+
+# Phân tích mỗi cửa sổ 60 giây do luồng dữ liệu phát ra (trượt mỗi HOP_SECONDS)
+def feature_time_extractor(stream, window):
+    time_arr, ir_signal, start_index = stream.read_window(window)
+
+    if len(time_arr) >= 2:
+        if stream.beat_tracker is not None:
+            # Cửa sổ trượt 1 giây: chỉ phát hiện nhịp trên phần tín hiệu mới thay vì cả 60 giây
+            features = stream.beat_tracker.window_features(time_arr, ir_signal, start_index, WINDOW_SECONDS)
+        else:
+            # Như lúc huấn luyện model_time_domain.pkl: phát hiện đỉnh/đáy riêng cho từng cửa sổ
+            features = window_time_features(time_arr, ir_signal, WINDOW_SECONDS)
+
+        # Ghi kết quả
+        result = pd.DataFrame([features], columns=TIME_FEATURE_COLUMNS)
+        stream.scheduler.submit("time", window.window_id, result)
+        stream.save_features(result, window, TIME_FEATURE_FILE_NAME)
+        stream.log(f"✅ Đã lưu các đặc trưng vào '{TIME_FEATURE_FILE_NAME}'")
+
+def fourier_feature_extractor(stream, window):
+    time_arr, ir_signal, _ = stream.read_window(window)
+    if len(time_arr) >= 2:
+        if stream.resample_rate is None:
+            end_time = time_arr[-1]
+            start_time = end_time - FOURIER_SECONDS
+
+            mask = (time_arr >= start_time) & (time_arr <= end_time)
+            time_window = time_arr[mask]
+            ir_window = ir_signal[mask]
+        else:
+            # Lưới đều: 10 giây cuối luôn đúng FOURIER_SECONDS * rate + 1 mẫu (cả hai đầu như mask ở trên)
+            n = grid_length(FOURIER_SECONDS, stream.resample_rate) + 1
+            time_window = time_arr[-n:]
+            ir_window = ir_signal[-n:]
+
+        if len(time_window) < 2:
+            stream.log("⚠️ [Frequency] Dữ liệu trong 10 giây cuối không đủ để tính FFT.")
+            return
 
-t1.join()
-t2.join()
-t3.join()
-t4.join()
-t5.join()
-t6.join()
+        # FFT
+        N = len(ir_window)
+        if stream.resample_rate is None:
+            dt = np.mean(np.diff(time_window))
+            freqs = np.fft.rfftfreq(N, d=dt)
+        else:
+            freqs = rfft_frequencies(N, stream.resample_rate)  # cùng N mọi cửa sổ: tính một lần
+        fft_result = np.fft.rfft(ir_window)
+
+        amplitude = np.abs(fft_result)
+        phase = np.angle(fft_result)
+        power = amplitude ** 2
+
+        # Tìm peaks & troughs pha
+        peaks_all, _ = find_peaks(phase)
+        peaks = peaks_all[phase[peaks_all] > 1]
+
+        troughs_all, _ = find_peaks(-phase)
+        troughs = troughs_all[phase[troughs_all] < -1]
+
+        peak_phases = phase[peaks]
+        trough_phases = phase[troughs]
+
+        peak_mean = np.mean(peak_phases) if len(peak_phases) > 0 else 0
+        peak_std = np.std(peak_phases) if len(peak_phases) > 0 else 0
+        trough_mean = np.mean(trough_phases) if len(trough_phases) > 0 else 0
+        trough_std = np.std(trough_phases) if len(trough_phases) > 0 else 0
+
+        max_amplitude = np.max(amplitude)
+        fma = freqs[np.argmax(amplitude)]
+        total_power = np.sum(power)
+
+        output = pd.DataFrame([[
+            peak_mean, peak_std,
+            trough_mean, trough_std, fma, total_power
+        ]], columns=[
+            "AVG Peak", "STD Peak",
+            "AVG Trough", "STD Trough", "FMA", "Total Power"
+        ])
+
+        stream.scheduler.submit("frequency", window.window_id, output)
+        stream.save_features(output, window, FREQUENCY_FEATURE_FILE_NAME)
+
+        stream.log(f"✅ [Frequency] Đã tính đặc trưng và lưu vào '{FREQUENCY_FEATURE_FILE_NAME}'")
+    else:
+        stream.log("⚠️ [Frequency] Chưa có dữ liệu trong bộ đệm.")
+
+
+def wavelet_feature_extractor(stream, window):
+    time_arr, ir_signal, _ = stream.read_window(window)
+    if len(ir_signal) >= 2:
+        result = []
+
+        # Biến đổi wavelet mức 4 với coif5
+        coeffs = pywt.wavedec(ir_signal, wavelet='coif5', level=4)
+        A4, D4, D3, D2, D1 = coeffs  # Giải nén hệ số (ngược lại với thứ tự trả về)
+
+        # Tính kurtosis
+        kurt_D1 = kurtosis(D1)
+        kurt_D2 = kurtosis(D2)
+        kurt_D3 = kurtosis(D3)
+        kurt_A4 = kurtosis(A4)
+
+        result.append([kurt_D1, kurt_D2, kurt_D3, kurt_A4])
+        result_df = pd.DataFrame(result, columns=["Kurtosis D1", "Kurtosis D2", "Kurtosis D3", "Kurtosis A4"])
+        stream.scheduler.submit("wavelet", window.window_id, result_df)
+        stream.save_features(result_df, window, WAVELET_FEATURE_FILE_NAME)
+        stream.log("✅ Đã lưu các đặc trưng vào 'wavelet_results.csv'")
+
+
+# Chạy trong tiến trình của nhóm tiến trình: cửa sổ được đọc thẳng từ file bộ đệm vòng (memory-mapped)
+# theo chỉ số mẫu, nên chỉ đường dẫn và hai chỉ số được gửi qua pickle thay vì cả mảng tín hiệu.
+_worker_ring_buffers = {}
+
+def nonlinear_features_from_ring_buffer(buffer_path, start_index, end_index, rate=None, ami_method=None):
+    ring_buffer = _worker_ring_buffers.get(buffer_path)
+    if ring_buffer is None:
+        ring_buffer = _worker_ring_buffers[buffer_path] = PPGRingBuffer.open(buffer_path)
+    time_arr, _, ir_signal = ring_buffer.window(start_index, end_index)
+    ir_signal = reduce_rate(time_arr, ir_signal, rate)
+    if len(ir_signal) < 2:
+        return None
+    return nonlinear_window_features(ir_signal, max_lag=50, max_dim=10, ami_method=ami_method)
+
+# Phi tuyến chậm hơn HOP_SECONDS: nhóm worker chỉ giữ cửa sổ mới nhất nên các cửa sổ đã lỡ bị bỏ qua
+def run_nonlinear_analysis(stream, window):
+    features = stream.pool.run_in_process(nonlinear_features_from_ring_buffer, stream.ring_buffer.path,
+                                          window.start_index, window.end_index, stream.nonlinear_rate,
+                                          stream.ami_method)
+    if features is not None:
+        nonlinear_df = pd.DataFrame([features], columns=NONLINEAR_FEATURE_COLUMNS)
+        stream.scheduler.submit("nonlinear", window.window_id, nonlinear_df)
+        stream.save_features(nonlinear_df, window, NONLINEAR_FEATURE_FILE_NAME)
+        stream.log("✅ Đã lưu các đặc trưng vào 'nonlinear_results.csv'")
+
+DOMAIN_EXTRACTORS = {
+    "time": feature_time_extractor,
+    "wavelet": wavelet_feature_extractor,
+    "nonlinear": run_nonlinear_analysis,
+    "frequency": fourier_feature_extractor,
+}
+
+# Dự đoán cho một cửa sổ khi đã có đủ đặc trưng của cả 4 miền; None nếu có miền rỗng
+def predict_window(window_id, features):
+    df_time = features["time"]
+    df_wavelet = features["wavelet"]
+    df_nonlinear = features["nonlinear"]
+    df_frequency = features["frequency"]
+    if df_time.empty or df_wavelet.empty or df_nonlinear.empty or df_frequency.empty:
+        return None
+
+    model_time = models.get("time")
+    model_wavelet = models.get("wavelet")
+    model_nonlinear = models.get("nonlinear")
+    model_frequency = models.get("frequency")
+
+    pred_time = model_time.predict(df_time)[0]
+    pred_wavelet = model_wavelet.predict(df_wavelet)[0]
+    pred_nonlinear = model_nonlinear.predict(df_nonlinear)[0]
+    pred_frequency = model_frequency.predict(df_frequency)[0]
+
+    weight_sum = pred_time*acc_time + pred_nonlinear*acc_nonlinear + pred_wavelet*acc_wavelet + pred_frequency*acc_fourier
+    threshold = (acc_wavelet + acc_nonlinear + acc_time +acc_fourier)/2
+
+    final_pred = (weight_sum >= threshold).astype(int)
+
+    return [window_id, pred_time, pred_wavelet, pred_nonlinear, pred_frequency, final_pred]
+
+
+# Danh sách cảm biến "tên=cổng"; một cảm biến (mặc định) ghi kết quả ngay thư mục hiện tại như trước
+def build_streams(devices, pool, streams_dir=STREAMS_DIR, cascade_threshold=None, resample_rate=None,
+                  nonlinear_rate=None, ami_method=None, time_mode=None):
+    if not devices:
+        return [Stream("default", SERIAL_PORT, ".", pool, cascade_threshold, resample_rate, nonlinear_rate, ami_method,
+                       time_mode)]
+    streams = []
+    for device in devices:
+        name, sep, port = device.partition("=")
+        if not sep:
+            name, port = f"sensor{len(streams) + 1}", device
+        if any(s.name == name for s in streams):
+            raise ValueError(f"Tên cảm biến '{name}' bị trùng")
+        streams.append(Stream(name, port, os.path.join(streams_dir, name), pool, cascade_threshold,
+                              resample_rate, nonlinear_rate, ami_method, time_mode))
+    return streams
+
+
+# Khởi chạy song song: mỗi cảm biến một luồng đọc Serial, đặc trưng của mọi cảm biến chạy trên nhóm worker chung
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dự đoán trạng thái buồn ngủ thời gian thực từ một hoặc nhiều cảm biến PPG")
+    parser.add_argument("--device", action="append", default=[], metavar="NAME=PORT",
+                        help="Cảm biến cần theo dõi (lặp lại cho nhiều cảm biến), vd. left=COM3 hoặc "
+                             "right=replay:data/data_04042025.csv; mặc định một cảm biến trên SERIAL_PORT")
+    parser.add_argument("--streams-dir", default=STREAMS_DIR,
+                        help="Thư mục chứa kết quả của từng cảm biến khi có --device")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Số worker tính đặc trưng dùng chung (mặc định: số nhân CPU)")
+    parser.add_argument("--process-workers", type=int, default=os.cpu_count(),
+                        help="Số tiến trình tính đặc trưng phi tuyến (0: chạy ngay trong worker)")
+    parser.add_argument("--cascade", nargs="?", type=float, const=CASCADE_THRESHOLD, default=None, metavar="THRESHOLD",
+                        help="Dự đoán theo tầng: dừng sớm khi xác suất đạt ngưỡng (mặc định "
+                             f"{CASCADE_THRESHOLD}), chỉ tính wavelet/Fourier/phi tuyến khi chưa chắc chắn")
+    parser.add_argument("--resample", nargs="?", type=float, const=RESAMPLE_RATE_HZ, default=None, metavar="HZ",
+                        help="Lấy mẫu lại mỗi cửa sổ lên lưới thời gian đều (mặc định "
+                             f"{RESAMPLE_RATE_HZ:g} Hz) trước khi tính đặc trưng; bỏ qua cửa sổ có khoảng trống")
+    parser.add_argument("--nonlinear-rate", type=float, default=None, metavar="HZ",
+                        help="Tính đặc trưng phi tuyến trên tín hiệu giảm còn HZ (rẻ hơn, cần mô hình huấn luyện "
+                             "ở cùng tần số; xem nonlinear_rate_eval.py)")
+    parser.add_argument("--ami-method", choices=["sklearn", "histogram"], default=None,
+                        help="Cách ước lượng AMI, phải khớp với model_nonlinear.pkl (mặc định sklearn)")
+    parser.add_argument("--time-mode", choices=["window", "beats"], default=None,
+                        help="Cách tính miền thời gian, phải khớp với model_time_domain.pkl (mặc định "
+                             f"{time_domain.TIME_FEATURE_MODE}; beats nhanh hơn nhưng lệch so với window)")
+    args = parser.parse_args()
+
+    pool = SharedWorkerPool(args.workers, args.process_workers)
+    streams = build_streams(args.device, pool, args.streams_dir, args.cascade, args.resample,
+                            args.nonlinear_rate, args.ami_method, args.time_mode)
+    print(f"⚙️ {len(streams)} cảm biến, {pool.workers} worker tính đặc trưng, "
+          f"{pool.process_workers} tiến trình phi tuyến")
+    print("⏳ Đang đợi đủ 60 giây dữ liệu trước khi bắt đầu tính đặc trưng và dự đoán...")
+
+    models.start_watching()
+    readers = [threading.Thread(target=stream.serial_reader, name=f"serial-{stream.name}", daemon=True)
+               for stream in streams]
+    for t in readers:
+        t.start()
+    try:
+        for t in readers:
+            t.join()
+    except KeyboardInterrupt:
+        print("⛔ Dừng ghi dữ liệu.")
+        pool.shutdown(wait=False)
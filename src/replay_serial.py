@@ -0,0 +1,175 @@
+import argparse
+import time
+from urllib.parse import parse_qs
+
+import numpy as np
+import serial
+
+from ppg_archive import read_recording
+from serial_ingest import SerialBatchReader
+
+# Cổng Serial ảo phát lại một bản ghi data/*.csv (hoặc .ppgz) đúng định dạng ESP32 gửi lên ("ir,filtered\r\n"),
+# để chạy predict.py / plotPPG.py và đo độ trễ, thông lượng của luồng thời gian thực mà không cần MAX30102.
+# Dùng thay cho tên cổng thật, ví dụ:
+#   PPG_SERIAL_PORT="replay:data/data_04042025.csv" python src/predict.py            (tốc độ thật, 1x)
+#   PPG_SERIAL_PORT="replay:data/data_04042025.csv?speed=10" python src/predict.py   (nhanh gấp 10)
+#   PPG_SERIAL_PORT="replay:data/data_04042025.csv?speed=max&loop=1" ...             (không giới hạn, lặp lại)
+# Mỗi mẫu chỉ "đến" cổng khi tới thời điểm "Time (s)" của nó (chia cho speed); read() chặn theo timeout
+# giống pyserial nên bộ đọc theo lô hoạt động y như với thiết bị thật.
+
+REPLAY_PREFIX = "replay:"
+REPLAY_COLUMNS = ["IR Value raw", "IR Value filtered", "Time (s)"]
+
+
+class ReplaySerial:
+    def __init__(self, path, speed=1.0, loop=False, timeout=None):
+        # speed <= 0 hoặc None: phát không giới hạn tốc độ (mọi mẫu có sẵn ngay)
+        self.port = f"{REPLAY_PREFIX}{path}"
+        self.speed = speed if speed and speed > 0 else None
+        self.loop = loop
+        self.timeout = timeout
+        self.is_open = True
+
+        df = read_recording(path, REPLAY_COLUMNS).dropna()
+        lines = [f"{int(raw)},{int(filtered)}\r\n".encode()
+                 for raw, filtered in zip(df["IR Value raw"], df["IR Value filtered"])]
+        self._payload = b"".join(lines)
+        self._line_ends = np.cumsum([len(line) for line in lines])
+        times = df["Time (s)"].to_numpy(dtype=np.float64)
+        self._offsets = times - times[0] if len(times) else times
+        # Khoảng cách giữa hai vòng phát lại: một chu kỳ lấy mẫu trung bình
+        self._period = float(np.median(np.diff(times))) if len(times) > 1 else 0.0
+        self._position = 0
+        self._rounds = 0
+        self._start = time.monotonic()
+
+    @property
+    def samples(self):
+        return len(self._line_ends)
+
+    def _emitted_at(self, index):
+        # Thời điểm (đồng hồ đơn điệu) mẫu thứ index được gửi, tính cả các vòng lặp trước
+        span = self._offsets[-1] + self._period
+        offset = self._rounds * span + self._offsets[index]
+        return self._start + offset / self.speed
+
+    def _available(self):
+        # Số byte thiết bị đã "gửi" tới thời điểm hiện tại
+        total = len(self._payload)
+        if self.speed is None:
+            return total
+        elapsed = (time.monotonic() - self._start) * self.speed
+        span = self._offsets[-1] + self._period
+        if self.loop and span > 0:
+            elapsed -= self._rounds * span
+        count = int(np.searchsorted(self._offsets, elapsed, side="right"))
+        return int(self._line_ends[count - 1]) if count else 0
+
+    def _next_arrival(self):
+        # Thời điểm mẫu kế tiếp đến cổng, None nếu đã phát hết
+        if self._position >= len(self._payload):
+            return None
+        if self.speed is None:
+            return time.monotonic()
+        index = int(np.searchsorted(self._line_ends, self._position, side="right"))
+        return self._emitted_at(index)
+
+    def _rewind(self):
+        if self.loop and self._position >= len(self._payload) and len(self._payload):
+            self._position = 0
+            self._rounds += 1
+            if self.speed is None:
+                self._start = time.monotonic()
+
+    @property
+    def finished(self):
+        return not self.loop and self._position >= len(self._payload)
+
+    @property
+    def in_waiting(self):
+        self._check_open()
+        self._rewind()
+        return max(self._available() - self._position, 0)
+
+    def read(self, size=1):
+        # Giống serial.Serial.read: trả về tối đa size byte, chờ tới khi đủ hoặc hết timeout
+        self._check_open()
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        data = b""
+        while len(data) < size:
+            self._rewind()
+            available = self._available()
+            if available > self._position:
+                end = min(available, self._position + size - len(data))
+                data += self._payload[self._position:end]
+                self._position = end
+                continue
+            arrival = self._next_arrival()
+            now = time.monotonic()
+            if arrival is None and deadline is None:
+                break  # đã phát hết và không lặp: không còn gì để chờ
+            wake = arrival if deadline is None else min(arrival or deadline, deadline)
+            if deadline is not None and now >= deadline:
+                break
+            time.sleep(max(wake - now, 0))
+        return data
+
+    def reset_input_buffer(self):
+        self._rewind()
+        self._position = max(self._available(), self._position)
+
+    def _check_open(self):
+        if not self.is_open:
+            raise serial.SerialException(f"Cổng {self.port} đã đóng")
+
+    def close(self):
+        self.is_open = False
+
+
+def open_serial(port, baudrate, **kwargs):
+    # Mở cổng thật, hoặc ReplaySerial nếu port có dạng "replay:<đường dẫn>[?speed=N&loop=1]"
+    if not port.startswith(REPLAY_PREFIX):
+        return serial.Serial(port, baudrate, **kwargs)
+    path, _, query = port[len(REPLAY_PREFIX):].partition("?")
+    options = {k: v[-1] for k, v in parse_qs(query).items()}
+    speed = options.get("speed", "1")
+    speed = 0.0 if speed.lower() in ("max", "0") else float(speed.rstrip("xX"))
+    loop = options.get("loop", "0").lower() in ("1", "true", "yes")
+    try:
+        return ReplaySerial(path, speed=speed, loop=loop, timeout=kwargs.get("timeout"))
+    except (OSError, ValueError) as e:
+        raise serial.SerialException(f"Không mở được bản ghi '{path}': {e}") from e
+
+
+if __name__ == "__main__":
+    # Đo thông lượng và độ trễ của bộ đọc theo lô khi phát lại một bản ghi
+    parser = argparse.ArgumentParser(description="Phát lại bản ghi PPG qua cổng Serial ảo và đo thông lượng/độ trễ")
+    parser.add_argument("recording", help="File data/*.csv hoặc .ppgz")
+    parser.add_argument("--speed", default="1", help="Hệ số tốc độ (1, 10, ...) hoặc 'max' để không giới hạn")
+    parser.add_argument("--seconds", type=float, default=None, help="Dừng sau số giây (đồng hồ thật) này")
+    args = parser.parse_args()
+
+    ser = open_serial(f"{REPLAY_PREFIX}{args.recording}?speed={args.speed}", 115200)
+    reader = SerialBatchReader(ser)
+    reader.start_clock()
+    samples, batches, lags = 0, 0, []
+    begin = time.monotonic()
+    while not ser.finished or ser.in_waiting:
+        if args.seconds is not None and time.monotonic() - begin >= args.seconds:
+            break
+        batch = reader.read_batch()
+        if len(batch.elapsed) == 0:
+            continue
+        samples += len(batch.elapsed)
+        batches += 1
+        if ser.speed is not None:
+            # Độ trễ: từ lúc mẫu cuối của lô được "gửi" tới lúc bộ đọc nhận được cả lô
+            lags.append(time.monotonic() - ser._emitted_at(samples - 1))
+    duration = time.monotonic() - begin
+
+    print(f"📡 {samples}/{ser.samples} mẫu trong {batches} lô, {duration:.2f} s")
+    print(f"🚀 Thông lượng: {samples / duration:.0f} mẫu/s")
+    if lags:
+        lags = np.array(lags) * 1000
+        print(f"⏱️ Độ trễ lô: trung vị {np.median(lags):.2f} ms, p95 {np.percentile(lags, 95):.2f} ms, "
+              f"lớn nhất {lags.max():.2f} ms")
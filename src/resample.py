@@ -0,0 +1,114 @@
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+from scipy.signal import decimate
+
+# Đưa tín hiệu về lưới thời gian đều tuyệt đối trước khi tính đặc trưng.
+# Mẫu được gắn nhãn thời gian ở máy tính (time.time() - record_start) nên khoảng cách giữa hai mẫu dao động
+# quanh 20-40 ms, trong khi FFT (dt = mean(diff)), khoảng cách đỉnh của find_peaks và các cửa sổ theo số mẫu
+# của nonlinear.py đều giả sử tần số lấy mẫu đều. Lưới được neo vào thời gian tuyệt đối: điểm thứ k nằm tại
+# k / rate, nên chỉ số k (grid index) của cùng một thời điểm không đổi giữa các cửa sổ trượt (BeatTracker
+# dùng được như chỉ số mẫu tuyệt đối) và một cửa sổ W giây luôn có đúng W * rate mẫu.
+#   - Nội suy tuyến tính một lượt: searchsorted một lần, mọi kênh (raw, filtered, ...) dùng chung chỉ số/trọng số.
+#   - Giảm tần số (rate thấp hơn tần số gốc): nội suy lên lưới trung gian rate * q >= tần số gốc rồi
+#     decimate (FIR pha không, chống chồng phổ) q lần.
+#   - Phát hiện khoảng trống: điểm lưới nằm giữa hai mẫu gốc cách nhau > max_gap giây (mất kết nối, bỏ tay)
+#     được đánh dấu valid=False; giá trị ở đó chỉ là nội suy, không phải dữ liệu thật.
+
+RESAMPLE_RATE_HZ = 25.0   # phần lớn bản ghi trong data/ ở ~25 Hz (có bản ghi 17 Hz, 50 Hz, 62.5 Hz)
+MAX_GAP_SECONDS = 0.5     # khoảng cách bình thường tối đa ~0.2 s
+GAP = "gap"               # lý do bỏ qua cửa sổ có khoảng trống (cột "Signal Quality" của predict.py)
+DECIMATION_TOLERANCE = 1.1  # tần số gốc chỉ nhỉnh hơn rate (do dao động nhãn thời gian) thì chỉ nội suy
+
+# time: thời điểm các điểm lưới; signal: giá trị (1 chiều, hoặc n x kênh); valid: False tại khoảng trống;
+# source_index: chỉ số mẫu gốc ngay trước mỗi điểm lưới (để lấy nhãn); first_index: chỉ số lưới của điểm đầu
+Resampled = namedtuple("Resampled", ["time", "signal", "valid", "source_index", "rate", "first_index"])
+
+
+def native_rate(time):
+    # Tần số lấy mẫu gốc ước lượng bằng trung vị (không bị kéo lệch bởi khoảng trống)
+    diffs = np.diff(time)
+    diffs = diffs[diffs > 0]
+    return 1 / np.median(diffs) if len(diffs) else np.nan
+
+
+def decimation_factor(time, rate):
+    source_rate = native_rate(time)
+    if not np.isfinite(source_rate) or source_rate <= rate * DECIMATION_TOLERANCE:
+        return 1
+    return int(np.ceil(source_rate / rate - 1e-6))
+
+
+def _interpolate(time, signal, grid):
+    idx = np.searchsorted(time, grid, side="right")
+    right = np.clip(idx, 1, len(time) - 1)
+    left = right - 1
+    span = time[right] - time[left]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weight = np.clip(np.where(span > 0, (grid - time[left]) / span, 0.0), 0.0, 1.0)
+    if signal.ndim > 1:
+        weight = weight[:, None]
+    values = signal[left] * (1 - weight) + signal[right] * weight
+    return values, left, right
+
+
+def resample_uniform(time, signal, rate=RESAMPLE_RATE_HZ, max_gap=MAX_GAP_SECONDS, start=None, end=None):
+    # `signal`: mảng 1 chiều hoặc ma trận (mẫu x kênh); `time` tăng dần (mẫu trùng thời gian được giữ mẫu sau)
+    time = np.asarray(time, dtype=np.float64)
+    signal = np.asarray(signal, dtype=np.float64)
+    start = time[0] if start is None else start
+    end = time[-1] if end is None else end
+    q = decimation_factor(time, rate)
+    fine_rate = rate * q
+
+    first_index = int(np.ceil(start * rate - 1e-9))
+    last_index = int(np.floor(end * rate + 1e-9))
+    n = max(last_index - first_index + 1, 0)
+    if len(time) < 2 or n == 0:
+        empty = np.empty((0,) + signal.shape[1:])
+        return Resampled(np.empty(0), empty, np.zeros(0, dtype=bool), np.zeros(0, dtype=np.int64), rate, first_index)
+
+    # Lưới mịn bắt đầu đúng tại điểm lưới đầu tiên để mẫu thứ j sau decimate trùng điểm thứ j * q
+    fine = (first_index * q + np.arange((n - 1) * q + 1)) / fine_rate
+    values, left, right = _interpolate(time, signal, fine)
+    if q > 1:
+        values = decimate(values, q, ftype="fir", axis=0, zero_phase=True)[:n]
+        left, right = left[::q], right[::q]
+
+    grid = (first_index + np.arange(n)) / rate
+    valid = (time[right] - time[left] <= max_gap) & (grid >= time[0]) & (grid <= time[-1])
+    return Resampled(grid, values, valid, left, rate, first_index)
+
+
+def gaps(time, max_gap=MAX_GAP_SECONDS):
+    # Các khoảng trống (thời điểm mẫu trước, thời điểm mẫu sau) dài hơn max_gap giây
+    time = np.asarray(time)
+    where = np.flatnonzero(np.diff(time) > max_gap)
+    return np.column_stack([time[where], time[where + 1]])
+
+
+def overlaps_gap(starts, ends, gap_list):
+    # Mask các cửa sổ [start, end] có chứa (một phần) khoảng trống
+    starts = np.asarray(starts, dtype=np.float64)
+    ends = np.asarray(ends, dtype=np.float64)
+    if len(gap_list) == 0:
+        return np.zeros(len(starts), dtype=bool)
+    # Khoảng trống đầu tiên kết thúc sau start phải bắt đầu trước end
+    first = np.searchsorted(gap_list[:, 1], starts, side="right")
+    has = first < len(gap_list)
+    return has & (gap_list[np.minimum(first, len(gap_list) - 1), 0] < ends)
+
+
+@lru_cache(maxsize=None)
+def grid_length(seconds, rate):
+    # Số điểm lưới cố định của một cửa sổ `seconds` giây
+    return int(round(seconds * rate))
+
+
+@lru_cache(maxsize=None)
+def rfft_frequencies(n, rate):
+    # Trục tần số của rfft cho cửa sổ n mẫu trên lưới đều: tính một lần, dùng lại cho mọi cửa sổ
+    freqs = np.fft.rfftfreq(n, d=1 / rate)
+    freqs.flags.writeable = False
+    return freqs
@@ -0,0 +1,98 @@
+import csv
+import os
+
+# Ghi kết quả theo từng cửa sổ vào CSV bằng cách nối thêm (append) theo lô,
+# thay vì dựng lại DataFrame và ghi đè cả file sau mỗi cửa sổ (O(n²) I/O).
+# Khi mở lại một file đã có (resume=True), các hàng cũ được giữ nguyên,
+# dòng cuối ghi dở (nếu chương trình bị dừng giữa chừng) bị cắt bỏ,
+# và `last_key` cho biết cửa sổ cuối cùng đã ghi để tính tiếp từ đó.
+# `source`: khóa của dữ liệu nguồn (vd. sha256 của bản ghi), lưu cạnh file kết quả ở <path>.source;
+# chỉ tính tiếp khi khóa khớp, tránh nối kết quả của bản ghi khác vào file cũ.
+
+
+class CSVResultSink:
+    def __init__(self, path, columns, flush_every=50, resume=True, key_column=None, source=None):
+        self.path = path
+        self.source = source
+        self.columns = list(columns)
+        self.flush_every = flush_every
+        self.key_index = self.columns.index(key_column) if key_column is not None else 0
+        self.rows_written = 0
+        self.last_key = None
+        self._buffer = []
+
+        if resume and os.path.exists(path) and os.path.getsize(path) > 0:
+            self._check_source()
+            self._recover()
+            self._file = open(path, "a", newline="", encoding="utf-8")
+            self._writer = csv.writer(self._file, lineterminator="\n")
+        else:
+            self._file = open(path, "w", newline="", encoding="utf-8")
+            self._writer = csv.writer(self._file, lineterminator="\n")
+            self._writer.writerow(self.columns)
+            self._file.flush()
+            self._write_source()
+
+    @property
+    def source_path(self):
+        return self.path + ".source"
+
+    def _check_source(self):
+        if self.source is None:
+            return
+        previous = None
+        if os.path.exists(self.source_path):
+            with open(self.source_path, encoding="utf-8") as f:
+                previous = f.read().strip()
+        if previous != self.source:
+            raise ValueError(f"File '{self.path}' được tạo từ dữ liệu nguồn khác ({previous or 'không rõ'}), "
+                             f"không thể tính tiếp cho {self.source}; xóa file hoặc dùng resume=False")
+
+    def _write_source(self):
+        if self.source is None:
+            if os.path.exists(self.source_path):
+                os.remove(self.source_path)
+            return
+        with open(self.source_path, "w", encoding="utf-8") as f:
+            f.write(self.source + "\n")
+
+    def _recover(self):
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            # Cắt dòng cuối chưa có ký tự xuống dòng (bị ngắt khi đang ghi)
+            end = data.rfind(b"\n") + 1
+            if end < len(data):
+                f.truncate(end)
+                data = data[:end]
+        lines = data.decode("utf-8").splitlines()
+        header = next(csv.reader(lines[:1]), [])
+        if header != self.columns:
+            raise ValueError(f"File '{self.path}' có cột {header}, không khớp {self.columns}")
+        rows = list(csv.reader(lines[1:]))
+        self.rows_written = len(rows)
+        if rows:
+            self.last_key = float(rows[-1][self.key_index])
+
+    def append(self, row):
+        self._buffer.append(row)
+        if len(self._buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._writer.writerows(self._buffer)
+            self.rows_written += len(self._buffer)
+            self.last_key = float(self._buffer[-1][self.key_index])
+            self._buffer.clear()
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
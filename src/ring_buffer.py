@@ -0,0 +1,135 @@
+import os
+import numpy as np
+
+# Bộ đệm vòng ánh xạ bộ nhớ (memory-mapped) chứa các mẫu (thời gian, IR raw, IR filtered).
+# Mỗi mẫu được ghi 2 lần: tại vị trí i và i + capacity, nhờ vậy N mẫu mới nhất
+# (N <= capacity) luôn nằm liền kề nhau và có thể lấy ra bằng một view NumPy
+# không sao chép (zero-copy), kể cả khi vòng đệm đã quay vòng.
+
+RING_BUFFER_FILE_NAME = "data.buf"
+DEFAULT_CAPACITY = 1 << 15  # ~650 giây ở tốc độ ~50 Hz, dư cho cửa sổ 60 giây
+
+_MAGIC = 0x50504752  # "PPGR"
+_HEADER_FIELDS = 4   # magic, capacity, count, reserved
+_HEADER_BYTES = 64
+
+
+class PPGRingBuffer:
+    def __init__(self, path=RING_BUFFER_FILE_NAME, capacity=None, create=False):
+        self.path = path
+        if create:
+            if capacity is None:
+                capacity = DEFAULT_CAPACITY
+            self._create_file(path, capacity)
+        elif not os.path.exists(path):
+            raise FileNotFoundError(path)
+
+        mode = "r+" if create else "r"
+        self._header = np.memmap(path, dtype=np.int64, mode=mode, shape=(_HEADER_FIELDS,))
+        if self._header[0] != _MAGIC:
+            raise ValueError(f"File '{path}' không phải bộ đệm vòng PPG")
+        self.capacity = int(self._header[1])
+
+        size = 2 * self.capacity
+        offset = _HEADER_BYTES
+        self._time = np.memmap(path, dtype=np.float64, mode=mode, offset=offset, shape=(size,))
+        offset += self._time.nbytes
+        self._raw = np.memmap(path, dtype=np.int32, mode=mode, offset=offset, shape=(size,))
+        offset += self._raw.nbytes
+        self._filtered = np.memmap(path, dtype=np.int32, mode=mode, offset=offset, shape=(size,))
+
+    @classmethod
+    def create(cls, path=RING_BUFFER_FILE_NAME, capacity=DEFAULT_CAPACITY):
+        return cls(path, capacity=capacity, create=True)
+
+    @classmethod
+    def open(cls, path=RING_BUFFER_FILE_NAME):
+        return cls(path)
+
+    @staticmethod
+    def _create_file(path, capacity):
+        size = 2 * capacity
+        total = _HEADER_BYTES + size * (8 + 4 + 4)
+        # Không cắt file về 0 nếu đã tồn tại: tiến trình khác (app.py) có thể đang map file này
+        with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+            f.truncate(total)
+        header = np.memmap(path, dtype=np.int64, mode="r+", shape=(_HEADER_FIELDS,))
+        header[:] = [_MAGIC, capacity, 0, 0]
+        header.flush()
+        del header
+
+    @property
+    def count(self):
+        # Tổng số mẫu đã ghi kể từ khi tạo bộ đệm (không bị giảm khi quay vòng)
+        return int(self._header[2])
+
+    def reset(self):
+        self._header[2] = 0
+
+    def extend(self, times, ir_raw, ir_filtered):
+        times = np.asarray(times, dtype=np.float64)
+        n = len(times)
+        if n == 0:
+            return
+        if n > self.capacity:
+            # Chỉ giữ lại phần cuối vừa với bộ đệm
+            skip = n - self.capacity
+            self._header[2] = int(self._header[2]) + skip
+            times = times[skip:]
+            ir_raw = np.asarray(ir_raw)[skip:]
+            ir_filtered = np.asarray(ir_filtered)[skip:]
+            n = self.capacity
+
+        count = int(self._header[2])
+        pos = count % self.capacity
+        first = min(n, self.capacity - pos)
+        for arr, values in ((self._time, times), (self._raw, ir_raw), (self._filtered, ir_filtered)):
+            values = np.asarray(values)
+            # Ghi phần đầu tại [pos, pos + first), phần quay vòng (nếu có) từ 0
+            arr[pos:pos + first] = values[:first]
+            arr[pos + self.capacity:pos + self.capacity + first] = values[:first]
+            if first < n:
+                arr[0:n - first] = values[first:]
+                arr[self.capacity:self.capacity + n - first] = values[first:]
+        # Cập nhật bộ đếm sau cùng để bên đọc không thấy mẫu ghi dở
+        self._header[2] = count + n
+
+    def latest(self, n):
+        # Trả về view (time, raw, filtered) của n mẫu mới nhất
+        count = int(self._header[2])
+        n = min(n, count, self.capacity)
+        end = count % self.capacity + self.capacity
+        start = end - n
+        return self._time[start:end], self._raw[start:end], self._filtered[start:end]
+
+    def latest_window(self, seconds):
+        # View của các mẫu nằm trong `seconds` giây cuối cùng
+        time_arr, raw, filtered = self.latest(self.capacity)
+        if len(time_arr) == 0:
+            return time_arr, raw, filtered
+        first = np.searchsorted(time_arr, time_arr[-1] - seconds, side="left")
+        return time_arr[first:], raw[first:], filtered[first:]
+
+    def latest_window_bounds(self, seconds):
+        # Chỉ số tuyệt đối [start_index, end_index) của `seconds` giây cuối cùng
+        count = int(self._header[2])
+        n = min(count, self.capacity)
+        end = count % self.capacity + self.capacity
+        time_arr = self._time[end - n:end]
+        if n == 0:
+            return count, count
+        first = np.searchsorted(time_arr, time_arr[-1] - seconds, side="left")
+        return count - n + int(first), count
+
+    def window(self, start_index, end_index):
+        # View của các mẫu có chỉ số tuyệt đối [start_index, end_index)
+        count = int(self._header[2])
+        if end_index > count or count - start_index > self.capacity:
+            raise IndexError(f"Cửa sổ [{start_index}, {end_index}) không còn trong bộ đệm")
+        end = (end_index - 1) % self.capacity + self.capacity + 1
+        start = end - (end_index - start_index)
+        return self._time[start:end], self._raw[start:end], self._filtered[start:end]
+
+    def flush(self):
+        for arr in (self._time, self._raw, self._filtered, self._header):
+            arr.flush()
@@ -0,0 +1,155 @@
+import multiprocessing
+import os
+import signal
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Một cửa sổ tín hiệu được xác định bằng chỉ số mẫu tuyệt đối trong bộ đệm vòng
+# [start_index, end_index) và id tăng dần; mọi kết quả đặc trưng đều mang id này.
+Window = namedtuple("Window", ["window_id", "start_index", "end_index", "t_start", "t_end"])
+
+
+class PipelineScheduler:
+    # Sự kiện "cửa sổ sẵn sàng" được phát tới từng miền (time, wavelet, ...);
+    # khi đủ kết quả của tất cả các miền cho cùng một cửa sổ k thì phát sự kiện
+    # "cửa sổ k hoàn tất" cho luồng dự đoán: on_complete(window_id, results) được gọi ngay trong luồng
+    # nộp kết quả cuối cùng (dùng với SharedWorkerPool).
+    def __init__(self, domains, on_complete, max_pending=120):
+        self.domains = tuple(domains)
+        self.max_pending = max_pending
+        self.on_complete = on_complete
+        self._pending = {}
+        self._last_completed = -1
+        self._lock = threading.Lock()
+
+    def submit(self, domain, window_id, result):
+        with self._lock:
+            if window_id <= self._last_completed:
+                return
+            results = self._pending.setdefault(window_id, {})
+            results[domain] = result
+            if len(results) < len(self.domains):
+                # Giới hạn số cửa sổ dở dang (miền nào đó đã bỏ qua chúng)
+                while len(self._pending) > self.max_pending:
+                    del self._pending[min(self._pending)]
+                return
+            del self._pending[window_id]
+            self._last_completed = window_id
+            for stale in [k for k in self._pending if k < window_id]:
+                del self._pending[stale]
+        self.on_complete(window_id, results)
+
+
+class CascadeScheduler:
+    # Giống PipelineScheduler (cùng submit(domain, window_id, result)) nhưng các miền chạy theo tầng:
+    # start(window) trả về các miền của tầng đầu; khi đủ kết quả của một tầng, on_stage(window, stage, results)
+    # được gọi với mọi kết quả đã có và trả về True nếu cần tính tiếp. Khi đó tầng được tăng trước,
+    # rồi dispatch(window, domains) mới được gọi cho các miền của tầng sau.
+    def __init__(self, stages, on_stage, dispatch, max_pending=120):
+        self.stages = tuple(tuple(stage) for stage in stages)
+        self.domains = tuple(d for stage in self.stages for d in stage)
+        self.on_stage = on_stage
+        self.dispatch = dispatch
+        self.max_pending = max_pending
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def start(self, window):
+        with self._lock:
+            self._pending[window.window_id] = {"window": window, "stage": 0, "results": {}}
+            # Giới hạn số cửa sổ dở dang (miền nào đó đã bỏ qua chúng)
+            while len(self._pending) > self.max_pending:
+                del self._pending[min(self._pending)]
+        self.dispatch(window, self.stages[0])
+
+    def submit(self, domain, window_id, result):
+        with self._lock:
+            entry = self._pending.get(window_id)
+            if entry is None:
+                return
+            entry["results"][domain] = result
+            stage = entry["stage"]
+            if any(d not in entry["results"] for d in self.stages[stage]):
+                return
+            results = dict(entry["results"])
+        escalate = self.on_stage(entry["window"], stage, results) and stage + 1 < len(self.stages)
+        with self._lock:
+            if not escalate:
+                self._pending.pop(window_id, None)
+                return
+            entry["stage"] = stage + 1
+        self.dispatch(entry["window"], self.stages[stage + 1])
+
+
+def _ignore_sigint():
+    # Ctrl+C chỉ để tiến trình chính xử lý; tiến trình con dừng khi nhóm tiến trình được tắt
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class SharedWorkerPool:
+    # Nhóm luồng xử lý dùng chung cho mọi luồng dữ liệu (mỗi cảm biến một luồng dữ liệu).
+    # Mỗi khóa (luồng dữ liệu, miền) chạy tuần tự và chỉ giữ việc mới nhất đang chờ, giống
+    # hàng đợi maxsize=1: miền chậm bỏ qua cửa sổ cũ thay vì dồn việc,
+    # còn các khóa khác nhau chạy song song trên các worker.
+    # Miền nặng, chủ yếu là vòng lặp Python giữ GIL (phi tuyến), được chạy qua run_in_process trên một
+    # nhóm tiến trình thường trực (process_workers > 0) để không làm chậm luồng đọc Serial và các miền nhẹ.
+    def __init__(self, workers=None, process_workers=0):
+        self.workers = workers or os.cpu_count() or 1
+        self.process_workers = process_workers
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="feature")
+        self._processes = None
+        if process_workers:
+            # "spawn": không fork một tiến trình đang có nhiều luồng (và giống hành vi trên Windows)
+            self._processes = ProcessPoolExecutor(max_workers=process_workers,
+                                                  mp_context=multiprocessing.get_context("spawn"),
+                                                  initializer=_ignore_sigint)
+            # Khởi động sẵn các tiến trình để cửa sổ đầu tiên không phải chờ import thư viện
+            for _ in range(process_workers):
+                self._processes.submit(os.getpid)
+        self._lock = threading.Lock()
+        self._running = set()
+        self._waiting = {}
+        self._closed = False
+
+    def submit_latest(self, key, fn, *args):
+        with self._lock:
+            if self._closed:
+                return
+            if key in self._running:
+                self._waiting[key] = (fn, args)
+                return
+            self._running.add(key)
+        self._executor.submit(self._run, key, fn, args)
+
+    def cancel(self, key):
+        # Bỏ việc đang chờ của khóa (việc đang chạy vẫn chạy nốt)
+        with self._lock:
+            self._waiting.pop(key, None)
+
+    def _run(self, key, fn, args):
+        try:
+            fn(*args)
+        except Exception as e:
+            print(f"❌ [{key}] Lỗi xử lý: {e}")
+        with self._lock:
+            waiting = self._waiting.pop(key, None)
+            if waiting is None or self._closed:
+                self._running.discard(key)
+                return
+        # Đưa lại vào cuối hàng đợi để các khóa khác không bị lấn lượt
+        self._executor.submit(self._run, key, *waiting)
+
+    def run_in_process(self, fn, *args):
+        # Chạy fn trong nhóm tiến trình (nếu có) và chờ kết quả; luồng worker nhả GIL trong lúc chờ.
+        # fn và các tham số phải pickle được và nhỏ: dữ liệu cửa sổ nên đi qua bộ nhớ dùng chung.
+        if self._processes is None:
+            return fn(*args)
+        return self._processes.submit(fn, *args).result()
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+        if self._processes is not None:
+            self._processes.shutdown(wait=wait, cancel_futures=not wait)
@@ -0,0 +1,166 @@
+import re
+import time
+import warnings
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+import pytz
+
+# Đọc Serial theo lô thay vì readline() từng dòng trong vòng lặp kiểm tra in_waiting:
+#   - ser.read() chặn (blocking) tới khi có dữ liệu hoặc hết READ_TIMEOUT_SECONDS, nên luồng đọc
+#     ngủ khi không có dữ liệu thay vì quay vòng chiếm trọn một nhân CPU;
+#   - mọi dòng "raw,filtered" hoàn chỉnh trong bộ đệm được kiểm tra và chuyển thành mảng NumPy
+#     trong một lần; dòng cuối chưa hoàn chỉnh được giữ lại cho lần đọc sau;
+#   - thời gian lấy từ đồng hồ đơn điệu (time.monotonic, không nhảy khi chỉnh giờ hệ thống);
+#     các mẫu trong lô được rải đều giữa thời điểm nhận lô trước và lô này, nhưng không trải dài quá
+#     n * MAX_SAMPLE_PERIOD_SECONDS (kết thúc tại lúc nhận): sau một lúc im lặng / kết nối lại, khoảng
+#     trống vẫn còn nguyên trong "Time (s)" thay vì bị lấp bằng các mẫu bịa ra;
+#   - giờ thực (Time (real)) chỉ định dạng một lần cho mỗi lô.
+
+READ_TIMEOUT_SECONDS = 0.05
+MAX_READ_BYTES = 1 << 16
+MAX_SAMPLE_PERIOD_SECONDS = 0.06  # chu kỳ mẫu dài nhất gặp trong data/ (~17 Hz)
+
+VN_TZ = pytz.timezone('Asia/Ho_Chi_Minh')
+
+_SAMPLE_LINE = re.compile(rb"^[ \t]*(-?\d+)[ \t]*,[ \t]*(-?\d+)[ \t]*\r?$", re.MULTILINE)
+_ALLOWED = np.zeros(256, dtype=bool)
+_ALLOWED[list(b"0123456789-, \t\r\n")] = True
+_DIGITS = np.zeros(256, dtype=bool)
+_DIGITS[list(b"0123456789")] = True
+_SEPARATORS = bytes.maketrans(b",\t\r\n", b"    ")
+
+# elapsed: số giây kể từ khi bắt đầu ghi; wall_time: chuỗi giờ thực của lô
+Batch = namedtuple("Batch", ["elapsed", "ir_raw", "ir_filtered", "wall_time"])
+
+
+def _parse_samples_regex(data, end):
+    pairs = _SAMPLE_LINE.findall(data, 0, end)
+    values = np.array([int(v) for pair in pairs for v in pair], dtype=np.int64)
+    return values.reshape(-1, 2)
+
+
+def parse_samples(data):
+    # Trả về (ir_raw, ir_filtered, số byte đã dùng); bỏ qua dòng không đúng định dạng.
+    # Kiểm tra từng dòng bằng phép toán NumPy trên mảng byte (ký tự hợp lệ, đúng một dấu phẩy),
+    # rồi chuyển cả bộ đệm thành số trong một lần gọi np.fromstring.
+    end = data.rfind(b"\n") + 1
+    empty = np.empty(0, dtype=np.int64)
+    if end == 0:
+        return empty, empty, 0
+    buf = np.frombuffer(data, dtype=np.uint8, count=end)
+    newline = buf == ord("\n")
+    line_id = np.cumsum(newline) - newline
+    n_lines = int(line_id[-1]) + 1
+    bad = np.bincount(line_id[~_ALLOWED[buf]], minlength=n_lines)
+    commas = np.bincount(line_id[buf == ord(",")], minlength=n_lines)
+    digits = np.bincount(line_id[_DIGITS[buf]], minlength=n_lines)
+    valid = (bad == 0) & (commas == 1) & (digits >= 2)
+
+    clean = data[:end] if valid.all() else buf[valid[line_id]].tobytes()
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", DeprecationWarning)
+            values = np.fromstring(clean.translate(_SEPARATORS).decode("ascii"), dtype=np.int64, sep=" ")
+    except (DeprecationWarning, ValueError):
+        values = empty
+    if len(values) != 2 * int(valid.sum()):
+        # Dòng lạ lọt qua bước kiểm tra nhanh (vd. "12,-"): tách lại bằng regex
+        values = _parse_samples_regex(data, end)
+    values = values.reshape(-1, 2)
+    return values[:, 0], values[:, 1], end
+
+
+class SerialBatchReader:
+    def __init__(self, ser=None, read_timeout=READ_TIMEOUT_SECONDS, tz=VN_TZ):
+        self.read_timeout = read_timeout
+        self.tz = tz
+        self.ser = None
+        self._pending = b""
+        self._start = None
+        self._wall_start = None
+        self._last_elapsed = 0.0
+        self._contiguous = True
+        self._period = MAX_SAMPLE_PERIOD_SECONDS  # chu kỳ mẫu ước lượng từ các lô liền mạch gần đây
+        if ser is not None:
+            self.attach(ser)
+
+    def attach(self, ser):
+        # Gắn cổng mới (khi kết nối lại): giữ nguyên đồng hồ, bỏ phần dòng dở của cổng cũ
+        ser.timeout = self.read_timeout
+        self.ser = ser
+        self.drop_partial()
+        self.mark_discontinuity()
+
+    def drop_partial(self):
+        self._pending = b""
+
+    def mark_discontinuity(self):
+        # Lô tiếp theo không nối liền với lô trước (kết nối lại): thời điểm mẫu tính lùi từ lúc nhận
+        # theo chu kỳ mẫu ước lượng, không rải qua thời gian mất kết nối
+        self._contiguous = False
+
+    @property
+    def started(self):
+        return self._start is not None
+
+    def start_clock(self):
+        self._start = time.monotonic()
+        self._wall_start = time.time()
+        self._last_elapsed = 0.0
+        self._contiguous = True
+
+    def elapsed(self):
+        return time.monotonic() - self._start
+
+    def _read(self, block):
+        if block:
+            # Chặn tới khi có ít nhất 1 byte (hoặc hết timeout), sau đó lấy nốt phần đã về
+            data = self.ser.read(1)
+            waiting = self.ser.in_waiting
+            if waiting:
+                data += self.ser.read(min(waiting, MAX_READ_BYTES))
+            return data
+        waiting = self.ser.in_waiting
+        return self.ser.read(min(waiting, MAX_READ_BYTES)) if waiting else b""
+
+    def read_batch(self, block=True):
+        # Một lô các mẫu mới (có thể rỗng khi hết timeout); block=False cho vòng lặp giao diện
+        return self.feed(self._read(block))
+
+    def feed(self, data):
+        # Tách một khối byte nhận được (từ Serial hoặc socket) thành một lô mẫu
+        data = self._pending + data
+        ir_raw, ir_filtered, used = parse_samples(data)
+        self._pending = data[used:][-MAX_READ_BYTES:]  # không để rác không có xuống dòng tích tụ mãi
+        if self._start is None:
+            self.start_clock()
+
+        now = self.elapsed()
+        n = len(ir_raw)
+        # Rải đều thời điểm các mẫu trong khoảng (lần nhận trước, lần nhận này], tối đa n chu kỳ mẫu;
+        # không bao giờ lùi về trước mẫu cuối của lô trước
+        period = MAX_SAMPLE_PERIOD_SECONDS if self._contiguous else self._period
+        first = max(now - n * period, self._last_elapsed)
+        elapsed = np.linspace(first, now, n + 1)[1:] if n else np.empty(0)
+        if n:
+            if self._contiguous and first > now - n * MAX_SAMPLE_PERIOD_SECONDS:
+                self._period = 0.9 * self._period + 0.1 * (now - first) / n
+            self._last_elapsed = now
+            self._contiguous = True
+        wall_time = datetime.fromtimestamp(self._wall_start + now, self.tz).strftime("%Y-%m-%d %H:%M:%S")
+        return Batch(elapsed, ir_raw, ir_filtered, wall_time)
+
+    def discard(self, seconds):
+        # Đọc bỏ dữ liệu trong `seconds` giây (ổn định tín hiệu) mà không quay vòng
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            self._read(block=True)
+        self._pending = b""
+
+
+def batch_rows(batch):
+    # Các hàng CSV ["Time (real)", "IR Value raw", "IR Value filtered", "Time (s)"] của một lô
+    n = len(batch.elapsed)
+    return zip([batch.wall_time] * n, batch.ir_raw.tolist(), batch.ir_filtered.tolist(), batch.elapsed.tolist())
@@ -0,0 +1,31 @@
+import argparse
+import matplotlib.pyplot as plt
+from ppg_archive import load_span
+
+# Xem nhanh một đoạn tín hiệu PPG [t0, t1] (giây) của một bản ghi dài (.csv hoặc .ppgz)
+# mà không phải đọc cả file, ví dụ:
+#   python src/show_span.py data/data_Cong_12052025.csv 1200 1380
+
+parser = argparse.ArgumentParser(description="Vẽ tín hiệu PPG trong một khoảng thời gian")
+parser.add_argument("recording")
+parser.add_argument("t0", type=float)
+parser.add_argument("t1", type=float)
+args = parser.parse_args()
+
+df = load_span(args.recording, args.t0, args.t1)
+if df.empty:
+    print(f"⚠️ Không có mẫu nào trong khoảng [{args.t0}, {args.t1}] s")
+else:
+    df = df.sort_values(by="Time (s)")
+    label_column = "Label" if "Label" in df.columns else "Label_Detail"
+
+    plt.figure(figsize=(12, 6))
+    for i, column in enumerate(["IR Value raw", "IR Value filtered"]):
+        plt.subplot(2, 1, i + 1)
+        plt.plot(df["Time (s)"], df[column], color="blue" if i == 0 else "red", linewidth=1)
+        plt.title(f"{column} ({args.t0:.0f}s - {args.t1:.0f}s, nhãn: {sorted(df[label_column].unique())})")
+        plt.xlabel("Time (s)")
+        plt.ylabel("IR Value")
+        plt.grid(True)
+    plt.tight_layout()
+    plt.show()
@@ -0,0 +1,110 @@
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+# Chỉ số chất lượng tín hiệu (SQI) tính rẻ theo từng giây ngay khi mẫu đến, để bỏ qua việc tính đặc trưng
+# (AMI, FNN, wavelet, FFT, ...) cho các cửa sổ chỉ toàn nhiễu hoặc không có ngón tay trên cảm biến.
+# Mỗi giây được đánh dấu xấu nếu:
+#   - no_contact: đa số mẫu raw < CONTACT_MIN_RAW (không có ngón tay, giống cảnh báo cũ ir_raw < 50000);
+#   - saturated: đa số mẫu raw >= SATURATION_RAW (ADC 18 bit của MAX30102 bị bão hòa);
+#   - flat: độ lệch chuẩn raw trong giây < FLAT_STD (tín hiệu đứng yên, mất kết nối cảm biến).
+# Một cửa sổ đạt nếu ít nhất MIN_GOOD_FRACTION số giây đạt và nhịp ước lượng (đếm số lần cắt qua trung bình
+# của tín hiệu lọc trong BEAT_CHECK_SECONDS giây cuối) nằm trong BEAT_RATE_RANGE nhịp/phút.
+
+CONTACT_MIN_RAW = 50000
+SATURATION_RAW = 262000
+FLAT_STD = 5.0
+BEAT_RATE_RANGE = (35, 220)
+BEAT_CHECK_SECONDS = 10
+MIN_GOOD_FRACTION = 0.8
+HISTORY_SECONDS = 180
+
+QUALITY_OK = "ok"
+NO_CONTACT = "no_contact"
+SATURATED = "saturated"
+FLAT = "flat"
+IMPLAUSIBLE_RATE = "implausible_rate"
+
+# reason: QUALITY_OK hoặc lý do chính khiến cửa sổ không đạt; beat_rate: nhịp/phút ước lượng (None nếu không tính)
+Quality = namedtuple("Quality", ["ok", "reason", "good_fraction", "beat_rate"])
+
+# Thứ tự cột thống kê của mỗi giây
+_COUNT, _NO_CONTACT, _SATURATED, _SUM, _SUMSQ = range(5)
+
+
+def beat_rate(time_window, filtered_window):
+    # Nhịp/phút ước lượng từ số lần tín hiệu (đã bỏ trôi nền) cắt lên qua 0; None nếu quá ít mẫu
+    if len(filtered_window) < 20 or time_window[-1] <= time_window[0]:
+        return None
+    x = np.asarray(filtered_window, dtype=np.float64)
+    x = x - x.mean()
+    k = max(len(x) // 10, 1)
+    # Bỏ trôi nền bằng trung bình trượt, cắt hai đầu nơi trung bình trượt bị lệch do thiếu mẫu
+    x = (x - np.convolve(x, np.ones(k) / k, mode="same"))[k // 2:len(x) - k // 2]
+    crossings = np.count_nonzero((x[:-1] < 0) & (x[1:] >= 0))
+    duration = time_window[len(time_window) - k // 2 - 1] - time_window[k // 2]
+    return crossings / duration * 60 if duration > 0 else None
+
+
+class SignalQualityTracker:
+    def __init__(self, history_seconds=HISTORY_SECONDS):
+        self.history_seconds = history_seconds
+        self._seconds = OrderedDict()  # giây (int) -> mảng thống kê 5 phần tử
+        self.contact = None            # trạng thái tiếp xúc của lô gần nhất (None: chưa có dữ liệu)
+
+    def update(self, elapsed, ir_raw):
+        # Cộng dồn thống kê theo giây của một lô mẫu (vector hóa, không lặp theo mẫu)
+        if len(elapsed) == 0:
+            return
+        raw = np.asarray(ir_raw, dtype=np.float64)
+        seconds, index = np.unique(np.floor(elapsed).astype(np.int64), return_inverse=True)
+        stats = np.column_stack([
+            np.bincount(index, minlength=len(seconds)),
+            np.bincount(index, weights=raw < CONTACT_MIN_RAW, minlength=len(seconds)),
+            np.bincount(index, weights=raw >= SATURATION_RAW, minlength=len(seconds)),
+            np.bincount(index, weights=raw, minlength=len(seconds)),
+            np.bincount(index, weights=raw * raw, minlength=len(seconds)),
+        ])
+        for second, row in zip(seconds.tolist(), stats):
+            current = self._seconds.get(second)
+            self._seconds[second] = row if current is None else current + row
+        oldest = seconds[-1] - self.history_seconds
+        while self._seconds and next(iter(self._seconds)) < oldest:
+            self._seconds.popitem(last=False)
+        self.contact = bool(np.median(raw) >= CONTACT_MIN_RAW)
+
+    def _second_reasons(self, t_start, t_end):
+        reasons = []
+        for second in range(int(np.floor(t_start)), int(np.floor(t_end)) + 1):
+            row = self._seconds.get(second)
+            if row is None or row[_COUNT] == 0:
+                continue
+            n = row[_COUNT]
+            variance = max(row[_SUMSQ] / n - (row[_SUM] / n) ** 2, 0.0)
+            if row[_NO_CONTACT] > n / 2:
+                reasons.append(NO_CONTACT)
+            elif row[_SATURATED] > n / 2:
+                reasons.append(SATURATED)
+            elif n > 1 and np.sqrt(variance) < FLAT_STD:
+                reasons.append(FLAT)
+            else:
+                reasons.append(QUALITY_OK)
+        return reasons
+
+    def assess(self, t_start, t_end, time_window=None, filtered_window=None):
+        # Đánh giá cửa sổ [t_start, t_end]; time_window/filtered_window (nếu có) dùng cho kiểm tra nhịp
+        reasons = self._second_reasons(t_start, t_end)
+        if not reasons:
+            return Quality(False, NO_CONTACT, 0.0, None)
+        good_fraction = reasons.count(QUALITY_OK) / len(reasons)
+        if good_fraction < MIN_GOOD_FRACTION:
+            bad = [r for r in reasons if r != QUALITY_OK]
+            return Quality(False, max(set(bad), key=bad.count), good_fraction, None)
+
+        rate = None
+        if time_window is not None and len(time_window):
+            lo = np.searchsorted(time_window, time_window[-1] - BEAT_CHECK_SECONDS, side="left")
+            rate = beat_rate(time_window[lo:], filtered_window[lo:])
+            if rate is None or not BEAT_RATE_RANGE[0] <= rate <= BEAT_RATE_RANGE[1]:
+                return Quality(False, IMPLAUSIBLE_RATE, good_fraction, rate)
+        return Quality(True, QUALITY_OK, good_fraction, rate)
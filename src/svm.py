@@ -1,5 +1,3 @@
-import pandas as pd
-import os
 import joblib
 from sklearn.model_selection import train_test_split
 from sklearn.svm import SVC
@@ -7,31 +5,13 @@ from sklearn.metrics import accuracy_score, classification_report, confusion_mat
 from sklearn.preprocessing import StandardScaler
 import seaborn as sns
 import matplotlib.pyplot as plt
-# Tên các thư mục chứa dữ liệu
-time_domain_dir = 'Features_time'
-nonlinear_domain_dir = 'Features_nonlinear'
-wavelet_dir = 'Features_wavelet'
-frequence_dir = 'Features_fourier'
-# Hàm để đọc và kết hợp tất cả các file CSV
-def load_and_combine_all(directory, prefix, drop_cols):
-    all_files = [f for f in os.listdir(directory) if f.startswith(prefix) and f.endswith('.csv')]
-    df_list = []
-    for file in all_files:
-        file_path = os.path.join(directory, file)
-        df = pd.read_csv(file_path)
-        df.columns = df.columns.str.strip().str.replace('\ufeff', '', regex=True)
-        df_dropped = df.drop(columns=drop_cols, errors='ignore')
-        df_list.append(df_dropped)
-    if df_list:
-        combined_df = pd.concat(df_list, ignore_index=True)
-        return combined_df
-    return None
+from feature_store import load_features
 
-# Đọc dữ liệu
-df_thoi_gian_all = load_and_combine_all(time_domain_dir, 'time_data', ['Start Time (s)', 'End Time (s)', 'Label'])
-df_phi_tuyen_all = load_and_combine_all(nonlinear_domain_dir, 'Nonlinear_result_data', ['Time start', 'Time end', 'Label'])
-df_wavelet_all = load_and_combine_all(wavelet_dir, 'Wavelet_result_data', ['Start Time (s)', 'End Time (s)', 'Label'])
-df_tanso_all = load_and_combine_all(frequence_dir, 'FFT_result_data', ['Start Time (s)', 'End Time (s)', 'Label'])
+# Đọc dữ liệu từ kho đặc trưng gộp (feature_store.py), thay cho việc đọc từng file CSV
+df_thoi_gian_all = load_features("time")
+df_phi_tuyen_all = load_features("nonlinear")
+df_wavelet_all = load_features("wavelet")
+df_tanso_all = load_features("fourier")
 
 def plot_confusion_matrix(cm, domain_name, labels=['Alert', 'Drowsy']):
     plt.figure(figsize=(8, 6))  
@@ -96,112 +96,176 @@
 #             print(f"⚠️ File {file_name} không có đầy đủ cột cần thiết!")
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 from scipy.signal import find_peaks
-
-# 🔹 1. Đọc file CSV
-file_path = "data/data_Cong_11062025.csv"  # Đổi thành đường dẫn file của bạn
-df = pd.read_csv(file_path)
-
-# 🔹 2. Kiểm tra dữ liệu
-if "Time (s)" in df.columns and "IR Value filtered" in df.columns and "Label" in df.columns:
-    df = df.drop_duplicates(subset=["Time (s)"]).sort_values(by=["Time (s)"])
-    time = np.array(df["Time (s)"])
-    ir_signal = np.array(df["IR Value filtered"])
-    labels = np.array(df["Label"])
-
-    # 🔹 3. Thông số cửa sổ trượt
-    window_size = 60 #Kích thước cửa sổ (10 giây)
-    step_size = 1# Dịch chuyển mỗi lần 1 giây
-
-    start_time = time[0]
-    end_time = time[-1]
-
-    bpm_results = []
-
-    # 🔹 4. Duyệt qua các cửa sổ trượt
-    for current_start in np.arange(start_time, end_time - window_size, step_size):
-        current_end = current_start + window_size
-        mask = (time >= current_start) & (time <= current_end)
-        time_window = time[mask]
-        ir_signal_window = ir_signal[mask]
-        label_window = labels[mask]
-
-        # Gán nhãn phổ biến nhất trong cửa sổ
-        if len(label_window) > 0:
-            label_counts = pd.Series(label_window).value_counts()
-            dominant_label = label_counts.idxmax()
-        else:
-            dominant_label = "unknown"
-
-        # Lọc dữ liệu trong khoảng [current_start, current_end]
-        mask = (time >= current_start) & (time <= current_end)
-        time_window = time[mask]
-        ir_signal_window = ir_signal[mask]
-
-        if len(time_window) < 2:
-            continue  # Bỏ qua nếu dữ liệu quá ít
-
-        # 🔹 5a. Phát hiện đỉnh PPG (tương ứng với nhịp tim)
-        peaks, _ = find_peaks(ir_signal_window, height=np.mean(ir_signal_window), distance=0.5 * (1 / np.mean(np.diff(time_window))) )
-        # 🔹 5b. Phát hiện đáy PPG
-        valleys, _ = find_peaks(-ir_signal_window, height=-np.mean(ir_signal_window), distance=0.3 * (1 / np.mean(np.diff(time_window))))
-        #valleys = [i for i in valleys if ir_signal_window[i] < 0]
-        rising_times = []
-        for v in valleys:
-            future_peaks = peaks[peaks > v]
-            if len(future_peaks) == 0:
-                continue
-            p = future_peaks[0]  # Lấy đỉnh gần nhất sau đáy
-            t_valley = time_window[v]
-            t_peak = time_window[p]
-            rising_times.append(t_peak - t_valley)
-        # 🔹 5c. Tính khoảng thời gian trung bình giữa các đỉnh
-        if len(peaks) >= 2:
-            peak_times = time_window[peaks]
-            intervals = np.diff(peak_times)
-            avg_interval = np.mean(intervals)
-            std_interval = np.std(intervals)
+from windowing import window_bounds, dominant_labels
+from ppg_archive import read_recording
+
+TIME_FEATURE_COLUMNS = ["BPM", "AVG Interval (s)", "STD Interval (s)", "Amplitude", "Time V2P (s)"]
+
+# "window": chạy lại find_peaks trên từng cửa sổ (cách tính cũ, model_time_domain.pkl được huấn luyện theo cách này)
+# "beats": phát hiện đỉnh/đáy một lần trên toàn bản ghi rồi tổng hợp theo từng cửa sổ bằng tổng tích lũy;
+#          nhanh hơn nhiều nhưng ngưỡng/khoảng cách đỉnh tính trên cả bản ghi nên STD Interval có thể lệch
+#          tới ~17% so với "window" -> chỉ dùng khi chọn rõ (extract_features.py --time-mode beats) và huấn luyện lại
+TIME_FEATURE_MODE = "window"
+
+
+def detect_beats(time, ir_signal, height=None):
+    dt = np.mean(np.diff(time))  # chu kỳ lấy mẫu
+    if height is None:
+        height = np.mean(ir_signal)
+    peaks, _ = find_peaks(ir_signal, height=height, distance=0.5 / dt)
+    valleys, _ = find_peaks(-ir_signal, height=-height, distance=0.3 / dt)
+    return peaks, valleys
+
+
+def beat_window_features(time, ir_signal, peaks, valleys, lo, hi, window_size):
+    # Đặc trưng miền thời gian của mọi cửa sổ [lo, hi) từ các đỉnh/đáy đã phát hiện sẵn.
+    # Mỗi cửa sổ chỉ cần vài phép searchsorted và hiệu của tổng tích lũy: O(1) khấu hao.
+    lo = np.asarray(lo)
+    hi = np.asarray(hi)
+    p_lo = np.searchsorted(peaks, lo)
+    p_hi = np.searchsorted(peaks, hi)
+    v_lo = np.searchsorted(valleys, lo)
+    v_hi = np.searchsorted(valleys, hi)
+    n_peaks = p_hi - p_lo
+    n_valleys = v_hi - v_lo
+
+    def window_sum(values, a, b):
+        cs = np.concatenate([[0.0], np.cumsum(values, dtype=float)])
+        return cs[b] - cs[a]
+
+    # Khoảng cách giữa hai đỉnh liên tiếp cùng nằm trong cửa sổ (trừ trung bình toàn cục để giảm sai số)
+    intervals = np.diff(time[peaks])
+    offset = intervals.mean() if len(intervals) else 0.0
+    centered = intervals - offset
+    n_intervals = n_peaks - 1
+    i_hi = np.maximum(p_hi - 1, p_lo)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_c = window_sum(centered, p_lo, i_hi) / n_intervals
+        var = window_sum(centered ** 2, p_lo, i_hi) / n_intervals - mean_c ** 2
+        avg_interval = np.where(n_peaks >= 2, mean_c + offset, np.nan)
+        std_interval = np.where(n_peaks >= 2, np.sqrt(np.maximum(var, 0.0)), np.nan)
+
+        amplitude = np.where(
+            (n_peaks > 0) & (n_valleys > 0),
+            window_sum(ir_signal[peaks], p_lo, p_hi) / n_peaks - window_sum(ir_signal[valleys], v_lo, v_hi) / n_valleys,
+            np.nan)
+
+        # Thời gian lên: từ mỗi đáy tới đỉnh đầu tiên sau nó, chỉ tính khi đỉnh đó vẫn nằm trong cửa sổ
+        next_peak = np.searchsorted(peaks, valleys, side="right")
+        has_peak = next_peak < len(peaks)
+        next_peak_index = np.where(has_peak, peaks[np.minimum(next_peak, len(peaks) - 1)], len(ir_signal))
+        rise = np.where(has_peak, time[np.minimum(next_peak_index, len(time) - 1)] - time[valleys], 0.0)
+        r_hi = np.clip(np.searchsorted(next_peak_index, hi), v_lo, v_hi)
+        n_rise = r_hi - v_lo
+        avg_rising_time = np.where(n_rise > 0, window_sum(rise, v_lo, r_hi) / n_rise, np.nan)
+
+    bpm = (n_peaks / window_size) * 60  # Chuyển đổi sang BPM
+    return np.column_stack([bpm, avg_interval, std_interval, amplitude, avg_rising_time])
+
+
+def window_time_features(time_window, ir_signal_window, window_size):
+    # Cách tính cũ: phát hiện đỉnh/đáy riêng cho một cửa sổ
+    peaks, valleys = detect_beats(time_window, ir_signal_window)
+    n = len(ir_signal_window)
+    return beat_window_features(time_window, ir_signal_window, peaks, valleys, [0], [n], window_size)[0]
+
+
+class BeatTracker:
+    # Phát hiện nhịp tăng dần cho luồng trực tiếp: cửa sổ 60 giây trượt mỗi giây nên chỉ cần
+    # chạy find_peaks trên phần đuôi mới (kèm một đoạn chồng lấn `margin_seconds` để ghép nối).
+    def __init__(self, margin_seconds=2.0):
+        self.margin_seconds = margin_seconds
+        self.peaks = np.empty(0, dtype=np.int64)    # chỉ số mẫu tuyệt đối
+        self.valleys = np.empty(0, dtype=np.int64)
+        self.end_index = None
+
+    def _merge(self, old, new, boundary, start_index, distance):
+        old = old[(old >= start_index) & (old < boundary)]
+        new = new[new >= boundary]
+        # Giữ ràng buộc khoảng cách tối thiểu của find_peaks tại điểm ghép
+        if len(old) and len(new) and new[0] - old[-1] < distance:
+            new = new[1:]
+        return np.concatenate([old, new])
+
+    def update(self, time_window, ir_signal_window, start_index):
+        end_index = start_index + len(ir_signal_window)
+        dt = np.mean(np.diff(time_window))
+        margin = int(self.margin_seconds / dt)
+        height = np.mean(ir_signal_window)
+
+        if self.end_index is None or self.end_index - margin < start_index or self.end_index > end_index:
+            region_start = start_index
         else:
-            avg_interval = np.nan  # Không đủ đỉnh để tính
-            std_interval = np.nan
-
-        if len(peaks) > 0 and len(valleys) > 0:
-            avg_peak = np.mean(ir_signal_window[peaks])
-            avg_valley = np.mean(ir_signal_window[valleys])
-            amplitude = avg_peak - avg_valley
-        else:
-            amplitude = np.nan
-
-        if rising_times:
-            avg_rising_time = np.mean(rising_times)
+            region_start = self.end_index - margin
+        offset = region_start - start_index
+        peaks, valleys = detect_beats(time_window[offset:], ir_signal_window[offset:], height=height)
+        peaks = peaks + region_start
+        valleys = valleys + region_start
+
+        if region_start == start_index:
+            self.peaks, self.valleys = peaks, valleys
         else:
-            avg_rising_time = np.nan
-        
-        
-        
-        # Tính BPM
-        num_beats = len(peaks)
-        bpm = (num_beats / window_size) * 60  # Chuyển đổi sang BPM
-
-        bpm_results.append([current_start, current_end, bpm, avg_interval, std_interval, amplitude, avg_rising_time, dominant_label])
-
-        # # 🔹 6. Vẽ tín hiệu + nhịp tim
-        # plt.figure(figsize=(10, 4))
-        # plt.plot(time_window, ir_signal_window, label="IR Signal", color="b")
-        # plt.scatter(time_window[peaks], ir_signal_window[peaks], color="r", marker="o", label="Detected Peaks")
-        # plt.scatter(time_window[valleys], ir_signal_window[valleys], color="y", marker="o", label="Detected Valleys")
-        # plt.xlabel("Time (s)")
-        # plt.ylabel("IR Value filtered")
-        # plt.title(f"PPG Signal & Heart Rate: {bpm:.1f} BPM ({current_start:.1f}s - {current_end:.1f}s)")
-        # plt.legend()
-        # plt.grid()
-        # plt.show()
-
-    # 🔹 7. Lưu BPM vào file CSV
-    bpm_df = pd.DataFrame(bpm_results, columns=["Start Time (s)", "End Time (s)", "BPM", "AVG Interval (s)", "STD Interval (s)", "Amplitude", "Time V2P (s)", "Label"])
-    bpm_df.to_csv("heart_rate_results.csv", index=False)
-
-    print("✅ Đã lưu nhịp tim trung bình vào 'heart_rate_results.csv'")
-else:
-    print("⚠️ Cột dữ liệu không đúng! Hãy kiểm tra lại file CSV.")
\ No newline at end of file
+            boundary = region_start + margin // 2
+            self.peaks = self._merge(self.peaks, peaks, boundary, start_index, 0.5 / dt)
+            self.valleys = self._merge(self.valleys, valleys, boundary, start_index, 0.3 / dt)
+        self.end_index = end_index
+        return self.peaks - start_index, self.valleys - start_index
+
+    def window_features(self, time_window, ir_signal_window, start_index, window_size):
+        peaks, valleys = self.update(time_window, ir_signal_window, start_index)
+        n = len(ir_signal_window)
+        return beat_window_features(time_window, ir_signal_window, peaks, valleys, [0], [n], window_size)[0]
+
+
+def extract_time_features(time, ir_signal, labels, window_size=60, step_size=1, mode=None, windows=None):
+    # `windows`: slice chọn một phần danh sách cửa sổ (để chia việc cho nhiều tiến trình)
+    mode = mode or TIME_FEATURE_MODE
+    starts, lo, hi = window_bounds(time, window_size, step_size)
+    dominant = dominant_labels(labels, lo, hi, ties="first")
+    if windows is not None:
+        starts, lo, hi, dominant = starts[windows], lo[windows], hi[windows], dominant[windows]
+    keep = hi - lo >= 2  # Bỏ qua cửa sổ quá ít dữ liệu
+    starts, lo, hi, dominant = starts[keep], lo[keep], hi[keep], dominant[keep]
+
+    if mode == "beats":
+        peaks, valleys = detect_beats(time, ir_signal)
+        features = beat_window_features(time, ir_signal, peaks, valleys, lo, hi, window_size)
+    elif mode == "window":
+        features = np.array([window_time_features(time[a:b], ir_signal[a:b], window_size)
+                             for a, b in zip(lo, hi)]).reshape(-1, len(TIME_FEATURE_COLUMNS))
+    else:
+        raise ValueError(f"Chế độ miền thời gian không hợp lệ: {mode}")
+
+    bpm_df = pd.DataFrame(features, columns=TIME_FEATURE_COLUMNS)
+    bpm_df.insert(0, "Start Time (s)", starts)
+    bpm_df.insert(1, "End Time (s)", starts + window_size)
+    bpm_df["Label"] = dominant
+    return bpm_df
+
+
+if __name__ == "__main__":
+    # 🔹 1. Đọc file CSV
+    file_path = "data/data_Cong_11062025.csv"  # Đổi thành đường dẫn file của bạn
+    df = read_recording(file_path)
+
+    # 🔹 2. Kiểm tra dữ liệu
+    if "Time (s)" in df.columns and "IR Value filtered" in df.columns and "Label" in df.columns:
+        df = df.drop_duplicates(subset=["Time (s)"]).sort_values(by=["Time (s)"])
+        time = np.array(df["Time (s)"])
+        ir_signal = np.array(df["IR Value filtered"])
+        labels = np.array(df["Label"])
+
+        # 🔹 3. Thông số cửa sổ trượt
+        window_size = 60 #Kích thước cửa sổ (60 giây)
+        step_size = 1# Dịch chuyển mỗi lần 1 giây
+
+        # 🔹 4. Tính đặc trưng cho tất cả các cửa sổ trượt
+        bpm_df = extract_time_features(time, ir_signal, labels, window_size, step_size)
+
+        # 🔹 5. Lưu BPM vào file CSV
+        bpm_df.to_csv("heart_rate_results.csv", index=False)
+
+        print("✅ Đã lưu nhịp tim trung bình vào 'heart_rate_results.csv'")
+    else:
+        print("⚠️ Cột dữ liệu không đúng! Hãy kiểm tra lại file CSV.")
@@ -0,0 +1,68 @@
+import numpy as np
+
+# Cửa sổ trượt dùng chung cho các script trích xuất đặc trưng offline.
+# Thay vì tạo mask (time >= start) & (time <= end) trên toàn bản ghi cho mỗi cửa sổ (O(N)),
+# chỉ số đầu/cuối của mọi cửa sổ được tính một lần bằng np.searchsorted
+# và mỗi cửa sổ chỉ là một slice (view, không sao chép) của mảng gốc.
+
+
+def window_bounds(time, window_size, step_size, start_time=None, end_time=None):
+    # current_start giống hệt np.arange(start_time, end_time - window_size, step_size) trong các script cũ;
+    # [lo, hi) tương đương mask (time >= current_start) & (time <= current_start + window_size)
+    # với `time` đã sắp xếp tăng dần.
+    if start_time is None:
+        start_time = time[0]
+    if end_time is None:
+        end_time = time[-1]
+    starts = np.arange(start_time, end_time - window_size, step_size)
+    lo = np.searchsorted(time, starts, side="left")
+    hi = np.searchsorted(time, starts + window_size, side="right")
+    return starts, lo, hi
+
+
+def index_windows(n_samples, window_length, stride):
+    # Cửa sổ theo số mẫu (như nonlinear.py): [lo, hi) với hi = lo + window_length
+    lo = np.arange(0, n_samples - window_length + 1, stride)
+    return lo, lo + window_length
+
+
+def dominant_labels(labels, lo, hi, default="unknown", ties="smallest"):
+    # Nhãn xuất hiện nhiều nhất trong mỗi cửa sổ [lo, hi), tính bằng tổng tích lũy theo từng nhãn.
+    # Khi hòa: ties="smallest" chọn nhãn nhỏ nhất (giống pd.Series.mode()[0], wavelet.py);
+    # ties="first" chọn nhãn xuất hiện trước trong cửa sổ (giống value_counts().idxmax(), time_domain.py
+    # và Fourier_transform.py), vd. [5, 5, 3, 3] -> 5.
+    values, codes = np.unique(np.asarray(labels), return_inverse=True)
+    codes = codes.reshape(-1)
+    counts = np.zeros((len(codes) + 1, len(values)), dtype=np.int64)
+    counts[np.arange(1, len(codes) + 1), codes] = 1
+    np.cumsum(counts, axis=0, out=counts)
+    window_counts = counts[hi] - counts[lo]
+
+    if ties == "first":
+        # Vị trí xuất hiện đầu tiên (>= lo) của từng nhãn; nhãn hòa có vị trí nhỏ nhất thắng
+        first_seen = np.full(window_counts.shape, len(codes), dtype=np.int64)
+        for k in range(len(values)):
+            positions = np.flatnonzero(codes == k)
+            at = np.searchsorted(positions, lo)
+            found = at < len(positions)
+            first_seen[found, k] = positions[at[found]]
+        tied = window_counts == window_counts.max(axis=1, keepdims=True)
+        best = np.argmin(np.where(tied, first_seen, len(codes) + 1), axis=1)
+    elif ties == "smallest":
+        best = np.argmax(window_counts, axis=1)
+    else:
+        raise ValueError(f"Cách chọn nhãn khi hòa không hợp lệ: {ties}")
+    result = values[best].astype(object)
+    result[hi <= lo] = default
+    return result
+
+
+def iter_windows(time, window_size, step_size, labels=None, ties="smallest"):
+    # Sinh (current_start, current_end, slice cửa sổ, nhãn chiếm ưu thế) cho từng cửa sổ
+    starts, lo, hi = window_bounds(time, window_size, step_size)
+    if labels is None:
+        dominant = [None] * len(starts)
+    else:
+        dominant = dominant_labels(labels, lo, hi, ties=ties)
+    for current_start, a, b, label in zip(starts, lo, hi, dominant):
+        yield current_start, current_start + window_size, slice(a, b), label
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Các script trong src/ import lẫn nhau trực tiếp (chạy bằng python src/x.py), nên test cũng thêm src/ vào path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
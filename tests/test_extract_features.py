@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+import pytest
+
+import extract_features
+import nonlinear
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+def jittered_recording(seconds=150, rate=25.0, seed=0):
+    # Nhãn thời gian dao động quanh 1 / rate như khi gắn thời gian ở máy tính
+    rng = np.random.default_rng(seed)
+    time = np.cumsum(1 / rate + rng.normal(0, 0.006, int(seconds * rate)).clip(-0.02, 0.02))
+    ir_signal = 1000 * np.sin(2 * np.pi * 1.2 * time) + rng.normal(0, 20, len(time))
+    return time, ir_signal, np.zeros(len(time), dtype=int)
+
+
+def check_planned_matches_extracted(monkeypatch, time, ir_signal, labels, rate):
+    # Đặc trưng giả = số mẫu của cửa sổ: chỉ kiểm tra cách chia cửa sổ, không tính đặc trưng thật
+    monkeypatch.setattr(nonlinear, "nonlinear_window_features", lambda signal, **options: [len(signal)] * 5)
+    planned = extract_features.count_windows("nonlinear", time, rate)
+    df = nonlinear.extract_nonlinear_features(time, ir_signal, labels, rate=rate)
+
+    assert len(df) == planned
+    if rate is not None:
+        # Cửa sổ đúng 60 giây, trượt đúng 1 giây trên lưới đều
+        assert (df["AMI"] == int(60 * rate)).all()
+        assert np.allclose(np.diff(df["Time start"]), 1.0)
+
+
+@pytest.mark.parametrize("rate", [None, 5.0, 15.0, 20.0])
+def test_planned_nonlinear_windows_match_extraction(monkeypatch, rate):
+    check_planned_matches_extracted(monkeypatch, *jittered_recording(), rate)
+
+
+@pytest.mark.parametrize("name, rate", [("data_15042025.csv", 15.0), ("data_Cong_14052025.csv", 5.0),
+                                        ("data_Cong_05062025.csv", 20.0)])
+def test_planned_nonlinear_windows_match_extraction_on_recordings(monkeypatch, name, rate):
+    path = os.path.join(DATA_DIR, name)
+    if not os.path.exists(path):
+        pytest.skip(f"thiếu bản ghi {name}")
+    time, ir_signal, labels, _ = extract_features.load_recording(path)
+    check_planned_matches_extracted(monkeypatch, time, ir_signal, labels, rate)
+
+
+def test_duplicate_recording_names_are_rejected(tmp_path):
+    files = []
+    for directory in ("data", "predict_data"):
+        os.makedirs(tmp_path / directory)
+        path = tmp_path / directory / "data_01012025.csv"
+        path.write_text(f"Time (s),IR Value filtered,Label\n0,{len(files)},0\n")
+        files.append(str(path))
+    with pytest.raises(ValueError, match="data_01012025"):
+        extract_features.plan_jobs(files, ["time"], str(tmp_path / "out"), 10, False)
+    # Cùng một file chỉ ra hai lần không phải là trùng tên
+    extract_features.check_unique_stems([files[0], files[0].replace("data_01", "./data_01")])
@@ -0,0 +1,41 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ppg_archive import PPGArchive, convert_csv, read_recording
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+def check_round_trip(csv_path, output_dir):
+    archive_path = convert_csv(csv_path, str(output_dir))
+    expected = pd.read_csv(csv_path)
+    expected = expected[[c for c in expected.columns if not c.startswith("Unnamed")]]
+    actual = read_recording(archive_path)
+
+    # Thời gian phải khớp đúng từng bit: sai lệch 1e-13 cũng đủ làm window_bounds đổi biên cửa sổ
+    assert np.array_equal(actual["Time (s)"].to_numpy(), expected["Time (s)"].to_numpy())
+    pd.testing.assert_frame_equal(actual, expected, check_exact=True)
+    return archive_path
+
+
+@pytest.mark.parametrize("name", ["data_04042025.csv", "data_31032025.csv", "data_Cong_12052025.csv",
+                                  "data_Cong_05062025.csv"])
+def test_archive_reads_back_like_csv(tmp_path, name):
+    check_round_trip(os.path.join(DATA_DIR, name), tmp_path)
+
+
+def test_archive_time_needs_full_precision(tmp_path):
+    # Thời gian ghi đủ 17 chữ số (time.time()) không biểu diễn được bằng tick: phải lưu nguyên float64
+    rng = np.random.default_rng(0)
+    time = np.cumsum(0.04 + rng.normal(0, 0.005, 500))
+    df = pd.DataFrame({"Time (real)": "2025-05-12 00:46:40", "IR Value raw": 120000 + np.arange(500),
+                       "IR Value filtered": rng.integers(-2000, 2000, 500), "Time (s)": time, "Label": 0})
+    csv_path = tmp_path / "data_full_precision.csv"
+    df.to_csv(csv_path, index=False)
+
+    archive_path = check_round_trip(str(csv_path), tmp_path)
+    with PPGArchive(archive_path) as archive:
+        assert "scale" not in archive.columns["Time (s)"]
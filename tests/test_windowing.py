@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+
+from windowing import dominant_labels
+
+
+def test_dominant_labels_tie_breaking_matches_pandas():
+    # ties="first" như value_counts().idxmax() (time_domain.py, Fourier_transform.py),
+    # ties="smallest" như mode()[0] (wavelet.py)
+    rng = np.random.default_rng(0)
+    labels = rng.integers(0, 3, 400)
+    lo = rng.integers(0, len(labels), 300)
+    hi = np.minimum(lo + rng.integers(1, 8, 300), len(labels))
+
+    first = dominant_labels(labels, lo, hi, ties="first")
+    smallest = dominant_labels(labels, lo, hi)
+    for i, (a, b) in enumerate(zip(lo, hi)):
+        window = pd.Series(labels[a:b])
+        assert first[i] == window.value_counts().idxmax()
+        assert smallest[i] == window.mode()[0]
+
+    assert dominant_labels(np.array([5, 5, 3, 3]), np.array([0]), np.array([4]), ties="first")[0] == 5
+    assert dominant_labels(np.array([5, 5, 3, 3]), np.array([0]), np.array([4]))[0] == 3